@@ -0,0 +1,428 @@
+import asyncio
+import json
+import random
+import socket
+import ssl
+import time
+import urllib.error
+
+from metrics import new_timing, add_phase
+from result_cache import normalize_command
+from server_health import read_only
+from tsmrest import TsmRest
+
+# asyncio client for the OC REST API (web app backend, dashboards): one event loop serves many calls at the same
+# time without a thread per call. Same results as TsmRest: the REST responses are parsed by a TsmRest instance
+# (parse_responses()), so parsed_result, error records, metrics, cache and circuit breaker are the same.
+#
+#     client = AsyncTsmRest("tsmOC.company.com", "11090")
+#     parsed_result, raw_result = await client.query(['TSM01', 'TSM02'], "admin", "password", "q stgpool")
+#     await client.close()
+
+
+class AsyncOcConnectionPool:
+    # asyncio version of OcConnectionPool (oc_transport.py): keep-alive HTTPS connections (asyncio streams)
+    # to one OC, max_connections open at the same time. Same statistics and exceptions (HTTPError, URLError)
+
+    def __init__(self, oc_address, oc_port, max_connections=20):
+        self.oc_address = oc_address
+        self.oc_port = int(oc_port)
+        self.max_connections = max_connections
+
+        # Ignores cert warnings (CERT_NONE), like OcConnectionPool
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+        self._idle = []      # Idle connections (reader, writer), last used on top
+        self._slots = None   # asyncio.Semaphore, created in the running event loop
+
+        self.stats = {'requests': 0, 'new_connections': 0, 'reused_connections': 0, 'retries': 0,
+                      'closed_connections': 0}
+
+    async def _new_connection(self, timing=None):
+        # TCP connect + TLS handshake (phase 'connect': asyncio does both in one step)
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection(self.oc_address, self.oc_port, ssl=self.ssl_context,
+                                                           server_hostname=self.oc_address)
+        except OSError as e:
+            raise urllib.error.URLError(e)
+
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        add_phase(timing, 'connect', time.perf_counter() - start)
+        self.stats['new_connections'] += 1
+        return reader, writer
+
+    def _close(self, connection):
+        connection[1].close()
+        self.stats['closed_connections'] += 1
+
+    async def _request(self, connection, path, body, headers, timing=None):
+        # Send the request, read the response. Returns tuple (status, reason, body, keep_alive)
+        reader, writer = connection
+        request_head = [f"POST {path} HTTP/1.1", f"Host: {self.oc_address}:{self.oc_port}",
+                        f"Content-Length: {len(body)}"]
+        request_head += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(('\r\n'.join(request_head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+        # Phase 'wait': until the status line (the OC waits for the TSM server)
+        start = time.perf_counter()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("The OC closed the connection")
+        add_phase(timing, 'wait', time.perf_counter() - start)
+
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        start = time.perf_counter()
+        keep_alive = version == 'HTTP/1.1' and response_headers.get('connection', '').lower() != 'close'
+        if 'chunked' in response_headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass  # Trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            response_body = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            response_body = await reader.readexactly(int(response_headers['content-length']))
+        else:
+            response_body = await reader.read()
+            keep_alive = False
+        add_phase(timing, 'read', time.perf_counter() - start)
+
+        return int(status), reason, response_body, keep_alive
+
+    # End of function _request()
+
+    async def _send(self, path, body, headers, timing=None):
+        # Returns tuple (status, reason, body). A stale idle connection is replaced by a new one (once)
+        reused = bool(self._idle)
+        connection = self._idle.pop() if reused else await self._new_connection(timing)
+        self.stats['requests'] += 1
+        if reused:
+            self.stats['reused_connections'] += 1
+        if timing is not None:
+            timing['reused'] = reused
+            timing['bytes_sent'] += len(body)
+
+        try:
+            status, reason, response_body, keep_alive = await self._request(connection, path, body, headers, timing)
+
+        # The OC closed the keep-alive connection while it was idle: retry once on a new connection
+        except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
+            self._close(connection)
+            if not reused:
+                raise
+            self.stats['retries'] += 1
+            if timing is not None:
+                timing['reused'] = False
+            connection = await self._new_connection(timing)
+            try:
+                status, reason, response_body, keep_alive = await self._request(connection, path, body, headers,
+                                                                                timing)
+            except BaseException:
+                self._close(connection)
+                raise
+
+        except BaseException:  # Also a timeout (task cancelled): the connection is in an unknown state
+            self._close(connection)
+            raise
+
+        if keep_alive:
+            self._idle.append(connection)
+        else:
+            self._close(connection)
+        return status, reason, response_body
+
+    # End of function _send()
+
+    async def post(self, path, body, headers, timeout, timing=None):
+        # Send a POST request to the OC, returns the response body (bytes)
+        # HTTP status >= 400 raises urllib.error.HTTPError, no reply within 'timeout' secs raises socket.timeout
+        # Waiting for a free connection (max_connections) is not part of the timeout
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+
+        start = time.perf_counter()
+        async with self._slots:
+            add_phase(timing, 'queue', time.perf_counter() - start)
+            try:
+                status, reason, response_body = await asyncio.wait_for(self._send(path, body, headers, timing),
+                                                                       timeout)
+            except asyncio.TimeoutError:
+                # Same exception as a blocking socket (before Python 3.11 asyncio has its own TimeoutError)
+                raise socket.timeout("timed out")
+
+        if timing is not None:
+            timing['bytes_received'] += len(response_body)
+        if status >= 400:
+            url = f"https://{self.oc_address}:{self.oc_port}{path}"
+            raise urllib.error.HTTPError(url, status, reason, None, None)
+        return response_body
+
+    async def close(self):
+        # Close all idle connections
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            self._close(connection)
+
+# End of class
+
+
+class AsyncTsmRest:
+    # asyncio client with the semantics of TsmRest.run_command() / query() / run_commands()
+    # Concurrency: all calls of this client share max_connections connections to the OC (no threads)
+    # api: the TsmRest instance that parses the responses and has the settings (request_timeout, command_retries,
+    # cache, health, metrics). Default: a new TsmRest(oc_address, oc_port)
+
+    max_connections = 20  # Max number of open HTTPS connections to the OC
+    coalesce_requests = True  # Identical commands in flight at the same time share one REST call
+    thread_decode_bytes = 65536  # Larger responses are decoded in a thread, not in the event loop
+
+    def __init__(self, oc_address, oc_port, api=None):
+        self.api = api if api is not None else TsmRest(oc_address, oc_port)
+        self.pool = AsyncOcConnectionPool(oc_address, oc_port, self.max_connections)
+        self.tsm_servers = []
+        self.raw_result = []
+        self.parsed_result = {}
+
+        self._in_flight = {}  # Request key -> asyncio.Future with the response (see fetch_response())
+        self.coalesce_stats = {'calls': 0, 'shared': 0}
+
+    @property
+    def metrics(self):
+        return self.api.metrics
+
+    @property
+    def health(self):
+        return self.api.health
+
+    @property
+    def pool_stats(self):
+        return dict(self.pool.stats)
+
+    async def run_command(self, tsm_servers, tsm_user, tsm_pass, tsm_command, deadline=None):
+        # Same as TsmRest.run_command(): self.parsed_result and self.raw_result are set
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+        self.tsm_servers = tsm_servers
+        self.parsed_result, self.raw_result = await self.query(tsm_servers, tsm_user, tsm_pass, tsm_command, deadline)
+
+    async def query(self, tsm_servers, tsm_user, tsm_pass, tsm_command, deadline=None):
+        # Same as TsmRest.query(): returns tuple (parsed_result, raw_result). Pages (page_size) are not used
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+        if deadline is None:
+            deadline = self.api.command_deadline
+
+        timings = [new_timing() for tsm_server in tsm_servers]
+        responses = (await self.fetch_matrix(tsm_servers, tsm_user, tsm_pass, [tsm_command], deadline, [timings]))[0]
+
+        # Parsing is CPU work: in a thread, the event loop keeps serving other requests
+        return await asyncio.to_thread(self.api.parse_responses, tsm_servers, tsm_command, responses, timings)
+
+    async def run_commands(self, tsm_servers, tsm_user, tsm_pass, tsm_commands, deadline=None):
+        # Same as TsmRest.run_commands(): returns {name (or command): parsed_result}
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+        if isinstance(tsm_commands, str):
+            tsm_commands = [tsm_commands]
+        if not isinstance(tsm_commands, dict):
+            tsm_commands = {tsm_command: tsm_command for tsm_command in tsm_commands}
+        if deadline is None:
+            deadline = self.api.command_deadline
+
+        timings = [[new_timing() for tsm_server in tsm_servers] for tsm_command in tsm_commands]
+        responses = await self.fetch_matrix(tsm_servers, tsm_user, tsm_pass, list(tsm_commands.values()), deadline,
+                                            timings)
+
+        results = {}
+        for (name, tsm_command), command_responses, command_timings in zip(tsm_commands.items(), responses, timings):
+            parsed_result, raw_result = await asyncio.to_thread(self.api.parse_responses, tsm_servers, tsm_command,
+                                                                command_responses, command_timings)
+            results[name] = parsed_result
+        return results
+
+    async def fetch_matrix(self, tsm_servers, tsm_user, tsm_pass, tsm_commands, deadline=None, timings=None):
+        # Same as TsmRest.fetch_matrix(): list per command of tuples (raw_rest_reply, exception_msg)
+        deadline_msg = f"ERROR: Deadline exceeded: no reply within {deadline} secs"
+        responses = [[(None, deadline_msg)] * len(tsm_servers) for tsm_command in tsm_commands]
+
+        tasks = {}
+        for command_index, tsm_command in enumerate(tsm_commands):
+            retries = self.api.command_retries if read_only(tsm_command) else 0
+            for server_index, tsm_server in enumerate(tsm_servers):
+                timing = timings[command_index][server_index] if timings is not None else None
+                task = asyncio.ensure_future(self.fetch(tsm_server, tsm_user, tsm_pass, tsm_command, timing, retries))
+                tasks[task] = (command_index, server_index)
+
+        if tasks:
+            done, not_done = await asyncio.wait(tasks, timeout=deadline)
+            for task in not_done:
+                task.cancel()  # Late TSM servers: the call is abandoned, its connection closed
+            for task in done:
+                command_index, server_index = tasks[task]
+                responses[command_index][server_index] = task.result()
+
+        return responses
+
+    # End of function fetch_matrix()
+
+    async def fetch(self, tsm_server, tsm_user, tsm_pass, tsm_command, timing=None, retries=0):
+        # Same as TsmRest.fetch(): returns tuple (raw_rest_reply, exception_msg)
+        api = self.api
+        if timing is not None:
+            timing['start'] = time.perf_counter()
+
+        for attempt in range(retries + 1):
+            try:
+                http_response, source = await self.fetch_response(tsm_server, tsm_user, tsm_pass, tsm_command, timing)
+                start = time.perf_counter()
+                if len(http_response) > self.thread_decode_bytes:
+                    raw_rest_reply = await asyncio.to_thread(json.loads, http_response)  # The event loop keeps running
+                else:
+                    raw_rest_reply = json.loads(http_response)
+                add_phase(timing, 'decode', time.perf_counter() - start)
+                if timing is not None:
+                    timing['end'] = time.perf_counter()
+
+                if api.cache is not None and source == 'rest':
+                    api.cache.put(api.oc_key, tsm_server, api.user_key(tsm_user, tsm_pass), tsm_command, http_response)
+
+                return raw_rest_reply, ''
+
+            except Exception as e:
+                if attempt < retries and api.retryable_error(e):
+                    if timing is not None:
+                        timing['retries'] += 1
+                    await asyncio.sleep(random.uniform(0, min(api.retry_max_delay, api.retry_backoff * 2 ** attempt)))
+                    continue
+
+                if timing is not None:
+                    timing['end'] = time.perf_counter()
+                return None, api.exception_message(e, tsm_user)
+
+    # End of function fetch()
+
+    async def fetch_response(self, tsm_server, tsm_user, tsm_pass, tsm_command, timing=None):
+        # Same as TsmRest.fetch_response(): tuple (http_response, source 'cache' / 'shared' / 'rest')
+        api = self.api
+        user_key = api.user_key(tsm_user, tsm_pass)
+
+        if api.cache is not None:
+            http_response = api.cache.get(api.oc_key, tsm_server, user_key, tsm_command)
+            if http_response is not None:
+                if timing is not None:
+                    timing['source'] = 'cache'
+                return http_response, 'cache'
+
+        if not self.coalesce_requests:
+            http_response = await self.post_command(tsm_server, tsm_user, tsm_pass, tsm_command, timing)
+            if timing is not None:
+                timing['source'] = 'rest'
+            return http_response, 'rest'
+
+        # Identical requests in flight share one REST call (same key as TsmRest.single_flight)
+        key = (tsm_server.upper(), user_key, normalize_command(tsm_command))
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesce_stats['shared'] += 1
+            start = time.perf_counter()
+            http_response = await asyncio.shield(future)
+            add_phase(timing, 'wait', time.perf_counter() - start)
+            if timing is not None:
+                timing['source'] = 'shared'
+            return http_response, 'shared'
+
+        self.coalesce_stats['calls'] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            http_response = await self.post_command(tsm_server, tsm_user, tsm_pass, tsm_command, timing)
+            future.set_result(http_response)
+        except asyncio.CancelledError:
+            future.set_exception(TimeoutError("shared request cancelled"))
+            future.exception()  # Retrieved: no warning if nobody shared the call
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+        if timing is not None:
+            timing['source'] = 'rest'
+        return http_response, 'rest'
+
+    # End of function fetch_response()
+
+    async def post_command(self, tsm_server, tsm_user, tsm_pass, tsm_command, timing=None):
+        # Same as TsmRest.post_command(): circuit breaker, adaptive timeout (see server_health.py), rate limits
+        api = self.api
+        url_path, request_header = api.prepare_request(tsm_server, tsm_user, tsm_pass)
+        timeout = api.request_timeout
+        if api.health is not None:
+            api.health.check(tsm_server)
+            timeout = api.health.timeout(tsm_server, tsm_command, api.request_timeout)
+
+        if timing is None:
+            timing = new_timing()  # For the 'queue' phase
+        try:
+            await self.throttle(timing)
+            queued = timing['phases'].get('queue', 0.0)
+            start = time.perf_counter()
+            http_response = await self.pool.post(url_path, tsm_command.encode(), request_header, timeout, timing)
+
+        except Exception as e:
+            if api.health is None:
+                raise
+            raise api.record_failure(tsm_server, tsm_command, e, timeout)
+
+        # Cancelled (deadline of fetch_matrix(), client gone): the probe of a half-open circuit is released
+        except BaseException:
+            if api.health is not None:
+                api.health.release(tsm_server)
+            raise
+
+        # Duration without the wait for a free connection (see TsmRest.post_command())
+        if api.health is not None:
+            duration = time.perf_counter() - start - (timing['phases'].get('queue', 0.0) - queued)
+            api.health.success(tsm_server, tsm_command, duration)
+        return http_response
+
+    # End of function post_command()
+
+    async def throttle(self, timing=None):
+        # Same as TsmRest.throttle() (api.rate_limits), the event loop keeps running while waiting for the tokens
+        if self.api.rate_limits:
+            wait = max(bucket.reserve() for bucket in self.api.rate_limits)
+            if wait:
+                await asyncio.sleep(wait)
+            add_phase(timing, 'throttle', wait)
+
+    async def close(self):
+        await self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+# End of class
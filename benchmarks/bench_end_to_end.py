@@ -0,0 +1,166 @@
+# Benchmark: TsmRest end to end against the local mock OC (benchmarks/mock_oc.py)
+# Phases: fetch (REST call + JSON decode), parse_raw_data, fix_value, run_command, stream_command,
+# create_report XLSX / XLSX streaming / CSV / HTML
+# Every phase reports throughput, latency percentiles (per call) and peak memory (tracemalloc, separate run)
+#
+# Usage: python benchmarks/bench_end_to_end.py [--rows 5000] [--servers 4] [--repeat 5] [--latency 0.02]
+# Catch regressions: save a baseline, then compare (exit code 1 if a phase is slower than the tolerance)
+#     python benchmarks/bench_end_to_end.py --save baseline.json
+#     python benchmarks/bench_end_to_end.py --compare baseline.json --tolerance 0.25
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tsmrest import TsmRest
+from mock_oc import MockOc
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of a sorted list
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def measure(name, function, repeat, units):
+    # Run function 'repeat' times (output hidden), then once more with tracemalloc for the peak memory
+    # units: number of rows/values handled by one call, for the throughput
+    durations = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    durations.sort()
+    return {'phase': name,
+            'throughput': units * repeat / sum(durations),
+            'p50_ms': percentile(durations, 50) * 1000,
+            'p90_ms': percentile(durations, 90) * 1000,
+            'p99_ms': percentile(durations, 99) * 1000,
+            'peak_mb': peak_memory / 1024 / 1024}
+
+
+def run_benchmark(args, port, tmp_dir):
+    servers = [f'TSM{i:02}' for i in range(args.servers)]
+    rows = args.rows * args.servers
+    command = "select * from nodes"
+
+    my_api = TsmRest("localhost", str(port))
+    my_api.max_workers = args.servers
+    my_api.coalesce_requests = False
+
+    raw_rest_reply, exception_msg = my_api.fetch(servers[0], "admin", "password", command)
+    if raw_rest_reply is None:
+        raise RuntimeError(f"Mock OC did not reply: {exception_msg}")
+    values = [value for item in raw_rest_reply[0][0]['items'] for value in item.values()]
+
+    def parse():
+        my_api.parsed_result = {}
+        my_api.parse_raw_data(raw_rest_reply, servers[0], command)
+
+    def fix_values():
+        for value in values:
+            TsmRest.fix_value(value)
+
+    def stream():
+        for row in my_api.stream_command(servers, "admin", "password", command):
+            pass
+
+    results = [
+        measure('fetch', lambda: my_api.fetch(servers[0], "admin", "password", command), args.repeat, args.rows),
+        measure('parse_raw_data', parse, args.repeat, args.rows),
+        measure('fix_value', fix_values, args.repeat, len(values)),
+        measure('run_command', lambda: my_api.run_command(servers, "admin", "password", command),
+                args.repeat, rows),
+        measure('stream_command', stream, args.repeat, rows),
+    ]
+
+    # Reports of the result of run_command()
+    with contextlib.redirect_stdout(io.StringIO()):
+        my_api.run_command(servers, "admin", "password", command)
+    for report_type, streaming in (('XLSX', False), ('XLSX', True), ('CSV', False), ('HTML', False)):
+        name = 'create_report ' + report_type + (' streaming' if streaming else '')
+        file_name = os.path.join(tmp_dir, f'report_{streaming}.{report_type.lower()}')
+
+        def report():
+            if os.path.exists(file_name):
+                os.remove(file_name)
+            my_api.create_report(report_type, file_name, streaming=streaming)
+
+        results.append(measure(name, report, args.report_repeat, rows))
+
+    return results
+
+
+def print_results(results, baseline=None, tolerance=0.25):
+    # Returns the list of phases that are slower than the baseline (throughput)
+    regressions = []
+    baseline = {result['phase']: result for result in baseline or []}
+
+    print(f"{'phase':<26}{'units/s':>14}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'peak MB':>10}"
+          + (f"{'vs base':>10}" if baseline else ''))
+    for result in results:
+        line = (f"{result['phase']:<26}{result['throughput']:>14,.0f}{result['p50_ms']:>10.1f}"
+                f"{result['p90_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['peak_mb']:>10.1f}")
+        if result['phase'] in baseline:
+            change = result['throughput'] / baseline[result['phase']]['throughput'] - 1
+            line += f"{change:>+10.0%}"
+            if change < -tolerance:
+                regressions.append(result['phase'])
+                line += '  REGRESSION'
+        print(line)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000, help="rows per TSM server")
+    parser.add_argument('--servers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--report-repeat', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.0, help="mock OC latency per request (seconds)")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--save', help="save the results as JSON (baseline)")
+    parser.add_argument('--compare', help="baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed throughput drop vs the baseline")
+    args = parser.parse_args()
+
+    with MockOc(rows=args.rows, latency=args.latency, jitter=args.jitter) as oc:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = run_benchmark(args, oc.port, tmp_dir)
+
+    print(f"{args.servers} TSM servers x {args.rows} rows, repeat {args.repeat}, mock latency {args.latency} s")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    regressions = print_results(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+    if regressions:
+        print(f"Regression (> {args.tolerance:.0%} slower): {', '.join(regressions)}")
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
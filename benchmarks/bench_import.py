@@ -0,0 +1,82 @@
+# Benchmark: start-up cost of 'import tsmrest' in a new Python process (what every cron script pays)
+# Reports the wall time of the import (median of --repeat runs), the cumulative import time of the biggest
+# modules (python -X importtime) and whether openpyxl / sqlite3 were loaded. Then the same for the first
+# create_report() of every report type: its backend is imported at that moment (see export_backends.py)
+#
+# Usage: python benchmarks/bench_import.py [--repeat 10] [--top 8]
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+TIMED_IMPORT = """
+import sys, time
+start = time.perf_counter()
+import tsmrest
+print(time.perf_counter() - start, 'openpyxl' in sys.modules, 'sqlite3' in sys.modules)
+"""
+
+TIMED_EXPORT = """
+import sys, tempfile, os, time
+import tsmrest
+my_api = tsmrest.TsmRest('localhost', '11090')
+my_api.parsed_result = {{'hdr': ['TSM SERVER', 'Node Name'], 'items': [{{'TSM SERVER': 'TSM01', 'Node Name': 'N1'}}],
+                        'cmd': 'query node', 'tsm_srv': ['TSM01']}}
+with tempfile.TemporaryDirectory() as tmp_dir:
+    start = time.perf_counter()
+    my_api.create_report('{report_type}', os.path.join(tmp_dir, 'report.{report_type}'.lower()))
+    print(time.perf_counter() - start)
+"""
+
+
+def run_python(code, *options):
+    result = subprocess.run([sys.executable, *options, '-c', code], cwd=PACKAGE_DIR,
+                            capture_output=True, text=True, check=True)
+    return result
+
+
+def import_tree(top):
+    # Biggest modules imported by 'import tsmrest': list of (cumulative ms, module name), direct imports only
+    stderr = run_python('import tsmrest', '-X', 'importtime').stderr
+    modules = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match and len(match.group(3)) <= 3:  # tsmrest and the modules it imports itself
+            modules.append((int(match.group(2)) / 1000, match.group(4)))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up cost of import tsmrest")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--top', type=int, default=8)
+    args = parser.parse_args()
+
+    durations = []
+    for _ in range(args.repeat):
+        seconds, openpyxl_loaded, sqlite_loaded = run_python(TIMED_IMPORT).stdout.split()
+        durations.append(float(seconds))
+
+    print(f"import tsmrest: {statistics.median(durations) * 1000:.1f} ms (median of {args.repeat}), "
+          f"openpyxl loaded: {openpyxl_loaded}, sqlite3 loaded: {sqlite_loaded}")
+
+    print("\nCumulative import time (ms):")
+    for milliseconds, module in import_tree(args.top):
+        print(f"  {milliseconds:8.1f}  {module}")
+
+    print("\nFirst create_report() per report type (ms, includes the import of its backend):")
+    for report_type in ('CSV', 'JSON', 'HTML', 'SQLITE', 'XLSX'):
+        durations = [float(run_python(TIMED_EXPORT.format(report_type=report_type)).stdout.split()[-1])
+                     for _ in range(max(1, args.repeat // 2))]
+        print(f"  {statistics.median(durations) * 1000:8.1f}  {report_type}")
+
+
+if __name__ == '__main__':
+    main()
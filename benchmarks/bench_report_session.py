@@ -0,0 +1,66 @@
+# Benchmark: Excel report with many sheets
+# One create_report("XLSX", same_file, sheet_name) call per sheet versus one ReportSession saved once
+#
+# Usage: python benchmarks/bench_report_session.py [--sheets 30] [--rows 500]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tsmrest import TsmRest
+from report_session import ReportSession
+
+
+def synthetic_result(rows, sheet):
+    # parsed_result with 'rows' rows and 8 columns
+    col_names = ['TSM SERVER', 'Node Name', 'Type', 'Filespace Name', 'FSID',
+                 'Storage Pool Name', 'Number of Files', 'Physical Space Occupied (MB)']
+    items = []
+    for i in range(rows):
+        items.append({'TSM SERVER': f'TSM{i % 4:02}', 'Node Name': f'NODE{sheet}_{i}', 'Type': 'Bkup',
+                      'Filespace Name': f'/fs{i % 17}', 'FSID': i % 17, 'Storage Pool Name': 'DISKPOOL',
+                      'Number of Files': i * 13, 'Physical Space Occupied (MB)': f'{i * 1.5:.2f}'})
+    return {'hdr': col_names, 'items': items, 'cmd': 'query occupancy', 'tsm_srv': ['TSM00']}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sheets', type=int, default=30)
+    parser.add_argument('--rows', type=int, default=500)
+    args = parser.parse_args()
+
+    results = [synthetic_result(args.rows, sheet) for sheet in range(args.sheets)]
+    my_api = TsmRest("localhost", "11090")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        # One create_report() call per sheet: load + save the growing file every time
+        file_name = os.path.join(tmp_dir, 'create_report.xlsx')
+        start = time.perf_counter()
+        for sheet, parsed_result in enumerate(results):
+            my_api.parsed_result = parsed_result
+            my_api.create_report("XLSX", file_name, f"Sheet {sheet}")
+        create_report_secs = time.perf_counter() - start
+
+        # One ReportSession, saved once
+        timings = {}
+        for streaming in (False, True):
+            file_name = os.path.join(tmp_dir, f'session_{streaming}.xlsx')
+            start = time.perf_counter()
+            with ReportSession(file_name, streaming=streaming) as report:
+                for sheet, parsed_result in enumerate(results):
+                    report.add_sheet(parsed_result, f"Sheet {sheet}")
+            timings[streaming] = time.perf_counter() - start
+
+    print(f"{args.sheets} sheets x {args.rows} rows")
+    print(f"  create_report() per sheet     : {create_report_secs:8.2f} s")
+    print(f"  ReportSession                 : {timings[False]:8.2f} s")
+    print(f"  ReportSession(streaming=True) : {timings[True]:8.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+# Local mock of the Operations Center REST API: POST /oc/api/cli/issueConfirmedCommand/<TSM server>
+# Synthetic responses with the IBM structure, to test and benchmark TsmRest without a real OC
+#
+# The name of the TSM server selects the response:
+#   NOMATCH...  [[{'msg': {'n': '2034', ...}}]]   no match found (SP >= 8.1.9)
+#   LEGACY...   [[]]                              no match found (SP <= 8.1.8)
+#   FAIL...     HTTP 500                          syntax error / privileges
+#   SLOW...     normal result after 'slow_latency' seconds
+#   other       normal result: 'rows' rows with the value shapes of real responses (see COLUMNS)
+# A command ending with "OFFSET n ROWS FETCH FIRST m ROWS ONLY" gets that window of the rows (paged SELECT),
+# or 'no match found' after the last row
+# Every request waits 'latency' seconds (+ random 0..'jitter'), 'failure_rate' of the requests get HTTP 503
+#
+# Usage: python benchmarks/mock_oc.py [--port 11090] [--rows 1000] [--latency 0.05] [--failure-rate 0.01]
+# In a script:
+#     with MockOc(rows=1000) as oc:
+#         my_api = TsmRest("localhost", str(oc.port))
+#
+# TLS: a self-signed certificate is created with the openssl command, or pass cert_file and key_file
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+URL_PATH = '/oc/api/cli/issueConfirmedCommand/'
+PAGE_WINDOW = re.compile(rb'OFFSET\s+(\d+)\s+ROWS\s+FETCH\s+FIRST\s+(\d+)\s+ROWS\s+ONLY\s*;?\s*$', re.IGNORECASE)
+
+# Column definitions: (column title, function that returns the REST value of row i)
+COLUMNS = [
+    ('Node Name', lambda i: f'NODE{i:06}'),
+    ('Platform', lambda i: {'def': ('Linux', 'WinNT', 'AIX')[i % 3], 'id': str(23500 + i % 3)}),
+    ('Days Since Last Access', lambda i: i % 365),
+    ('Locked?', lambda i: {'def': 'No' if i % 10 else 'Yes', 'id': '23402'}),
+    ('Physical Space Occupied', lambda i: [{'val': round(i * 1.75, 2)}, {'val': {'def': 'GB'}}]),
+    ('Last Access Date/Time', lambda i: {'secs': 1600000000 + i * 60, 'type': 0, 'tzo': 3600}),
+    ('Privilege Classes', lambda i: [{'val': {'def': 'System', 'id': '23440'}}] if i % 50 == 0 else []),
+    ('TCP/IP Name', lambda i: [{'val': f'host{i % 1000}.company.com'}]),
+    ('Policy Domain Name', lambda i: ['STANDARD']),
+    ('Contact', lambda i: f'Team <{i % 7}> & "backup"'),
+]
+
+
+def rest_response(first_row, last_row):
+    # Normal result of a query/select command with the rows first_row .. last_row - 1
+    hdr = [{'def': title, 'id': str(23000 + col)} for col, (title, value) in enumerate(COLUMNS)]
+    items = [{str(23000 + col): value(i) for col, (title, value) in enumerate(COLUMNS)}
+             for i in range(first_row, last_row)]
+    return [[{'hdr': hdr, 'items': items}]]
+
+
+def no_match_response():
+    return [[{'msg': {'n': '2034', 'sev': 'E', 'txt': 'ANR2034E SELECT: No match found using this criteria.'}}]]
+
+
+def self_signed_certificate(directory):
+    # Returns (cert_file, key_file), created with the openssl command
+    if shutil.which('openssl') is None:
+        raise RuntimeError("MockOc: the openssl command is needed to create a certificate, "
+                           "or pass cert_file and key_file")
+
+    cert_file = os.path.join(directory, 'mock_oc.pem')
+    key_file = os.path.join(directory, 'mock_oc.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+                    '-subj', '/CN=localhost', '-keyout', key_file, '-out', cert_file],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_file, key_file
+
+
+class MockOcHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the OC
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        oc = self.server.mock_oc
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if not self.path.startswith(URL_PATH):
+            return self.reply(404)
+        if not self.headers.get('Authorization', '').startswith('Basic '):
+            return self.reply(401)
+
+        tsm_server = self.path[len(URL_PATH):].upper()
+        oc.count_request(tsm_server, body)
+
+        delay = oc.latency + random.uniform(0, oc.jitter)
+        if tsm_server.startswith('SLOW'):
+            delay += oc.slow_latency
+        if delay > 0:
+            time.sleep(delay)
+
+        if tsm_server.startswith('FAIL'):
+            return self.reply(500)
+        if oc.failure_rate and random.random() < oc.failure_rate:
+            return self.reply(503)
+
+        if tsm_server.startswith('NOMATCH'):
+            return self.reply(200, oc.body('nomatch'))
+        if tsm_server.startswith('LEGACY'):
+            return self.reply(200, b'[[]]')
+
+        window = PAGE_WINDOW.search(body)
+        if window is not None:
+            return self.reply(200, oc.body('rows', int(window.group(1)), int(window.group(2))))
+        return self.reply(200, oc.body('rows'))
+
+    def reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockOc:
+    # Mock OC in a background thread. port=0: a free port is chosen, see self.port
+    # rows, latency, jitter, slow_latency and failure_rate can be changed while the server runs
+
+    def __init__(self, port=0, rows=1000, latency=0.0, jitter=0.0, slow_latency=3.0, failure_rate=0.0,
+                 cert_file=None, key_file=None):
+        self.rows = rows
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_latency = slow_latency
+        self.failure_rate = failure_rate
+
+        self.stats = {'requests': 0, 'bytes_received': 0}
+        self.servers = {}   # Number of requests per TSM server
+        self._bodies = {}   # Encoded responses: generated once per (kind, rows, window)
+        self._lock = threading.Lock()
+        self._tmp_dir = None
+
+        if cert_file is None:
+            self._tmp_dir = tempfile.TemporaryDirectory()
+            cert_file, key_file = self_signed_certificate(self._tmp_dir.name)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), MockOcHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock_oc = self
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+        self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def body(self, kind, offset=0, fetch_rows=None):
+        # JSON response (bytes), generated once and reused: the mock should not slow down the benchmark
+        # offset, fetch_rows: window of the rows (paged SELECT)
+        rows = self.rows
+        last_row = rows if fetch_rows is None else min(rows, offset + fetch_rows)
+        if kind == 'rows' and offset >= last_row:
+            kind = 'nomatch'  # Page after the last row
+
+        key = (kind, rows, offset, last_row) if kind == 'rows' else (kind,)
+        with self._lock:
+            body = self._bodies.get(key)
+        if body is None:
+            response = no_match_response() if kind == 'nomatch' else rest_response(offset, last_row)
+            body = json.dumps(response).encode()
+            with self._lock:
+                self._bodies[key] = body
+        return body
+
+    def count_request(self, tsm_server, body):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_received'] += len(body)
+            self.servers[tsm_server] = self.servers.get(tsm_server, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+# End of class
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Operations Center REST API")
+    parser.add_argument('--port', type=int, default=11090)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--cert-file')
+    parser.add_argument('--key-file')
+    args = parser.parse_args()
+
+    oc = MockOc(args.port, args.rows, args.latency, args.jitter, failure_rate=args.failure_rate,
+                cert_file=args.cert_file, key_file=args.key_file)
+    print(f"Mock OC listening on https://localhost:{oc.port}{URL_PATH}<TSM server>  (Ctrl-C to stop)")
+    try:
+        oc.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        oc.stop()
+
+
+if __name__ == '__main__':
+    main()
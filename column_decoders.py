@@ -0,0 +1,220 @@
+import datetime
+from collections import Counter
+
+# Specialized value decoders, one per value 'shape' recognized by TsmRest.fix_value()
+# The shape of a column almost never changes between rows, so we detect it once (infer_shape) and
+# decode all cells of the column with code that skips the generic decision tree of fix_value().
+# A cell that does not have the expected shape is passed to the generic decoder (fallback).
+
+
+def value_shape(value):
+    # Returns the shape of a REST value, or None if fix_value() does not recognize it
+    if isinstance(value, dict):
+        if 'def' in value:
+            return 'def'                    # {'def': 'No', 'id': '23402'}
+        if 'secs' in value:
+            return 'secs'                   # {'secs': 1200, 'type': 0, 'tzo': 3600}
+
+    elif isinstance(value, list):
+        if len(value) == 0:
+            return 'empty'                  # []
+
+        if len(value) == 1:
+            if isinstance(value[0], dict):
+                if 'val' in value[0]:
+                    if isinstance(value[0]['val'], dict):
+                        if 'def' in value[0]['val']:
+                            return 'val_def'        # [{'val': {'def': 'System', 'id': '23440'}}]
+                    elif not isinstance(value[0]['val'], list):
+                        return 'val'                # [{'val': 'HOSTNAME'}]
+            elif not isinstance(value[0], list):
+                return 'item'                       # ['System']
+
+        elif len(value) == 2:
+            if isinstance(value[0], dict) and isinstance(value[1], dict):
+                if 'val' in value[0] and 'val' in value[1]:
+                    if not isinstance(value[0]['val'], (dict, list)):
+                        if isinstance(value[1]['val'], dict) and 'def' in value[1]['val']:
+                            return 'val_unit'       # [{'val': 1}, {'val': {'def': 'GB'}}]
+
+    else:
+        return 'scalar'                     # 'ADMIN', 155, None
+
+    return None
+
+# End of function value_shape()
+
+
+def infer_shape(values):
+    # Most common shape of the sample values of a column. None if there are no samples (shape unknown)
+    shapes = Counter(value_shape(value) for value in values)
+    if not shapes:
+        return None
+    return shapes.most_common(1)[0][0] or 'generic'
+
+
+def compile_decoder(shape, fallback):
+    # Returns a function that decodes one value of the given shape, or calls fallback(value) if it does not match
+
+    if shape == 'scalar':
+        def decode(value):
+            if value.__class__ is dict or value.__class__ is list:
+                return fallback(value)
+            return value
+
+    elif shape == 'def':
+        def decode(value):
+            try:
+                return value['def']
+            except (TypeError, KeyError):
+                return fallback(value)
+
+    elif shape == 'secs':
+        def decode(value):
+            try:
+                if 'def' not in value:
+                    return datetime.datetime.fromtimestamp(value['secs'])
+            except (TypeError, KeyError):
+                pass
+            return fallback(value)
+
+    elif shape == 'empty':
+        def decode(value):
+            if value.__class__ is list and not value:
+                return '-'
+            return fallback(value)
+
+    elif shape == 'val_def':
+        def decode(value):
+            if value.__class__ is list and len(value) == 1:
+                try:
+                    return value[0]['val']['def']
+                except (TypeError, KeyError):
+                    pass
+            return fallback(value)
+
+    elif shape == 'val':
+        def decode(value):
+            if value.__class__ is list and len(value) == 1:
+                try:
+                    val = value[0]['val']
+                    if val.__class__ is not dict and val.__class__ is not list:
+                        return val
+                except (TypeError, KeyError):
+                    pass
+            return fallback(value)
+
+    elif shape == 'item':
+        def decode(value):
+            if value.__class__ is list and len(value) == 1:
+                val = value[0]
+                if val.__class__ is not dict and val.__class__ is not list:
+                    return val
+            return fallback(value)
+
+    elif shape == 'val_unit':
+        def decode(value):
+            if value.__class__ is list and len(value) == 2:
+                try:
+                    val = value[0]['val']
+                    metric = value[1]['val']['def']
+                    if val.__class__ is not dict and val.__class__ is not list:
+                        return f"{val} {metric}"
+                except (TypeError, KeyError):
+                    pass
+            return fallback(value)
+
+    else:
+        # Unknown shape: generic decoder
+        decode = fallback
+
+    return decode
+
+# End of function compile_decoder()
+
+
+class ShapeMismatch(Exception):
+    # Raised by a compiled row parser when a value does not have the shape of its column
+    pass
+
+
+# Python statements that decode the value of column key 'k' into variable 'v', per shape
+# A value with another shape raises ShapeMismatch, TypeError or KeyError
+SHAPE_CODE = {
+    'scalar': ["{v} = item[{k}]",
+               "if {v}.__class__ is dict or {v}.__class__ is list: raise ShapeMismatch"],
+    'def': ["{v} = item[{k}]['def']"],
+    'secs': ["{v} = item[{k}]",
+             "if 'def' in {v}: raise ShapeMismatch",
+             "{v} = fromtimestamp({v}['secs'])"],
+    'empty': ["{v} = item[{k}]",
+              "if {v}.__class__ is not list or {v}: raise ShapeMismatch",
+              "{v} = '-'"],
+    'val_def': ["{v} = item[{k}]",
+                "if {v}.__class__ is not list or len({v}) != 1: raise ShapeMismatch",
+                "{v} = {v}[0]['val']['def']"],
+    'val': ["{v} = item[{k}]",
+            "if {v}.__class__ is not list or len({v}) != 1: raise ShapeMismatch",
+            "{v} = {v}[0]['val']",
+            "if {v}.__class__ is dict or {v}.__class__ is list: raise ShapeMismatch"],
+    'item': ["{v} = item[{k}]",
+             "if {v}.__class__ is not list or len({v}) != 1: raise ShapeMismatch",
+             "{v} = {v}[0]",
+             "if {v}.__class__ is dict or {v}.__class__ is list: raise ShapeMismatch"],
+    'val_unit': ["{v} = item[{k}]",
+                 "if {v}.__class__ is not list or len({v}) != 2: raise ShapeMismatch",
+                 "{v}_unit = {v}[1]['val']['def']",
+                 "{v} = {v}[0]['val']",
+                 "if {v}.__class__ is dict or {v}.__class__ is list: raise ShapeMismatch",
+                 "{v} = f'{{{v}}} {{{v}_unit}}'"],
+    'generic': ["{v} = fallback(item[{k}])"],
+}
+
+
+def compile_row_parser(columns, fallback, as_tuple=False):
+    # Returns a function parse_row(item, tsm_server) that converts one dict of 'items' into a new dict:
+    # {column title: clean value, ..., 'TSM SERVER': tsm_server}
+    # or, with as_tuple=True, into a tuple: (tsm_server, clean value, ...)
+    # columns is a list of tuples (column key, column title, shape)
+    # Rows with a value that does not match the shape of its column are decoded cell by cell (compile_decoder)
+
+    # Column keys and titles are passed as variables, they never become part of the generated source code
+    namespace = {
+        'ShapeMismatch': ShapeMismatch,
+        'fromtimestamp': datetime.datetime.fromtimestamp,
+        'fallback': fallback,
+    }
+
+    lines = ["def parse_row(item, tsm_server):", "    try:"]
+    result = []
+    for index, (key, col_name, shape) in enumerate(columns):
+        namespace[f'k{index}'] = key
+        namespace[f'n{index}'] = col_name
+        for statement in SHAPE_CODE[shape]:
+            lines.append("        " + statement.format(v=f'v{index}', k=f'k{index}'))
+        result.append(f"n{index}: v{index}")
+    result.append("'TSM SERVER': tsm_server")
+
+    lines.append("    except (ShapeMismatch, TypeError, KeyError):")
+    lines.append("        return parse_row_slow(item, tsm_server)")
+    if as_tuple:
+        lines.append("    return (tsm_server, " + "".join(f"v{index}, " for index in range(len(columns))) + ")")
+    else:
+        lines.append("    return {" + ", ".join(result) + "}")
+
+    # Slow path: one decoder per column
+    decoders = [(key, col_name, compile_decoder(shape, fallback)) for key, col_name, shape in columns]
+
+    def parse_row_slow(item, tsm_server):
+        if as_tuple:
+            return (tsm_server, *(decoder(item[key]) for key, col_name, decoder in decoders))
+        row = {col_name: decoder(item[key]) for key, col_name, decoder in decoders}
+        row['TSM SERVER'] = tsm_server
+        return row
+
+    namespace['parse_row_slow'] = parse_row_slow
+
+    exec("\n".join(lines), namespace)
+    return namespace['parse_row']
+
+# End of function compile_row_parser()
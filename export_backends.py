@@ -0,0 +1,35 @@
+import importlib
+
+# Report types of create_report(): report type -> backend, as 'module:function' or a function
+# A module is imported the first time its report type is used: a script that writes CSV or JSON
+# never imports openpyxl (XLSX) or sqlite3 (SQLITE)
+#
+# A backend is called as backend(file_name, col_names, rows, **options)
+#   rows: iterable of row dicts (missing keys are written as '-'), col_names: column titles in order
+#   options: sheet_name, sheet_tab_color, streaming, compress, table, cmd, tsm_srv. Ignore the ones you do not use
+#
+# Add a report type:
+#     register_backend('PARQUET', 'my_module:write_parquet')
+
+EXPORT_BACKENDS = {
+    'XLSX': 'extra_functions:export_xlsx',
+    'CSV': 'exporters:export_csv',
+    'HTML': 'exporters:export_html',
+    'JSON': 'exporters:export_json',
+    'SQLITE': 'sqlite_store:export_sqlite',
+}
+
+
+def register_backend(report_type, backend):
+    # backend: function, or 'module:function' (imported when the report type is used the first time)
+    EXPORT_BACKENDS[report_type] = backend
+
+
+def export_backend(report_type):
+    # Backend function of a report type. KeyError if the report type is not registered
+    backend = EXPORT_BACKENDS[report_type]
+    if isinstance(backend, str):
+        module_name, function_name = backend.split(':')
+        backend = getattr(importlib.import_module(module_name), function_name)
+        EXPORT_BACKENDS[report_type] = backend  # Imported once
+    return backend
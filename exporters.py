@@ -0,0 +1,118 @@
+import csv
+import datetime
+import gzip
+import html
+import io
+import json
+
+# Streaming report writers for create_report(): rows are written to the file in chunks of 'chunk_rows'
+# while they are produced, so 'rows' can be any iterable of dicts, e.g. TsmRest.stream_command()
+
+
+def open_report_file(file_name, compress=False):
+    # Text file for a report, gzip compressed if compress=True
+    if compress:
+        return gzip.open(file_name, 'wt', encoding='utf-8', newline='')
+    return open(file_name, 'w', encoding='utf-8', newline='')
+
+
+def write_csv(file_name, col_names, rows, compress=False, chunk_rows=1000):
+    # CSV report, ';' as delimiter. Missing values become '-'
+    with open_report_file(file_name, compress) as output_file:
+        buffer = io.StringIO()
+        dict_writer = csv.DictWriter(buffer, restval="-", extrasaction="ignore", fieldnames=col_names,
+                                     delimiter=';')
+        dict_writer.writeheader()
+
+        for count, row in enumerate(rows, start=1):
+            dict_writer.writerow(row)
+            if count % chunk_rows == 0:
+                output_file.write(buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+
+        output_file.write(buffer.getvalue())
+
+# End of function write_csv()
+
+
+def write_html(file_name, col_names, rows, compress=False, chunk_rows=1000, title='Test Report'):
+    # HTML report: one table. Column titles and values are HTML escaped. Missing values become '-'
+    with open_report_file(file_name, compress) as output_file:
+        chunk = [
+            "<html>\n<head>\n\t<meta charset=\"utf-8\">\n\t<title>" + html.escape(title) + "</title>\n</head>\n\n",
+            "<body>\n<table>\n\n\t<tr>\n"
+        ]
+        for col in col_names:
+            chunk.append("\t\t<th>" + html.escape(str(col)) + "</th>\n")
+        chunk.append("\t</tr>\n")
+
+        for count, item in enumerate(rows, start=1):
+            chunk.append("\t<tr>\n")
+            for col in col_names:
+                if col in item:
+                    chunk.append("\t\t<td>" + html.escape(str(item[col])) + "</td>\n")
+                else:
+                    chunk.append("\t\t<td>-</td>\n")
+            chunk.append("\t</tr>\n")
+
+            if count % chunk_rows == 0:
+                output_file.write(''.join(chunk))
+                chunk = []
+
+        chunk.append("</table>\n</body>\n</html>")
+        output_file.write(''.join(chunk))
+
+# End of function write_html()
+
+
+def write_json(file_name, col_names, rows, compress=False, chunk_rows=1000):
+    # JSON report: a list of objects with the keys of col_names. Missing values become '-', dates ISO 8601
+    def json_value(value):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        return str(value)
+
+    with open_report_file(file_name, compress) as output_file:
+        chunk = ["["]
+        for count, row in enumerate(rows, start=1):
+            if count > 1:
+                chunk.append(",")
+            chunk.append("\n" + json.dumps({col: row.get(col, '-') for col in col_names}, default=json_value))
+
+            if count % chunk_rows == 0:
+                output_file.write(''.join(chunk))
+                chunk = []
+
+        chunk.append("\n]\n")
+        output_file.write(''.join(chunk))
+
+# End of function write_json()
+
+
+# Backends of create_report() (see export_backends.py)
+
+def export_csv(file_name, col_names, rows, compress=False, **options):
+    # If target CSV report file exists then it gets overwritten
+    try:
+        write_csv(file_name, col_names, rows, compress)
+    except Exception:
+        print(f"ERROR: Could not create csv file {file_name}")
+        exit(1)
+
+
+def export_html(file_name, col_names, rows, compress=False, **options):
+    # If target HTML report file exists then it gets overwritten
+    try:
+        write_html(file_name, col_names, rows, compress)
+    except Exception:
+        print(f"ERROR: Could not create html file {file_name}")
+
+
+def export_json(file_name, col_names, rows, compress=False, **options):
+    # If target JSON report file exists then it gets overwritten
+    try:
+        write_json(file_name, col_names, rows, compress)
+    except Exception:
+        print(f"ERROR: Could not create json file {file_name}")
+        exit(1)
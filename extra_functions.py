@@ -1,13 +1,16 @@
 import os.path
 import csv
+import threading
+from itertools import chain, islice
+from types import MappingProxyType
 
-# 3rd Party Modules
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Border, Side, Alignment, Font, NamedStyle, Color
+# 3rd Party Modules: openpyxl is imported by the XLSX functions only, read_csv() / stream_csv() users
+# (e.g. the scheduler with a CSV job table) do not pay for the import
 
 
 # Function to init Excel styles
 def create_xls_styles(cur_workbook):
+    from openpyxl.styles import PatternFill, Border, Side, Alignment, Font, NamedStyle
 
     # Title cell
     if 'title_style' not in cur_workbook.named_styles:
@@ -47,46 +50,269 @@ def create_xls_styles(cur_workbook):
 # End of function create_xls_styles
 
 
-def read_excel_sheet(excel_file, excel_sheet):
-    # EXPECTING sheet row 1 to contain 'column titles'
+def xlsx_rows(col_names, items):
+    # Cell values of every row of parsed_result['items'], in the order of col_names
+    # If the value is None, or the column name is not present as a key in the item, we set a dash '-'
+    for item in items:
+        yield [item[col] if col in item and item[col] is not None else '-' for col in col_names]
 
-    if not os.path.exists(os.path.abspath(os.path.dirname(excel_file))):
-        print("read_structured_sheet(): Directory not found")
-        exit(1)
 
-    if not os.path.exists(excel_file):
-        print("read_structured_sheet(): Excel file not found")
+def measure_widths(rows, widths):
+    # Pass the rows through, while measuring the width of every column (length of the longest value)
+    # widths is a list with the current width of every column, updated in place
+    for row in rows:
+        for i, value in enumerate(row):
+            if value:
+                length = len(str(value))
+                if length > widths[i]:
+                    widths[i] = length
+        yield row
+
+
+def set_column_widths(ws, widths):
+    from openpyxl.utils import get_column_letter
+
+    for i, width in enumerate(widths, start=1):
+        if width:
+            ws.column_dimensions[get_column_letter(i)].width = width + 6
+
+
+def write_sheet(wb, sheet_name, sheet_tab_color, col_names, rows):
+    # Add a sheet to a normal workbook. rows is an iterable of lists with the cell values (order of col_names)
+
+    # Create a new Excel sheet, set name and tab color
+    ws = wb.create_sheet(title=sheet_name)
+    ws.sheet_properties.tabColor = sheet_tab_color
+
+    # Write headers to the first row of the sheet and style them
+    ws.append(col_names)
+    ws.row_dimensions[1].height = 20
+    for cell in ws[1]:
+        cell.style = 'title_style'
+
+    # Write values to cells, measure the column widths at the same time
+    widths = [len(str(name)) for name in col_names]
+    for row in measure_widths(rows, widths):
+        ws.append(row)
+
+    # Enable Excel Column Filtering
+    ws.auto_filter.ref = ws.dimensions
+
+    # Auto Size columns
+    set_column_widths(ws, widths)
+
+    return ws
+
+# End of function write_sheet()
+
+
+def write_only_sheet(wb, sheet_name, sheet_tab_color, col_names, rows, width_sample_rows=1000):
+    # Add a sheet to a write-only workbook (Workbook(write_only=True)): rows are written to disk one by one,
+    # memory use does not grow with the number of rows. rows is an iterable of lists with the cell values
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    ws = wb.create_sheet(title=sheet_name)
+    ws.sheet_properties.tabColor = sheet_tab_color
+
+    # Column widths must be set before the first row is written. They are measured on the column titles
+    # and on the first rows of the data (width_sample_rows), which are kept in memory until then
+    rows = iter(rows)
+    widths = [len(str(name)) for name in col_names]
+    first_rows = list(measure_widths(islice(rows, width_sample_rows), widths))
+    set_column_widths(ws, widths)
+
+    # Write headers to the first row of the sheet and style them
+    ws.row_dimensions[1].height = 20
+    title_cells = []
+    for name in col_names:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.style = 'title_style'
+        title_cells.append(cell)
+    ws.append(title_cells)
+
+    # Write values to cells
+    row_count = 0
+    for row in chain(first_rows, rows):
+        ws.append(row)
+        row_count += 1
+
+    # Enable Excel Column Filtering
+    ws.auto_filter.ref = f"A1:{get_column_letter(max(len(col_names), 1))}{row_count + 1}"
+
+    return ws
+
+# End of function write_only_sheet()
+
+
+def export_xlsx(file_name, col_names, rows, sheet_name='Report', sheet_tab_color='FFFFFF', streaming=False,
+                **options):
+    # XLSX backend of create_report() (see export_backends.py). An existing file gets a new sheet
+    # streaming=True: write-only workbook, rows are written to disk one by one (new file only)
+    from openpyxl import Workbook, load_workbook
+
+    # Cell values of every row, in the order of col_names
+    rows = xlsx_rows(col_names, rows)
+
+    # Write-only workbook: rows are streamed to disk, memory use stays flat. Creates a new file only
+    if streaming and os.path.exists(file_name):
+        print(f"create_report(): {file_name} exists, streaming mode cannot add a sheet. Using normal mode")
+        streaming = False
+
+    if streaming:
+        wb = Workbook(write_only=True)
+        create_xls_styles(wb)
+        write_only_sheet(wb, sheet_name, sheet_tab_color, col_names, rows)
+
+    else:
+        # Initialize wb as empty workbook
+        wb = Workbook()
+
+        # If the Excel file already exists then load it. We'll place our data in a new sheet
+        if os.path.exists(file_name):
+            try:
+                wb = load_workbook(file_name)
+            except Exception:  # At this point we already checked if path exists
+                print(f"ERROR: Could not access the target file {file_name}")
+                exit(1)
+        else:
+            # Excel file does not exist yet (wb already created in first step)
+
+            # Since this is a new file we can remove the 'default' sheet
+            remove_these_sheets = ['Sheet', 'Sheet1', 'Sheet 1']
+            for sheet in remove_these_sheets:
+                if sheet in wb.sheetnames:
+                    del wb[sheet]
+
+        # Define styles
+        create_xls_styles(wb)
+
+        # Create a new Excel sheet with the data
+        write_sheet(wb, sheet_name, sheet_tab_color, col_names, rows)
+
+    # Save Excel file
+    try:
+        wb.save(file_name)
+    except Exception:
+        print(f"ERROR: Could not save report file {file_name}")
         exit(1)
 
-    wb = load_workbook(filename=excel_file)
+# End of function export_xlsx()
+
+
+# Input files (server inventories, command lists): the rows are read one by one (stream_excel_sheet, stream_csv),
+# read_excel_sheet() and read_csv() keep the result in a cache until the file is changed (mtime, size)
+# Errors raise FileNotFoundError or ValueError
+
+loader_cache = {}  # (kind, path, sheet) -> (mtime_ns, size, {'hdr': tuple, 'items': tuple of read-only rows})
+loader_cache_size = 16  # Max number of files in loader_cache
+loader_cache_lock = threading.Lock()
+
+
+def check_input_file(file_name, function_name):
+    if not os.path.exists(os.path.abspath(os.path.dirname(file_name))):
+        raise FileNotFoundError(f"{function_name}(): Directory not found: {os.path.dirname(file_name)}")
+    if not os.path.exists(file_name):
+        raise FileNotFoundError(f"{function_name}(): File not found: {file_name}")
+
+
+def stream_excel_sheet(excel_file, excel_sheet):
+    # EXPECTING sheet row 1 to contain 'column titles'
+    # Returns {'hdr': column titles, 'items': generator of row dicts}. Read-only workbook, cell values only:
+    # no cell objects are built and the rows are read from the file while they are used
+    from openpyxl import load_workbook
+
+    check_input_file(excel_file, 'stream_excel_sheet')
+
+    wb = load_workbook(filename=excel_file, read_only=True)
+    if excel_sheet not in wb.sheetnames:
+        wb.close()
+        raise ValueError(f"stream_excel_sheet(): Sheet '{excel_sheet}' not found in {excel_file}")
     ws = wb[excel_sheet]
 
     # Get data from first row
-    column_names = []
-    for row in ws.iter_rows(min_row=1, max_row=1, values_only=True):  # iter_rows returns tuple
-        for cell in row:
-            column_names.append(cell)
+    column_names = list(next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ()))
+
+    def rows():
+        # The workbook is closed when the last row was read (or the generator is closed)
+        try:
+            for row in ws.iter_rows(min_row=2, values_only=True):
+                if len(row) < len(column_names):
+                    row = row + (None,) * (len(column_names) - len(row))
+                yield dict(zip(column_names, row))
+        finally:
+            wb.close()
+
+    return {'hdr': column_names, 'items': rows()}
+
+# End of function stream_excel_sheet()
 
-    # Get data from all rows after the first row
-    excel_data = []
-    for row in ws[2: ws.max_row]:  # not using iter_rows, need 'generator' to access col_idx
-        cur_row = {}
-        for cell in row:
-            cur_row[column_names[cell.col_idx - 1]] = cell.value
-        excel_data.append(cur_row)
 
-    wb.close()
+def stream_csv(csv_file):
+    # Returns {'hdr': column titles, 'items': generator of row dicts}. The file is read while the rows are used
+    check_input_file(csv_file, 'stream_csv')
 
-    return_data = {'hdr': column_names, 'items': excel_data}
-    return return_data
-    # End of function read_excel_sheet()
+    f = open(csv_file, 'r', newline='')
+    reader = csv.DictReader(f)
+    column_names = reader.fieldnames or []
+
+    def rows():
+        with f:
+            yield from reader
+
+    return {'hdr': column_names, 'items': rows()}
+
+
+def cached_load(kind, file_name, sheet, load):
+    # Result of load() (stream_excel_sheet or stream_csv), from loader_cache if the file did not change
+    # The cached result is shared by all callers and read-only: 'hdr' a tuple, 'items' a tuple of mappingproxy
+    stat = os.stat(file_name)
+    key = (kind, os.path.abspath(file_name), sheet)
+
+    with loader_cache_lock:
+        entry = loader_cache.get(key)
+    if entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+        streamed = load()
+        result = {'hdr': tuple(streamed['hdr']), 'items': tuple(MappingProxyType(row) for row in streamed['items'])}
+        with loader_cache_lock:
+            loader_cache.pop(key, None)
+            loader_cache[key] = (stat.st_mtime_ns, stat.st_size, result)
+            while len(loader_cache) > loader_cache_size:
+                del loader_cache[next(iter(loader_cache))]  # Oldest entry
+    else:
+        result = entry[2]
+
+    return result
+
+
+def copy_result(result):
+    # Own copy of a cached result for the caller: lists of dicts that can be changed
+    return {'hdr': list(result['hdr']), 'items': [dict(row) for row in result['items']]}
+
+
+def read_excel_sheet(excel_file, excel_sheet):
+    # EXPECTING sheet row 1 to contain 'column titles'
+    # Returns {'hdr': column titles, 'items': list of row dicts}. See stream_excel_sheet() for very large sheets
+    check_input_file(excel_file, 'read_excel_sheet')
+    return copy_result(read_excel_sheet_view(excel_file, excel_sheet))
+
+# End of function read_excel_sheet()
 
 
 def read_csv(csv_file):
-    csv_data = {}
-    with open(csv_file, 'r') as f:
-        reader = csv.DictReader(f)
-        csv_data['items'] = list(reader)
-        csv_data['hdr'] = reader.fieldnames
+    # Returns {'hdr': column titles, 'items': list of row dicts}. See stream_csv() for very large files
+    check_input_file(csv_file, 'read_csv')
+    return copy_result(read_csv_view(csv_file))
+
+
+def read_excel_sheet_view(excel_file, excel_sheet):
+    # Same as read_excel_sheet() without the copy: the cached result itself, read-only (see cached_load)
+    # A call on an unchanged file costs nothing. Use dict(row) for a row that must be changed
+    check_input_file(excel_file, 'read_excel_sheet_view')
+    return cached_load('xlsx', excel_file, excel_sheet, lambda: stream_excel_sheet(excel_file, excel_sheet))
+
 
-    return csv_data
+def read_csv_view(csv_file):
+    # Same as read_csv() without the copy: the cached result itself, read-only (see cached_load)
+    check_input_file(csv_file, 'read_csv_view')
+    return cached_load('csv', csv_file, None, lambda: stream_csv(csv_file))
@@ -0,0 +1,210 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+
+from paged_select import is_select
+
+# Incremental polling (see TsmRest.poll()): per TSM server a high-water mark (highest value of a column,
+# e.g. the date_time of actlog) is saved in a JSON file. The next poll only asks the rows from the mark on:
+#     select * from actlog where date_time >= '2026-10-17 10:15:00' and (severity in ('E','W'))
+# Rows at the mark (or within 'lookback' before it) were yielded already. They are recognised by a
+# fingerprint of their values and skipped, so the >= does not produce duplicates. Identical rows are real
+# events (the actlog has them): the mark counts the rows per fingerprint, only that many are skipped.
+
+
+def mask_quotes(command):
+    # The command with the text between quotes replaced by 'x' (same length, positions are kept)
+    return re.sub(r"'[^']*'|\"[^\"]*\"", lambda match: 'x' * len(match.group()), command)
+
+
+def sql_value(value):
+    # Mark value as an SQL literal
+    if isinstance(value, datetime.datetime):
+        return "'" + value.strftime('%Y-%m-%d %H:%M:%S') + "'"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def add_lower_bound(command, column, value):
+    # SELECT with the extra condition "column >= value", the existing WHERE condition is kept between ( )
+    # Works for a simple SELECT: the first WHERE and the first GROUP BY / HAVING / ORDER BY / FETCH FIRST
+    if not is_select(command):
+        raise ValueError(f"add_lower_bound(): not a SELECT command: {command}")
+    command = command.strip().rstrip(';').rstrip()
+    masked = mask_quotes(command).lower()
+    condition = f"{column} >= {sql_value(value)}"
+
+    tail = re.search(r'\b(group\s+by|having|order\s+by|fetch\s+first|offset\s+\d)\b', masked)
+    end = tail.start() if tail else len(command)
+    where = re.search(r'\bwhere\b', masked[:end])
+
+    if where is None:
+        return f"{command[:end].rstrip()} WHERE {condition} {command[end:]}".rstrip()
+
+    condition_text = command[where.end():end].strip()
+    return f"{command[:where.start()]}WHERE {condition} AND ({condition_text}) {command[end:]}".rstrip()
+
+
+def fingerprint(row):
+    # Identifies a row by its values
+    row_text = json.dumps(dict(row), sort_keys=True, default=str)
+    return hashlib.sha1(row_text.encode()).hexdigest()[:20]
+
+
+# Timestamps as text in SELECT replies: ISO 8601, DB2 (2026-10-17-10.15.00.000000), query output (10/17/2026 10:15:00)
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                     '%Y-%m-%d-%H.%M.%S.%f', '%Y-%m-%d-%H.%M.%S', '%m/%d/%Y %H:%M:%S', '%m/%d/%y %H:%M:%S',
+                     '%Y-%m-%d')
+
+
+def comparable(value):
+    # Values that can be a high-water mark ('-' or an error text cannot)
+    return isinstance(value, (datetime.datetime, int, float)) and not isinstance(value, bool)
+
+
+def mark_value(value):
+    # The value of a row as a high-water mark: datetime or number, timestamps and numbers in text are converted
+    # Returns None if the value cannot be a mark
+    if comparable(value):
+        return value
+    if not isinstance(value, str):
+        return None
+
+    text = value.strip()
+    if re.fullmatch(r'-?\d+', text):
+        return int(text)
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, timestamp_format)
+        except ValueError:
+            continue
+    return None
+
+
+def encode_value(value):
+    # Mark value for the JSON file
+    if isinstance(value, datetime.datetime):
+        return 'd:' + value.isoformat()
+    return 'n:' + repr(value)
+
+
+def decode_value(text):
+    if text.startswith('d:'):
+        return datetime.datetime.fromisoformat(text[2:])
+    number = text[2:]
+    return float(number) if '.' in number or 'e' in number else int(number)
+
+
+def decode_seen(seen):
+    # (value, count) of a fingerprint in the JSON file. Files of older versions have the value only (count 1)
+    if isinstance(seen, list):
+        return decode_value(seen[0]), int(seen[1])
+    return decode_value(seen), 1
+
+
+def window_start(hwm, lookback):
+    # Rows with a value >= window_start are kept in 'seen'
+    if isinstance(hwm, datetime.datetime):
+        return hwm - datetime.timedelta(seconds=lookback)
+    return hwm - lookback
+
+
+def advance_mark(mark, rows, hwm_field, lookback=0):
+    # Returns tuple (new mark, new rows). mark: {'hwm': value, 'seen': {fingerprint: (value, count)}} or None
+    # 'seen' counts the rows of the window (hwm - lookback) .. hwm of the previous reply, per fingerprint: that
+    # many rows with the fingerprint are not new, more identical rows are (new events with the same text)
+    # Rows before the window of the previous poll are old too (the rewritten SELECT does not return them)
+    hwm = mark['hwm'] if mark else None
+    skip = Counter({row_id: count for row_id, (value, count) in mark['seen'].items()}) if mark else Counter()
+    previous_start = window_start(hwm, lookback) if mark else None
+    new_rows = []
+    window = []  # (fingerprint, value) of the rows of this reply with a value
+
+    for row in rows:
+        value = mark_value(row.get(hwm_field))
+        if previous_start is not None and value is not None and value < previous_start:
+            continue
+
+        row_id = fingerprint(row)
+        if value is not None:
+            window.append((row_id, value))
+            if hwm is None or value > hwm:
+                hwm = value
+
+        if skip[row_id] > 0:
+            skip[row_id] -= 1
+            continue
+        new_rows.append(row)
+
+    if hwm is None:
+        return mark, new_rows
+
+    # The next reply has all the rows from the new window start on: they are counted from this reply
+    start = window_start(hwm, lookback)
+    seen = {}
+    for row_id, value in window:
+        if value >= start:
+            seen[row_id] = (value, seen[row_id][1] + 1 if row_id in seen else 1)
+    return {'hwm': hwm, 'seen': seen}, new_rows
+
+
+class HighWaterMarks:
+    # High-water marks per key (OC, TSM server, poll name), saved in a JSON file
+    # file_name None: marks in memory only (lost when the process ends)
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.marks = {}
+        self._lock = threading.Lock()
+
+        if file_name is not None and os.path.exists(file_name):
+            try:
+                with open(file_name) as f:
+                    saved = json.load(f)
+                for key, mark in saved.items():
+                    self.marks[key] = {'hwm': decode_value(mark['hwm']),
+                                       'seen': {row_id: decode_seen(seen) for row_id, seen in mark['seen'].items()}}
+            except (OSError, ValueError, KeyError, AttributeError, IndexError, TypeError):
+                print(f"HighWaterMarks(): {file_name} is not readable, starting without marks")
+                self.marks = {}
+
+    def get(self, key):
+        with self._lock:
+            return self.marks.get(key)
+
+    def set(self, key, mark):
+        with self._lock:
+            self.marks[key] = mark
+
+    def reset(self, key=None):
+        # Forget one mark, or all marks: the next poll returns the whole result again
+        with self._lock:
+            if key is None:
+                self.marks.clear()
+            else:
+                self.marks.pop(key, None)
+
+    def save(self):
+        # Write to a temporary file and rename it: a crash never leaves a half written file
+        if self.file_name is None:
+            return
+
+        with self._lock:
+            saved = {key: {'hwm': encode_value(mark['hwm']),
+                           'seen': {row_id: [encode_value(value), count]
+                                    for row_id, (value, count) in mark['seen'].items()}}
+                     for key, mark in self.marks.items()}
+
+        directory = os.path.dirname(os.path.abspath(self.file_name))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(saved, f, indent=1)
+        os.replace(tmp_path, self.file_name)
+
+# End of class
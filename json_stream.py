@@ -0,0 +1,112 @@
+import codecs
+import json
+
+
+class RestReplyStream:
+    # Incremental decoder for the JSON reply of the REST call issueConfirmedCommand
+    # Expected structure (see TsmRest.parse_raw_data): [[ {'hdr': [..], 'items': [..]}, {'msg': {..}} ]]
+    # The 'items' array is decoded one row at a time, everything else (hdr, msg) is small and decoded at once.
+    # Memory use is bounded by the read buffer (chunk_size) and the largest single row.
+
+    def __init__(self, read, chunk_size=65536):
+        self._read = read                   # Function that returns the next bytes of the reply (b'' at the end)
+        self._chunk_size = chunk_size
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        # Read the next chunk into the buffer. Returns False if there is no more data
+        if self._eof:
+            return False
+
+        chunk = self._read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            self._buf = self._buf[self._pos:] + self._utf8.decode(b'', final=True)
+        else:
+            self._buf = self._buf[self._pos:] + self._utf8.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        # Skip whitespace and return the next character ('' at the end of the reply)
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError("Unsupported Data structure: Not able to validate structure")
+        self._pos += 1
+
+    def _value(self):
+        # Decode one complete JSON value, read more data as long as the value is incomplete
+        while True:
+            self._peek()
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # A number at the end of the buffer might continue in the next chunk
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def events(self):
+        # Generator of decoding events, in the order of the reply:
+        #   ('object', index)    start of dict 'index' in the inner list
+        #   ('field', key, val)  a key of that dict, except 'items' (hdr, msg, ...)
+        #   ('items', 'items')   start of the 'items' array
+        #   ('item', row)        one row of the 'items' array
+        self._expect('[')
+        self._expect('[')
+
+        index = 0
+        while self._peek() != ']':
+            if index > 0:
+                self._expect(',')
+
+            self._expect('{')
+            yield 'object', index
+
+            first_key = True
+            while self._peek() != '}':
+                if not first_key:
+                    self._expect(',')
+                first_key = False
+
+                key = self._value()
+                self._expect(':')
+
+                if key == 'items' and self._peek() == '[':
+                    # Stream the rows one by one
+                    yield 'items', key
+                    self._pos += 1
+                    first_item = True
+                    while self._peek() != ']':
+                        if not first_item:
+                            self._expect(',')
+                        first_item = False
+                        yield 'item', self._value()
+                    self._pos += 1
+                else:
+                    yield 'field', key, self._value()
+
+            self._pos += 1
+            index += 1
+
+        self._expect(']')
+        self._expect(']')
+
+    # End of function events()
+
+# End of class
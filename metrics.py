@@ -0,0 +1,205 @@
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+# Per-phase timings of the REST calls (see TsmRest.metrics)
+#
+# Phases of one REST call on one TSM server (seconds):
+#   throttle waiting for a token of the rate limits (TsmRest.rate_limits, see rate_limit.py)
+#   queue    waiting for a free connection to the OC (max_connections)
+#   connect  DNS + TCP connect to the OC (new connections only)
+#   tls      TLS handshake (new connections only)
+#   wait     request sent until the response headers are received: the OC waits for the TSM server
+#   read     reading the response body
+#   decode   json.loads()
+#   parse    parse_raw_data()
+#   total    whole call: REST call, decode and parse (not the time spent waiting for the other TSM servers)
+# stream_command(): 'read' is the time spent in socket reads. Parsing happens while the rows are consumed,
+# so it is part of 'total' only
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def new_timing():
+    # Timing of one REST call, filled by TsmRest.fetch() and OcConnectionPool
+    return {'start': time.perf_counter(), 'phases': {}, 'source': 'rest', 'reused': None, 'retries': 0,
+            'bytes_sent': 0, 'bytes_received': 0}
+
+
+def add_phase(timing, phase, seconds):
+    # Add a duration to a phase (a phase can happen twice, e.g. connect after a retry). timing can be None
+    if timing is not None:
+        timing['phases'][phase] = timing['phases'].get(phase, 0.0) + seconds
+
+
+def label_value(value):
+    # Escape a Prometheus label value
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class CommandMetrics:
+    # Collects one record per REST call (per TSM server) and per report export
+    # - hooks: functions called with every record (dict), e.g. to log slow TSM servers
+    # - records: the last 'keep_records' records
+    # - prometheus(): aggregated metrics in the Prometheus text format (counters and histograms)
+    #
+    # Request record: {'kind': 'request', 'time', 'oc', 'tsm_server', 'command', 'status' ('ok' or 'error'),
+    #                  'error', 'source' ('rest', 'cache', 'shared', 'stream'), 'reused' (keep-alive connection),
+    #                  'retries', 'phases': {phase: seconds}, 'bytes_sent', 'bytes_received', 'rows'}
+    # Export record:  {'kind': 'export', 'time', 'oc', 'report_type', 'file_name', 'seconds', 'bytes'}
+
+    def __init__(self, oc='', keep_records=1000, buckets=DEFAULT_BUCKETS):
+        self.oc = oc
+        self.buckets = tuple(sorted(buckets))
+        self.records = deque(maxlen=keep_records)
+        self.hooks = []
+        self._lock = threading.Lock()
+
+        # Aggregates for prometheus()
+        self._requests = {}     # (tsm_server, status, source): count
+        self._phases = {}       # (tsm_server, phase): [count per bucket..., sum, count]
+        self._bytes = {}        # (tsm_server, direction): bytes
+        self._rows = {}         # tsm_server: rows
+        self._exports = {}      # report_type: [count, seconds, bytes]
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _call_hooks(self, record):
+        for hook in list(self.hooks):
+            try:
+                hook(record)
+            except Exception as e:
+                # A broken hook must not break the TSM command
+                print(f"Metrics hook {getattr(hook, '__name__', hook)} failed: {e}")
+
+    def record(self, tsm_server, command, timing, status, error='', rows=0):
+        # Save the timing of one REST call (see new_timing()), returns the record
+        phases = dict(timing['phases'])
+        if 'start' in timing:
+            end = timing.get('end', time.perf_counter())  # 'end': set by TsmRest.fetch() when the reply is decoded
+            phases['total'] = end - timing['start'] + phases.get('parse', 0.0)
+
+        record = {'kind': 'request', 'time': time.time(), 'oc': self.oc, 'tsm_server': tsm_server,
+                  'command': command, 'status': status, 'error': error, 'source': timing['source'],
+                  'reused': timing['reused'], 'retries': timing['retries'], 'phases': phases, 'bytes_sent': timing['bytes_sent'],
+                  'bytes_received': timing['bytes_received'], 'rows': rows}
+
+        with self._lock:
+            key = (tsm_server, status, record['source'])
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+            for phase, seconds in phases.items():
+                histogram = self._phases.get((tsm_server, phase))
+                if histogram is None:
+                    histogram = self._phases[(tsm_server, phase)] = [0] * len(self.buckets) + [0.0, 0]
+                for index, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        histogram[index] += 1
+                histogram[-2] += seconds
+                histogram[-1] += 1
+
+            for direction in ('sent', 'received'):
+                self._bytes[(tsm_server, direction)] = (self._bytes.get((tsm_server, direction), 0)
+                                                        + record['bytes_' + direction])
+            self._rows[tsm_server] = self._rows.get(tsm_server, 0) + rows
+            self.records.append(record)
+
+        self._call_hooks(record)
+        return record
+
+    # End of function record()
+
+    def record_export(self, report_type, file_name, seconds):
+        # Save the duration of one create_report() call, returns the record
+        try:
+            file_size = os.path.getsize(file_name)
+        except OSError:
+            file_size = 0
+
+        record = {'kind': 'export', 'time': time.time(), 'oc': self.oc, 'report_type': report_type,
+                  'file_name': file_name, 'seconds': seconds, 'bytes': file_size}
+
+        with self._lock:
+            export = self._exports.setdefault(report_type, [0, 0.0, 0])
+            export[0] += 1
+            export[1] += seconds
+            export[2] += file_size
+            self.records.append(record)
+
+        self._call_hooks(record)
+        return record
+
+    def prometheus(self):
+        # Metrics in the Prometheus text exposition format
+        oc = f'oc="{label_value(self.oc)}"'
+        lines = []
+
+        with self._lock:
+            lines.append("# HELP tsmrest_requests_total REST calls per TSM server")
+            lines.append("# TYPE tsmrest_requests_total counter")
+            for (tsm_server, status, source), count in sorted(self._requests.items()):
+                lines.append(f'tsmrest_requests_total{{{oc},tsm_server="{label_value(tsm_server)}",'
+                             f'status="{status}",source="{source}"}} {count}')
+
+            lines.append("# HELP tsmrest_phase_seconds Duration of the phases of the REST calls per TSM server")
+            lines.append("# TYPE tsmrest_phase_seconds histogram")
+            for (tsm_server, phase), histogram in sorted(self._phases.items()):
+                labels = f'{oc},tsm_server="{label_value(tsm_server)}",phase="{phase}"'
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'tsmrest_phase_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'tsmrest_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram[-1]}')
+                lines.append(f'tsmrest_phase_seconds_sum{{{labels}}} {histogram[-2]:.6f}')
+                lines.append(f'tsmrest_phase_seconds_count{{{labels}}} {histogram[-1]}')
+
+            lines.append("# HELP tsmrest_bytes_total Bytes of the REST requests (sent) and responses (received)")
+            lines.append("# TYPE tsmrest_bytes_total counter")
+            for (tsm_server, direction), count in sorted(self._bytes.items()):
+                lines.append(f'tsmrest_bytes_total{{{oc},tsm_server="{label_value(tsm_server)}",'
+                             f'direction="{direction}"}} {count}')
+
+            lines.append("# HELP tsmrest_rows_total Rows received per TSM server")
+            lines.append("# TYPE tsmrest_rows_total counter")
+            for tsm_server, count in sorted(self._rows.items()):
+                lines.append(f'tsmrest_rows_total{{{oc},tsm_server="{label_value(tsm_server)}"}} {count}')
+
+            lines.append("# HELP tsmrest_export_seconds Duration of create_report() per report type")
+            lines.append("# TYPE tsmrest_export_seconds summary")
+            for report_type, (count, seconds, file_size) in sorted(self._exports.items()):
+                lines.append(f'tsmrest_export_seconds_sum{{{oc},report_type="{report_type}"}} {seconds:.6f}')
+                lines.append(f'tsmrest_export_seconds_count{{{oc},report_type="{report_type}"}} {count}')
+
+            lines.append("# HELP tsmrest_export_bytes_total Size of the report files")
+            lines.append("# TYPE tsmrest_export_bytes_total counter")
+            for report_type, (count, seconds, file_size) in sorted(self._exports.items()):
+                lines.append(f'tsmrest_export_bytes_total{{{oc},report_type="{report_type}"}} {file_size}')
+
+        return '\n'.join(lines) + '\n'
+
+    # End of function prometheus()
+
+    def write_prometheus(self, file_name):
+        # Write prometheus() to a file, e.g. for the textfile collector of the node exporter (nightly cron jobs)
+        # Written to a temporary file and renamed: the collector never reads a half written file
+        directory = os.path.dirname(os.path.abspath(file_name))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.prometheus())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_name)
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+            self._requests.clear()
+            self._phases.clear()
+            self._bytes.clear()
+            self._rows.clear()
+            self._exports.clear()
+
+# End of class
@@ -0,0 +1,272 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import new_timing
+from paged_select import is_select, pageable
+from result_set import RowStream
+from tsmrest import TsmRest
+
+# TSM servers managed by several Operations Centers (OC), used like one TsmRest instance
+# Every OC has its own TsmRest instance: own connection pool (max_connections), concurrency budget (max_workers),
+# cache, metrics and circuit breaker. The OCs are queried at the same time, each with the deadline: a slow OC does
+# not hold back the others. The results are merged in the order of the TSM server list.
+#
+#     cluster = TsmCluster({'oc1.company.com:11090': ['TSM01', 'TSM02'],
+#                           'oc2.company.com:11090': ['TSM03', 'TSM04']}, max_workers=4)
+#     cluster.run_command(['TSM01', 'TSM03'], "admin", "password", "q stgpool")
+#     cluster.create_report("XLSX", 'stgpools.xlsx', "Storage Pools")
+#
+# page_size: large SELECT commands with an ORDER BY are fetched in pages on every OC (see TsmRest.query_paged())
+
+
+class TsmCluster:
+
+    command_deadline = None  # Max duration of one call (seconds), per OC. None = no limit
+    page_size = None  # SELECT commands with an ORDER BY are fetched in pages of page_size rows. None = no paging
+
+    def __init__(self, oc_servers, max_workers=4):
+        # oc_servers: {'address:port': [TSM servers]} or {(address, port): [TSM servers]}
+        # max_workers: TSM servers queried at the same time per OC
+        self.instances = {}   # OC 'address:port' -> TsmRest
+        self.server_oc = {}   # TSM server (upper case) -> OC 'address:port'
+        self.tsm_servers = []
+        self.tsm_command = None
+        self.raw_result = []
+        self.parsed_result = {}
+
+        for oc, tsm_servers in oc_servers.items():
+            oc_address, oc_port = oc if isinstance(oc, tuple) else oc.rsplit(':', 1)
+            self.add_oc(oc_address, oc_port, tsm_servers, max_workers)
+
+    def add_oc(self, oc_address, oc_port, tsm_servers, max_workers=4):
+        # Add an OC and the TSM servers it manages. Returns its TsmRest instance (settings per OC)
+        oc_key = f"{oc_address}:{oc_port}"
+        if oc_key not in self.instances:
+            self.instances[oc_key] = TsmRest(oc_address, str(oc_port))
+        instance = self.instances[oc_key]
+        instance.max_workers = max_workers
+
+        for tsm_server in tsm_servers:
+            other_oc = self.server_oc.get(tsm_server.upper())
+            if other_oc is not None and other_oc != oc_key:
+                print(f"TsmCluster(): TSM server {tsm_server} is managed by {other_oc} and {oc_key}")
+                exit(1)
+            self.server_oc[tsm_server.upper()] = oc_key
+
+        return instance
+
+    def instance(self, tsm_server):
+        # TsmRest instance of the OC of a TSM server, None if the TSM server is not in the cluster
+        oc_key = self.server_oc.get(tsm_server.upper())
+        return self.instances[oc_key] if oc_key is not None else None
+
+    @property
+    def all_servers(self):
+        return list(self.server_oc)
+
+    def run_command(self, tsm_servers, tsm_user, tsm_pass, tsm_command, deadline=None):
+        # Same as TsmRest.run_command(): self.parsed_result and self.raw_result are set
+        # tsm_servers: None = all TSM servers of the cluster
+        if tsm_servers is None:
+            tsm_servers = self.all_servers
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+        self.tsm_servers = tsm_servers
+        self.tsm_command = tsm_command
+
+        self.parsed_result, self.raw_result = self.query(tsm_servers, tsm_user, tsm_pass, tsm_command, deadline)
+
+    def query(self, tsm_servers, tsm_user, tsm_pass, tsm_command, deadline=None):
+        # Same as TsmRest.query(): returns tuple (parsed_result, raw_result) with the rows of every OC
+        if tsm_servers is None:
+            tsm_servers = self.all_servers
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+
+        # Opt-in: large SELECT commands in pages
+        if self.page_size and is_select(tsm_command):
+            is_pageable, reason = pageable(tsm_command)
+            if is_pageable:
+                return self.query_paged(tsm_servers, tsm_user, tsm_pass, tsm_command, deadline)
+            print(f"\nNo paging: {reason}. The command is sent in one request")
+
+        print(f"\nExecuting your command on {len(tsm_servers)} TSM server(s)...")
+        timings = [[new_timing() for tsm_server in tsm_servers]]
+        responses = self.fetch_matrix(tsm_servers, tsm_user, tsm_pass, [tsm_command], deadline, timings)
+        return self.merge_responses(tsm_servers, tsm_command, responses[0], timings[0])
+
+    def run_commands(self, tsm_servers, tsm_user, tsm_pass, tsm_commands, deadline=None):
+        # Same as TsmRest.run_commands(): returns {name (or command): parsed_result}, feeds ReportSession.add_sheets()
+        if tsm_servers is None:
+            tsm_servers = self.all_servers
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+        if isinstance(tsm_commands, str):
+            tsm_commands = [tsm_commands]
+        if not isinstance(tsm_commands, dict):
+            tsm_commands = {tsm_command: tsm_command for tsm_command in tsm_commands}
+
+        if deadline is None:
+            deadline = self.command_deadline
+        start = time.perf_counter()
+
+        # Large SELECT commands are fetched in pages after the batch, with the time left (see query_paged())
+        paged = {}
+        if self.page_size:
+            paged = {name: tsm_command for name, tsm_command in tsm_commands.items()
+                     if is_select(tsm_command) and pageable(tsm_command)[0]}
+        batch = {name: tsm_command for name, tsm_command in tsm_commands.items() if name not in paged}
+
+        print(f"\nExecuting {len(batch)} command(s) on {len(tsm_servers)} TSM server(s)...")
+        timings = [[new_timing() for tsm_server in tsm_servers] for tsm_command in batch]
+        responses = self.fetch_matrix(tsm_servers, tsm_user, tsm_pass, list(batch.values()), deadline, timings)
+
+        results = {}
+        for (name, tsm_command), command_responses, command_timings in zip(batch.items(), responses, timings):
+            print(f"{tsm_command}:")
+            results[name] = self.merge_responses(tsm_servers, tsm_command, command_responses, command_timings)[0]
+
+        for name, tsm_command in paged.items():
+            time_left = None if deadline is None else max(0.0, deadline - (time.perf_counter() - start))
+            results[name] = self.query_paged(tsm_servers, tsm_user, tsm_pass, tsm_command, time_left)[0]
+
+        return {name: results[name] for name in tsm_commands}
+
+    def query_paged(self, tsm_servers, tsm_user, tsm_pass, tsm_command, deadline=None, page_size=None):
+        # Same as TsmRest.query_paged(): the pages are fetched on every OC at the same time (fetch_pages() of its
+        # instance, max_workers pages per OC) and parsed in the order of tsm_servers
+        if deadline is None:
+            deadline = self.command_deadline
+        if page_size is None:
+            page_size = self.page_size
+
+        print(f"\nExecuting your command on {len(tsm_servers)} TSM server(s) in pages of {page_size} rows...")
+        oc_positions = self.oc_positions(tsm_servers)
+        pages = [None] * len(tsm_servers)
+
+        def fetch_oc(oc_key, positions):
+            instance = self.instances[oc_key]
+            return instance.fetch_pages([tsm_servers[position] for position in positions], tsm_user, tsm_pass,
+                                        tsm_command, page_size, instance.max_workers, deadline)
+
+        if oc_positions:
+            with ThreadPoolExecutor(max_workers=len(oc_positions)) as executor:
+                futures = {oc_key: executor.submit(fetch_oc, oc_key, positions)
+                           for oc_key, positions in oc_positions.items()}
+            for oc_key, positions in oc_positions.items():
+                for position, server_pages in zip(positions, futures[oc_key].result()):
+                    pages[position] = server_pages
+
+        parsed_result = {}
+        raw_result = []
+        for tsm_server, server_pages in zip(tsm_servers, pages):
+            instance = self.instance(tsm_server)
+            if instance is not None:
+                instance.parse_pages([tsm_server], tsm_command, [server_pages], page_size, parsed_result, raw_result)
+            else:
+                self.unknown_server(tsm_server, parsed_result)
+
+        return self.complete_result(tsm_servers, tsm_command, parsed_result), raw_result
+
+    # End of function query_paged()
+
+    def oc_positions(self, tsm_servers):
+        # Positions of the TSM servers per OC: {OC: [positions in tsm_servers]}, TSM servers of no OC are left out
+        oc_positions = {}
+        for position, tsm_server in enumerate(tsm_servers):
+            oc_key = self.server_oc.get(tsm_server.upper())
+            if oc_key is not None:
+                oc_positions.setdefault(oc_key, []).append(position)
+        return oc_positions
+
+    def fetch_matrix(self, tsm_servers, tsm_user, tsm_pass, tsm_commands, deadline=None, timings=None):
+        # TsmRest.fetch_matrix() on every OC at the same time, each OC with its own pool and max_workers
+        # Returns a list per command of tuples (raw_rest_reply, exception_msg), in the order of tsm_servers
+        if deadline is None:
+            deadline = self.command_deadline
+
+        unknown_msg = "ERROR: TSM server is not managed by an OC of the cluster"
+        responses = [[(None, unknown_msg)] * len(tsm_servers) for tsm_command in tsm_commands]
+
+        oc_positions = self.oc_positions(tsm_servers)
+        if not oc_positions:
+            return responses
+
+        def fetch_oc(oc_key, positions):
+            instance = self.instances[oc_key]
+            oc_timings = None
+            if timings is not None:
+                oc_timings = [[command_timings[position] for position in positions] for command_timings in timings]
+            return instance.fetch_matrix([tsm_servers[position] for position in positions], tsm_user, tsm_pass,
+                                         tsm_commands, instance.max_workers, deadline, oc_timings)
+
+        # One thread per OC: it waits for the threads of its own TsmRest instance (max_workers)
+        with ThreadPoolExecutor(max_workers=len(oc_positions)) as executor:
+            futures = {oc_key: executor.submit(fetch_oc, oc_key, positions)
+                       for oc_key, positions in oc_positions.items()}
+
+        for oc_key, positions in oc_positions.items():
+            for command_index, oc_responses in enumerate(futures[oc_key].result()):
+                for position, response in zip(positions, oc_responses):
+                    responses[command_index][position] = response
+
+        return responses
+
+    # End of function fetch_matrix()
+
+    def merge_responses(self, tsm_servers, tsm_command, responses, timings):
+        # One parsed_result from the responses of all OCs, in the order of tsm_servers
+        # Every TSM server is parsed by the instance of its OC (metrics per OC)
+        parsed_result = {}
+        raw_result = []
+
+        for tsm_server, response, timing in zip(tsm_servers, responses, timings):
+            instance = self.instance(tsm_server)
+            if instance is not None:
+                instance.parse_responses([tsm_server], tsm_command, [response], [timing], parsed_result, raw_result)
+            else:
+                self.unknown_server(tsm_server, parsed_result)
+
+        return self.complete_result(tsm_servers, tsm_command, parsed_result), raw_result
+
+    # End of function merge_responses()
+
+    def unknown_server(self, tsm_server, parsed_result):
+        # Error record of a TSM server that no OC of the cluster manages
+        exception_msg = "ERROR: TSM server is not managed by an OC of the cluster"
+        next(iter(self.instances.values())).result_items(parsed_result).append(
+            {'TSM SERVER': tsm_server + ' - ' + exception_msg})
+        print(f" -> {tsm_server} : {exception_msg}")
+
+    @staticmethod
+    def complete_result(tsm_servers, tsm_command, parsed_result):
+        parsed_result['cmd'] = tsm_command
+        parsed_result['tsm_srv'] = tsm_servers
+
+        # Same as TsmRest.parse_responses(): 'No Match Found' across all TSM servers
+        if 'items' in parsed_result and 'hdr' not in parsed_result:
+            parsed_result['hdr'] = ['TSM SERVER']
+        return parsed_result
+
+    def create_report(self, report_type, file_name=None, sheet_name='Report', sheet_tab_color='FFFFFF',
+                      streaming=False, compress=False, rows=None, table=None, col_names=None):
+        # TsmRest.create_report() of the merged self.parsed_result (same arguments). The rows are passed to the
+        # instance of the first OC with their own result (columns, command): its parsed_result is not changed
+        if rows is None:
+            if 'items' not in self.parsed_result:
+                print("No data to print, this is not normal. All exceptions should be handled. Check the 'msg' key")
+                exit(1)
+            rows = RowStream(iter(self.parsed_result['items']), self.parsed_result)
+            if col_names is None:
+                col_names = self.parsed_result['hdr']
+
+        report_instance = next(iter(self.instances.values()))
+        report_instance.create_report(report_type, file_name, sheet_name, sheet_tab_color, streaming, compress,
+                                      rows, table, col_names)
+
+    @property
+    def pool_stats(self):
+        # Connection pool statistics per OC
+        return {oc_key: instance.pool_stats for oc_key, instance in self.instances.items()}
+
+# End of class
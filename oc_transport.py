@@ -0,0 +1,175 @@
+import http.client
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+from contextlib import contextmanager
+
+from metrics import add_phase
+
+
+class OcConnectionPool:
+    # Pool of keep-alive HTTPS connections to one Operations Center (OC)
+    # All connections share one SSL context, idle connections are reused for the next request.
+    # The number of open connections (busy + idle) to the OC is capped at max_connections.
+
+    def __init__(self, oc_address, oc_port, max_connections=10):
+        self.oc_address = oc_address
+        self.oc_port = int(oc_port)
+        self.max_connections = max_connections
+
+        # One SSL context for every connection. Ignores cert warnings (CERT_NONE), like an empty ssl.SSLContext()
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+        self._idle = []                                             # Idle connections, last used on top
+        self._lock = threading.Lock()                               # Protects self._idle and self.stats
+        self._slots = threading.BoundedSemaphore(max_connections)   # Caps the connections per OC
+
+        # Pool statistics: to validate that connections are reused
+        self.stats = {
+            'requests': 0,              # HTTP requests sent
+            'new_connections': 0,       # TCP connect + TLS handshake performed
+            'reused_connections': 0,    # Requests sent on an idle keep-alive connection
+            'retries': 0,               # Requests resent because the OC closed an idle connection
+            'closed_connections': 0,    # Connections closed (by OC, error or partial read)
+        }
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _new_connection(self, timeout, timing=None):
+        # TCP connect + TLS handshake (same steps as HTTPSConnection.connect(), timed separately)
+        conn = http.client.HTTPSConnection(self.oc_address, self.oc_port, timeout=timeout, context=self.ssl_context)
+        sock = None
+        try:
+            start = time.perf_counter()
+            sock = socket.create_connection((self.oc_address, self.oc_port), timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connected = time.perf_counter()
+            conn.sock = self.ssl_context.wrap_socket(sock, server_hostname=self.oc_address)
+            add_phase(timing, 'connect', connected - start)
+            add_phase(timing, 'tls', time.perf_counter() - connected)
+        except OSError as e:
+            if sock is not None:
+                sock.close()
+            conn.close()
+            # Same exception urlopen() raises, so callers handle pooled and non-pooled requests the same way
+            raise urllib.error.URLError(e)
+
+        self._count('new_connections')
+        return conn
+
+    def _get_connection(self, timeout, timing=None):
+        # Returns tuple (connection, reused)
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+
+        if conn is None:
+            return self._new_connection(timeout, timing), False
+
+        conn.timeout = timeout
+        conn.sock.settimeout(timeout)
+        self._count('reused_connections')
+        return conn, True
+
+    def _close(self, conn):
+        conn.close()
+        self._count('closed_connections')
+
+    def _request(self, conn, path, body, headers, timing):
+        # Send the request and wait for the response headers (phase 'wait': the OC waits for the TSM server)
+        start = time.perf_counter()
+        conn.request('POST', path, body, headers)
+        response = conn.getresponse()
+        add_phase(timing, 'wait', time.perf_counter() - start)
+        return response
+
+    def _send(self, path, body, headers, timeout, timing=None):
+        # Send the request, returns tuple (connection, response)
+        conn, reused = self._get_connection(timeout, timing)
+        self._count('requests')
+        if timing is not None:
+            timing['reused'] = reused
+            timing['bytes_sent'] += len(body)
+
+        try:
+            return conn, self._request(conn, path, body, headers, timing)
+
+        # The OC closed the keep-alive connection while it was idle: retry once on a new connection
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            self._close(conn)
+            if not reused:
+                raise
+
+        except Exception:
+            self._close(conn)
+            raise
+
+        self._count('retries')
+        conn = self._new_connection(timeout, timing)
+        if timing is not None:
+            timing['reused'] = False
+        try:
+            return conn, self._request(conn, path, body, headers, timing)
+        except Exception:
+            self._close(conn)
+            raise
+
+    def _release(self, conn, response):
+        # Keep the connection if the OC allows it and the response body was read completely
+        if response is not None and not response.will_close and response.isclosed():
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            self._close(conn)
+
+    @contextmanager
+    def open(self, path, body, headers, timeout, timing=None):
+        # Send a POST request to the OC and yield the http.client.HTTPResponse (body not read yet)
+        # HTTP status >= 400 raises urllib.error.HTTPError, like urlopen()
+        # Read the whole body to give the connection back to the pool, otherwise it is closed
+        # timing: optional dict (metrics.new_timing()) that gets the connect, tls and wait phases
+        start = time.perf_counter()
+        self._slots.acquire()
+        add_phase(timing, 'queue', time.perf_counter() - start)
+        conn = None
+        response = None
+        try:
+            conn, response = self._send(path, body, headers, timeout, timing)
+
+            if response.status >= 400:
+                response.read()  # Empty the socket, the connection stays usable
+                url = f"https://{self.oc_address}:{self.oc_port}{path}"
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+
+            yield response
+
+        finally:
+            if conn is not None:
+                self._release(conn, response)
+            self._slots.release()
+
+    # End of function open()
+
+    def post(self, path, body, headers, timeout, timing=None):
+        # Send a POST request to the OC, returns the response body (bytes)
+        with self.open(path, body, headers, timeout, timing) as response:
+            start = time.perf_counter()
+            http_response = response.read()
+            add_phase(timing, 'read', time.perf_counter() - start)
+            if timing is not None:
+                timing['bytes_received'] += len(http_response)
+            return http_response
+
+    def close(self):
+        # Close all idle connections
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+# End of class
@@ -0,0 +1,41 @@
+import re
+
+# Paging of SELECT commands (see TsmRest.query_paged())
+# A page is the SELECT with a window: "... ORDER BY ... OFFSET 2000 ROWS FETCH FIRST 1000 ROWS ONLY"
+# The SELECT needs an ORDER BY (on a unique key), otherwise the rows of the pages can overlap or be missing
+
+
+def unquoted(command):
+    # The command without the text between quotes (a 'where' value can contain the words 'order by')
+    return ''.join(part for i, part in enumerate(re.split(r"('[^']*'|\"[^\"]*\")", command)) if i % 2 == 0)
+
+
+def is_select(command):
+    return re.match(r'\s*select\s', command, re.IGNORECASE) is not None
+
+
+def pageable(command):
+    # Returns tuple (pageable, reason). reason explains why a command is not pageable
+    if not is_select(command):
+        return False, "not a SELECT command"
+
+    command = unquoted(command).lower()
+    if re.search(r'\border\s+by\b', command) is None:
+        return False, "the SELECT has no ORDER BY"
+    if re.search(r'\b(fetch\s+first|offset\s+\d+\s+rows?|limit\s+\d)\b', command) is not None:
+        return False, "the SELECT already limits its rows"
+    return True, ''
+
+
+def page_command(command, page, page_size):
+    # SELECT of page number 'page' (0 = first page)
+    command = command.strip().rstrip(';').rstrip()
+    return f"{command} OFFSET {page * page_size} ROWS FETCH FIRST {page_size} ROWS ONLY"
+
+
+def reply_rows(raw_rest_reply):
+    # Number of rows in a REST response. 0 for 'no match found' ({'msg': ...} or [[]])
+    try:
+        return len(raw_rest_reply[0][0].get('items', ()))
+    except (IndexError, KeyError, TypeError, AttributeError):
+        return 0
@@ -0,0 +1,63 @@
+import threading
+import time
+
+# Token bucket: at most 'rate' REST calls per second on average, bursts of up to 'burst' calls
+# TsmRest.rate_limits is a list of buckets: every REST call (retries and pages included, not cache hits) waits
+# for a token of each of them. One bucket can be shared by several TsmRest instances (global limit of a
+# TsmCluster or a Scheduler) while another bucket belongs to one OC.
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        # rate: tokens per second, burst: max number of tokens saved up (default: one second of tokens)
+        if rate <= 0:
+            raise ValueError(f"TokenBucket(): rate must be > 0, not {rate}")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.stats = {'acquired': 0, 'throttled': 0, 'wait_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        # Take the tokens if they are available now. Returns True or False, never waits
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                self.stats['acquired'] += 1
+                return True
+            return False
+
+    def reserve(self, tokens=1):
+        # Take the tokens now, returns the time (seconds) to wait before they may be used. The caller waits:
+        # time.sleep() (acquire) or asyncio.sleep() (AsyncTsmRest). Waiting callers are served in the order they came
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.stats['acquired'] += 1
+            if wait:
+                self.stats['throttled'] += 1
+                self.stats['wait_seconds'] += wait
+        return wait
+
+    def acquire(self, tokens=1):
+        # Wait until the tokens are available and take them. Returns the waiting time (seconds)
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def status(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {'rate': self.rate, 'burst': self.burst, 'tokens': round(self.tokens, 3), **self.stats}
+
+# End of class
@@ -0,0 +1,124 @@
+import os.path
+import re
+
+# 3rd Party Modules
+from openpyxl import Workbook, load_workbook
+
+# Project specific functions
+from extra_functions import create_xls_styles, write_sheet, write_only_sheet, xlsx_rows
+
+
+def sheet_title(name, used_titles):
+    # Valid Excel sheet title for name (e.g. a command of run_commands(): 'select * from nodes'):
+    # without the characters []:*?/\ and leading or trailing quotes, max 31 characters, and not already in
+    # used_titles (Excel compares the titles without case): 'Title (2)', 'Title (3)', ...
+    title = re.sub(r'\s+', ' ', re.sub(r'[\[\]:*?/\\]', '', str(name)))
+    title = title.strip().strip("'").strip()[:31].rstrip() or 'Sheet'
+    used = {used_title.lower() for used_title in used_titles}
+    unique_title = title
+    number = 2
+    while unique_title.lower() in used:
+        suffix = f" ({number})"
+        unique_title = title[:31 - len(suffix)].rstrip() + suffix
+        number += 1
+    return unique_title
+
+
+class ReportSession:
+    # Excel report with several sheets, one per parsed_result, saved once at the end
+    # Replaces one create_report("XLSX", same_file, sheet_name=...) call per command, where every call
+    # loads the (growing) file again and saves it again.
+    #
+    # with ReportSession('daily.xlsx') as report:
+    #     my_api.run_command(tsm_servers, user, password, "query stgpool")
+    #     report.add_sheet(my_api.parsed_result, "Storage Pools", "349DCA")
+    #     ...
+    #
+    # streaming=True: write-only workbook, every sheet is written to disk when it is added (flat memory use),
+    # always creates a new file. Otherwise the workbook stays in memory and an existing file gets new sheets.
+
+    def __init__(self, file_name, streaming=False):
+
+        # Validate that file_name is a string with more than 3 chars
+        if not isinstance(file_name, str) or len(file_name) < 3:
+            print("ReportSession(): Incorrect file_name passed")
+            exit(1)
+
+        # Validate target directory to store report exists
+        if not os.path.exists(os.path.abspath(os.path.dirname(file_name))):
+            print("ReportSession(): Report directory does not exist")
+            exit(1)
+
+        self.file_name = file_name
+        self.streaming = streaming
+        self.sheet_count = 0
+
+        if streaming:
+            self.wb = Workbook(write_only=True)
+
+        # If the Excel file already exists then load it (once). We'll place our data in new sheets
+        elif os.path.exists(file_name):
+            try:
+                self.wb = load_workbook(file_name)
+            except Exception:
+                print(f"ERROR: Could not access the target file {file_name}")
+                exit(1)
+
+        else:
+            self.wb = Workbook()
+
+            # Since this is a new file we can remove the 'default' sheet
+            for sheet in ['Sheet', 'Sheet1', 'Sheet 1']:
+                if sheet in self.wb.sheetnames:
+                    del self.wb[sheet]
+
+        # Define styles (once)
+        create_xls_styles(self.wb)
+
+    def add_sheet(self, parsed_result, sheet_name='Report', sheet_tab_color='FFFFFF'):
+        # Add parsed_result (TsmRest.parsed_result) as a new sheet
+        # sheet_name is made a valid and unique sheet title (see sheet_title()), the title is returned
+
+        # Validate we have data to print
+        if 'items' not in parsed_result:
+            print("No data to print, this is not normal. All exceptions should be handled. Check the 'msg' key")
+            exit(1)
+
+        col_names = parsed_result['hdr']
+        rows = xlsx_rows(col_names, parsed_result['items'])
+        sheet_name = sheet_title(sheet_name, self.wb.sheetnames)
+
+        if self.streaming:
+            write_only_sheet(self.wb, sheet_name, sheet_tab_color, col_names, rows)
+        else:
+            write_sheet(self.wb, sheet_name, sheet_tab_color, col_names, rows)
+
+        self.sheet_count += 1
+        return sheet_name
+
+    def add_sheets(self, results, sheet_tab_color='FFFFFF'):
+        # Add several results as sheets: dict {sheet name: parsed_result}, e.g. the result of run_commands()
+        for sheet_name, parsed_result in results.items():
+            self.add_sheet(parsed_result, sheet_name, sheet_tab_color)
+
+    def save(self):
+        # Save the Excel file (once, after the last sheet was added)
+        if self.sheet_count == 0:
+            print(f"ReportSession(): No sheets added, {self.file_name} not saved")
+            return
+
+        try:
+            self.wb.save(self.file_name)
+        except Exception:
+            print(f"ERROR: Could not save report file {self.file_name}")
+            exit(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Save the report, unless an exception was raised while it was built
+        if exc_type is None:
+            self.save()
+
+# End of class
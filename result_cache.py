@@ -0,0 +1,192 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_command(command):
+    # TSM commands are not case sensitive and ignore extra blanks, text between quotes is kept as-is
+    # "Query  STGpool" and "query stgpool" give the same cache key
+    parts = re.split(r"('[^']*'|\"[^\"]*\")", command.strip())
+    normalized = ''.join(part if i % 2 else re.sub(r'\s+', ' ', part).lower() for i, part in enumerate(parts))
+    return normalized.rstrip('; ')
+
+
+class ResultCache:
+    # Cache of REST responses (JSON bytes) per OC, TSM server, TSM user and command (see TsmRest.cache)
+    # Entries expire after a TTL that depends on the command, the least recently used entries are evicted
+    # when max_entries or max_bytes is exceeded. With cache_dir, entries are also saved on disk, so several
+    # (short-lived) processes share them.
+    #
+    # ttls: {command prefix: seconds}, e.g. {'q stgpool': 300, 'q session': 5, 'select * from actlog': 0}
+    #       The longest matching prefix wins, commands without a match use default_ttl. TTL 0 = never cached
+    #       default_ttl applies to read-only commands only (query, select, show): other commands (cancel process,
+    #       update ..) are never cached, unless a prefix in ttls gives them a TTL
+
+    def __init__(self, default_ttl=60, ttls=None, max_entries=256, max_bytes=64 * 1024 * 1024, cache_dir=None):
+        self.default_ttl = default_ttl
+        self.ttls = {normalize_command(prefix): ttl for prefix, ttl in (ttls or {}).items()}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+
+        self._entries = OrderedDict()   # key: (expires, body), least recently used first
+        self._size = 0                  # Total bytes of the bodies in self._entries
+        self._lock = threading.Lock()
+
+        self.stats = {'hits': 0, 'misses': 0, 'disk_hits': 0, 'expired': 0, 'evictions': 0, 'stores': 0}
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    def ttl(self, command):
+        # TTL (seconds) for a command: longest matching prefix in self.ttls, else default_ttl (read-only commands)
+        from server_health import read_only  # server_health imports this module
+        command = normalize_command(command)
+        best_prefix = None
+        for prefix in self.ttls:
+            if command.startswith(prefix) and (best_prefix is None or len(prefix) > len(best_prefix)):
+                best_prefix = prefix
+        if best_prefix is not None:
+            return self.ttls[best_prefix]
+        return self.default_ttl if read_only(command) else 0
+
+    @staticmethod
+    def key(oc, tsm_server, tsm_user, command):
+        # The TSM user is part of the key: another admin can have other privileges
+        return oc, tsm_server.upper(), tsm_user.upper(), normalize_command(command)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha256(repr(key).encode()).hexdigest() + '.cache')
+
+    def get(self, oc, tsm_server, tsm_user, command):
+        # Returns the cached REST response (bytes), or None
+        key = self.key(oc, tsm_server, tsm_user, command)
+        now = time.time()
+        expired = False
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry[1]
+                self._remove(key)
+                expired = True
+
+        if self.cache_dir is not None:
+            body, disk_expired = self._disk_get(key, now)
+            if body is not None:
+                with self._lock:
+                    self.stats['hits'] += 1
+                    self.stats['disk_hits'] += 1
+                return body
+            expired = expired or disk_expired
+
+        with self._lock:
+            self.stats['misses'] += 1
+            if expired:
+                self.stats['expired'] += 1
+        return None
+
+    # End of function get()
+
+    def put(self, oc, tsm_server, tsm_user, command, body):
+        # Save a REST response (bytes), unless the TTL of the command is 0
+        ttl = self.ttl(command)
+        if ttl <= 0 or len(body) > self.max_bytes:
+            return
+
+        key = self.key(oc, tsm_server, tsm_user, command)
+        expires = time.time() + ttl
+
+        with self._lock:
+            self._store(key, expires, body)
+            self.stats['stores'] += 1
+
+        if self.cache_dir is not None:
+            self._disk_put(key, expires, body)
+
+    def _store(self, key, expires, body):
+        # Add entry in memory and evict the least recently used entries if needed (lock must be held)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires, body)
+        self._size += len(body)
+
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.stats['evictions'] += 1
+
+    def _remove(self, key):
+        expires, body = self._entries.pop(key)
+        self._size -= len(body)
+
+    def _disk_get(self, key, now):
+        # Returns tuple (body or None, expired)
+        # Cached file: first line is the expiry time, followed by the REST response
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires = float(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None, False
+
+        if expires <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, True
+
+        with self._lock:
+            self._store(key, expires, body)
+        return body, False
+
+    def _disk_put(self, key, expires, body):
+        # Write to a temporary file and rename it: other processes never read a half written file
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(f"{expires}\n".encode())
+                f.write(body)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            pass  # The disk cache is optional, the memory cache still works
+
+    def purge(self):
+        # Remove all expired entries, in memory and on disk
+        now = time.time()
+        with self._lock:
+            for key in [key for key, (expires, body) in self._entries.items() if expires <= now]:
+                self._remove(key)
+                self.stats['expired'] += 1
+
+        if self.cache_dir is not None:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith('.cache'):
+                    path = os.path.join(self.cache_dir, file_name)
+                    try:
+                        with open(path, 'rb') as f:
+                            expires = float(f.readline())
+                        if expires <= now:
+                            os.remove(path)
+                    except (OSError, ValueError):
+                        pass
+
+    def clear(self):
+        # Remove all entries from memory (the disk cache is kept)
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+# End of class
@@ -0,0 +1,466 @@
+import math
+import operator
+import re
+
+# Optional: with NumPy the filters, sorts and aggregates run as array operations. Without it, pure Python
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from result_set import CompactItems
+
+# Query layer over a parsed_result (see README): filter, group by, aggregate, sort without loops over dicts
+#
+#     frame = ResultFrame(my_api.parsed_result)
+#     per_node = (frame.where('Type', '==', 'Bkup')
+#                      .group_by('TSM SERVER', 'Node Name')
+#                      .agg(total_gb=('Physical Space Occupied (MB)', 'sum', 'GB'), filespaces=('FSID', 'count')))
+#     top10 = per_node.top(10, 'total_gb')
+#
+# Values like '50 GB' (fix_value() of [{'val': 50}, {'val': {'def': 'GB'}}]) are split once per column into a
+# number and a unit, and kept in a cache. Size units are converted (unit='GB'). A number without unit gets the
+# unit of the column title if there is one: 'Physical Space Occupied (MB)'
+# Without unit, the sizes of a column are converted to the unit of the column (see ResultFrame.unit()):
+# '2 GB' and '1024 MB' are 2 and 1, never 2 and 1024
+
+SIZE_UNITS = {'B': 1, 'BYTES': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4, 'PB': 1024 ** 5}
+
+VALUE_UNIT = re.compile(r'^\s*(-?\d[\d,]*(?:\.\d+)?)\s*([A-Za-z%]+)?\s*$')
+TITLE_UNIT = re.compile(r'\((\w+)\)\s*$')
+
+MISSING_VALUES = (None, '-', '')
+
+COMPARE = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+           '>': operator.gt, '>=': operator.ge}
+
+AGGREGATES = ('sum', 'count', 'mean', 'min', 'max', 'distinct')
+
+
+def split_value(value):
+    # Number and unit of a cell: '50 GB' -> (50.0, 'GB'), 12 -> (12.0, None), '-' or text -> (None, None)
+    if isinstance(value, bool):
+        return None, None
+    if isinstance(value, (int, float)):
+        return float(value), None
+    if isinstance(value, str):
+        match = VALUE_UNIT.match(value)
+        if match:
+            return float(match.group(1).replace(',', '')), match.group(2)
+    return None, None
+
+
+def convert(number, unit, target_unit):
+    # Number in 'unit' converted to target_unit. None if the units are not size units (or unknown)
+    if target_unit is None or unit == target_unit:
+        return number
+    from_factor = SIZE_UNITS.get(unit.upper()) if unit else None
+    to_factor = SIZE_UNITS.get(target_unit.upper())
+    if from_factor is None or to_factor is None:
+        return None
+    return number * from_factor / to_factor
+
+
+def is_missing(value):
+    return value is None or (isinstance(value, str) and value in MISSING_VALUES)
+
+
+def value_key(value):
+    # Key of a cell for group_by() and 'distinct': the value and its type (1, 1.0 and '1' are different values),
+    # lists and dicts by their text (not hashable)
+    if isinstance(value, (list, dict)):
+        return type(value), str(value)
+    return type(value), value
+
+
+def factorize(keys):
+    # Returns tuple (codes, first_index): number of the key of every item (order of appearance), index of the
+    # first item of every key. Same codes with and without NumPy: NumPy only does the aggregation
+    numbers = {}
+    codes = []
+    first_index = []
+    for index, key in enumerate(keys):
+        code = numbers.get(key)
+        if code is None:
+            code = numbers[key] = len(first_index)
+            first_index.append(index)
+        codes.append(code)
+    return codes, first_index
+
+
+class ResultFrame:
+    # Columnar, read-only view of rows. Every operation returns a new frame: the columns are shared,
+    # a frame only has the positions of its rows (self._positions)
+
+    def __init__(self, result, columns=None):
+        # result: parsed_result (dict with 'items'), list of row dicts, CompactItems, or {column: list of values}
+        if isinstance(result, dict) and 'items' in result:
+            columns = columns or result.get('hdr')
+            result = result['items']
+
+        if isinstance(result, CompactItems):
+            columns = columns or list(result.columns)
+            data = {column: result.column(column) for column in columns}
+            length = len(result)
+
+        elif isinstance(result, dict):
+            columns = columns or list(result)
+            data = {column: list(result[column]) for column in columns}
+            length = len(data[columns[0]]) if columns else 0
+
+        else:
+            rows = result if isinstance(result, list) else list(result)
+            if not columns:
+                columns = list(dict.fromkeys(key for row in rows for key in row))
+            data = {column: [row.get(column) for row in rows] for column in columns}
+            length = len(rows)
+
+        self.columns = list(columns)
+        self._data = data
+        self._length = length
+        self._positions = None  # None: all rows, in order
+        self._cache = {}        # Numeric columns and NumPy arrays, shared by the frames derived from this one
+
+    def _derive(self, positions, columns=None):
+        # New frame with the same columns and other rows
+        frame = ResultFrame.__new__(ResultFrame)
+        frame.columns = self.columns if columns is None else columns
+        frame._data = self._data
+        frame._length = self._length
+        frame._positions = positions
+        frame._cache = self._cache
+        return frame
+
+    def positions(self):
+        # Positions of the rows of this frame: NumPy array or list
+        if self._positions is not None:
+            return self._positions
+        return numpy.arange(self._length) if numpy is not None else range(self._length)
+
+    def __len__(self):
+        return self._length if self._positions is None else len(self._positions)
+
+    # Columns
+
+    def _raw_array(self, column):
+        # Whole column as NumPy object array (cached)
+        key = ('raw', column)
+        if key not in self._cache:
+            self._cache[key] = numpy.fromiter(self._data[column], dtype=object, count=self._length)
+        return self._cache[key]
+
+    def _split_column(self, column):
+        # Whole column split into (number, unit) pairs (cached). A number without unit gets the unit of the title
+        key = ('split', column)
+        if key in self._cache:
+            return self._cache[key]
+
+        title_unit = TITLE_UNIT.search(str(column))
+        title_unit = title_unit.group(1) if title_unit else None
+        split_values = {}  # The same strings come back often ('0.00 MB'): split them once
+        pairs = []
+        for value in self._data[column]:
+            if isinstance(value, str):
+                if value not in split_values:
+                    split_values[value] = split_value(value)
+                number, value_unit = split_values[value]
+            else:
+                number, value_unit = split_value(value)
+            pairs.append((number, (value_unit or title_unit) if number is not None else None))
+
+        self._cache[key] = pairs
+        return pairs
+
+    def unit(self, column):
+        # Size unit of the numbers of a column when no unit is given: the unit of the title, else the first size
+        # unit in the values. None if the column has no size units
+        pairs = self._split_column(column)
+        return next((value_unit for number, value_unit in pairs
+                     if value_unit is not None and value_unit.upper() in SIZE_UNITS), None)
+
+    def _numeric(self, column, unit=None):
+        # Whole column as numbers (cached): tuple (numbers, is_numeric)
+        # numbers: NumPy float array (NaN = no number) or list (None = no number)
+        # is_numeric: every value that is not missing is a number
+        # unit None: sizes in the unit of the column (self.unit()), other numbers as they are
+        key = ('numeric', column, unit)
+        if key in self._cache:
+            return self._cache[key]
+
+        target_unit = unit or self.unit(column)
+        numbers = []
+        is_numeric = True
+
+        for value, (number, value_unit) in zip(self._data[column], self._split_column(column)):
+            if number is None:
+                if not is_missing(value):
+                    is_numeric = False
+                numbers.append(None)
+                continue
+
+            if unit is None:
+                value_unit = value_unit or target_unit  # A number without unit is in the unit of the column
+            numbers.append(convert(number, value_unit, target_unit) if target_unit else number)
+
+        if numpy is not None:
+            numbers = numpy.array([math.nan if number is None else number for number in numbers], dtype=float)
+
+        self._cache[key] = (numbers, is_numeric)
+        return self._cache[key]
+
+    def column(self, column):
+        # Values of one column (as in the rows), for the rows of this frame
+        values = self._data[column]
+        return [values[position] for position in self.positions()]
+
+    def values(self, column, unit=None):
+        # Numeric values of one column for the rows of this frame (None for cells without number)
+        # unit: convert size units, e.g. 'GB'
+        numbers, is_numeric = self._numeric(column, unit)
+        if numpy is not None:
+            return [None if math.isnan(number) else float(number) for number in numbers[self.positions()]]
+        return [numbers[position] for position in self.positions()]
+
+    def rows(self):
+        # Rows as dicts. Columns without value are left out (like error records in parsed_result)
+        data = [(column, self._data[column]) for column in self.columns]
+        rows = []
+        for position in self.positions():
+            row = {}
+            for column, values in data:
+                value = values[position]
+                if value is not None:
+                    row[column] = value
+            rows.append(row)
+        return rows
+
+    def to_parsed_result(self, cmd=''):
+        # parsed_result structure, for create_report() or ReportSession.add_sheet()
+        return {'hdr': list(self.columns), 'items': self.rows(), 'cmd': cmd}
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    def __repr__(self):
+        return f"ResultFrame({len(self)} rows x {len(self.columns)} columns)"
+
+    # Filter, sort
+
+    def where(self, column, op, value, unit=None):
+        # Rows where 'column op value'. op: == != < <= > >= in, not in, contains, startswith
+        # A number as value compares the numeric value ('50 GB' > 10 with unit='GB' is True)
+        positions = self.positions()
+        numeric_value = isinstance(value, (int, float)) and not isinstance(value, bool)
+
+        if op in COMPARE and (numeric_value or op not in ('==', '!=')):
+            compare = COMPARE[op]
+            numbers = self._numeric(column, unit)[0]
+            if numpy is not None:
+                selected = numbers[positions]
+                with numpy.errstate(invalid='ignore'):
+                    mask = compare(selected, value) & ~numpy.isnan(selected)
+                return self._derive(positions[mask])
+            return self._derive([position for position in positions
+                                 if numbers[position] is not None and compare(numbers[position], value)])
+
+        if op in ('==', '!=') and numpy is not None:
+            selected = self._raw_array(column)[positions]
+            mask = numpy.fromiter((cell == value for cell in selected), dtype=bool, count=len(selected))
+            return self._derive(positions[mask if op == '==' else ~mask])
+
+        if op in ('==', '!='):
+            test = (lambda cell: cell == value) if op == '==' else (lambda cell: cell != value)
+        elif op == 'in':
+            value = set(value)
+            test = lambda cell: cell in value
+        elif op == 'not in':
+            value = set(value)
+            test = lambda cell: cell not in value
+        elif op == 'contains':
+            test = lambda cell: isinstance(cell, str) and value in cell
+        elif op == 'startswith':
+            test = lambda cell: isinstance(cell, str) and cell.startswith(value)
+        else:
+            raise ValueError(f"ResultFrame.where(): unknown operator {op}")
+
+        values = self._data[column]
+        if numpy is not None:
+            mask = numpy.fromiter((test(values[position]) for position in positions), dtype=bool,
+                                  count=len(positions))
+            return self._derive(positions[mask])
+        return self._derive([position for position in positions if test(values[position])])
+
+    # End of function where()
+
+    def sort(self, column, descending=False, unit=None):
+        # Numeric columns are sorted by number ('9 GB' before '10 GB'), others as text. Empty values last
+        positions = self.positions()
+        numbers, is_numeric = self._numeric(column, unit)
+
+        if is_numeric and numpy is not None:
+            keys = numbers[positions]
+            order = numpy.argsort(-keys if descending else keys, kind='stable')  # NaN is sorted last
+            return self._derive(positions[order])
+
+        if is_numeric:
+            present = [position for position in positions if numbers[position] is not None]
+            missing = [position for position in positions if numbers[position] is None]
+            present.sort(key=lambda position: numbers[position], reverse=descending)
+            return self._derive(present + missing)
+
+        values = self._data[column]
+        present = [position for position in positions if not is_missing(values[position])]
+        missing = [position for position in positions if is_missing(values[position])]
+        present.sort(key=lambda position: str(values[position]), reverse=descending)
+        if numpy is not None:
+            return self._derive(numpy.array(present + missing, dtype=numpy.intp))
+        return self._derive(present + missing)
+
+    # End of function sort()
+
+    def head(self, count=10):
+        return self._derive(self.positions()[:count])
+
+    def top(self, count, column, unit=None):
+        # The 'count' rows with the highest value of column
+        return self.sort(column, descending=True, unit=unit).head(count)
+
+    def select(self, *columns):
+        # Frame with only these columns
+        return self._derive(self._positions, list(columns))
+
+    def group_by(self, *columns):
+        return GroupBy(self, columns)
+
+# End of class
+
+
+class GroupBy:
+    # Result of ResultFrame.group_by(). agg() returns a ResultFrame with one row per group (order of appearance)
+
+    def __init__(self, frame, columns):
+        self.frame = frame
+        self.columns = list(columns)
+
+    def _group_codes(self):
+        # Returns tuple (codes, first_positions): group number of every row, position of the first row of
+        # every group. NumPy: codes and first_positions are arrays
+        frame = self.frame
+        positions = frame.positions()
+        key_values = [frame._data[column] for column in self.columns]
+        codes, first_index = factorize(tuple(value_key(values[position]) for values in key_values)
+                                       for position in positions)
+
+        if numpy is not None:
+            return numpy.array(codes, dtype=numpy.intp), positions[numpy.array(first_index, dtype=numpy.intp)]
+        return codes, [positions[index] for index in first_index]
+
+    # End of function _group_codes()
+
+    def agg(self, **specs):
+        # specs: name=(column, function) or name=(column, function, unit)
+        # function: sum, mean, min, max (numeric values), count (cells with a value), distinct (different values,
+        #           empty cells not counted)
+        frame = self.frame
+        codes, first_positions = self._group_codes()
+        group_count = len(first_positions)
+
+        result = {column: [frame._data[column][position] for position in first_positions]
+                  for column in self.columns}
+
+        for name, spec in specs.items():
+            column, function = spec[0], spec[1]
+            unit = spec[2] if len(spec) > 2 else None
+            if function not in AGGREGATES:
+                raise ValueError(f"GroupBy.agg(): unknown function {function}. Your options: {AGGREGATES}")
+
+            if numpy is not None:
+                result[name] = self._numpy_aggregate(column, function, unit, codes, group_count)
+            else:
+                result[name] = self._python_aggregate(column, function, unit, codes, group_count)
+
+        return ResultFrame(result, self.columns + list(specs))
+
+    # End of function agg()
+
+    def _numpy_aggregate(self, column, function, unit, codes, group_count):
+        frame = self.frame
+        positions = frame.positions()
+
+        if function == 'count':
+            cells = frame._raw_array(column)[positions]
+            present = numpy.fromiter((not is_missing(cell) for cell in cells), dtype=bool, count=len(cells))
+            return numpy.bincount(codes[present], minlength=group_count).tolist()
+
+        if function == 'distinct':
+            cells = frame._raw_array(column)[positions]
+            present = numpy.fromiter((not is_missing(cell) for cell in cells), dtype=bool, count=len(cells))
+            if not present.any():
+                return [0] * group_count
+            value_codes = numpy.array(factorize(value_key(cell) for cell in cells[present])[0], dtype=numpy.intp)
+            pairs = numpy.unique(numpy.stack([codes[present], value_codes], axis=1), axis=0)
+            return numpy.bincount(pairs[:, 0], minlength=group_count).tolist()
+
+        numbers = frame._numeric(column, unit)[0][positions]
+        present = ~numpy.isnan(numbers)
+        counts = numpy.bincount(codes[present], minlength=group_count)
+
+        if function in ('sum', 'mean'):
+            totals = numpy.bincount(codes[present], weights=numbers[present], minlength=group_count)
+            if function == 'mean':
+                with numpy.errstate(invalid='ignore', divide='ignore'):
+                    totals = totals / counts
+            values = totals
+        else:
+            values = numpy.full(group_count, numpy.inf if function == 'min' else -numpy.inf)
+            (numpy.minimum if function == 'min' else numpy.maximum).at(values, codes[present], numbers[present])
+
+        # Groups without any number: None (sum: 0)
+        if function == 'sum':
+            return values.tolist()
+        return [float(value) if count else None for value, count in zip(values, counts)]
+
+    # End of function _numpy_aggregate()
+
+    def _python_aggregate(self, column, function, unit, codes, group_count):
+        frame = self.frame
+        positions = frame.positions()
+
+        if function in ('count', 'distinct'):
+            values = frame._data[column]
+            groups = [set() for _ in range(group_count)] if function == 'distinct' else [0] * group_count
+            for code, position in zip(codes, positions):
+                value = values[position]
+                if is_missing(value):
+                    continue
+                if function == 'distinct':
+                    groups[code].add(value_key(value))
+                else:
+                    groups[code] += 1
+            return [len(group) for group in groups] if function == 'distinct' else groups
+
+        numbers = frame._numeric(column, unit)[0]
+        totals = [0.0] * group_count
+        counts = [0] * group_count
+        extremes = [None] * group_count
+        pick = min if function == 'min' else max
+
+        for code, position in zip(codes, positions):
+            number = numbers[position]
+            if number is None:
+                continue
+            counts[code] += 1
+            if function in ('sum', 'mean'):
+                totals[code] += number
+            else:
+                extremes[code] = number if extremes[code] is None else pick(extremes[code], number)
+
+        if function == 'sum':
+            return totals
+        if function == 'mean':
+            return [total / count if count else None for total, count in zip(totals, counts)]
+        return extremes
+
+    # End of function _python_aggregate()
+
+# End of class
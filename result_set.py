@@ -0,0 +1,151 @@
+import sys
+from collections.abc import Mapping
+
+
+# Marks a column that has no value in a row (the key is not present in the row dict)
+MISSING = object()
+
+
+class RowView(Mapping):
+    # Read-only dict-like view of one row of CompactItems. Keys are the column titles
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index      # {column title: position in values}, shared by all rows
+        self._values = values    # tuple, can be shorter than the number of columns
+
+    def __getitem__(self, key):
+        position = self._index[key]
+        if position < len(self._values):
+            value = self._values[position]
+            if value is not MISSING:
+                return value
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        position = self._index.get(key)
+        return position is not None and position < len(self._values) and self._values[position] is not MISSING
+
+    def __iter__(self):
+        for key, position in self._index.items():
+            if position < len(self._values) and self._values[position] is not MISSING:
+                yield key
+
+    def __len__(self):
+        return sum(1 for value in self._values if value is not MISSING)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+# End of class
+
+
+class CompactItems:
+    # Compact replacement of the list of dicts in parsed_result['items'] (see TsmRest.compact_result)
+    # The column titles are stored once, every row is a tuple of values in column order.
+    # Iterating or indexing returns RowView objects, so code that reads rows as dicts keeps working.
+
+    def __init__(self, columns=(), rows=None):
+        self.columns = list(columns)
+        self._index = {name: position for position, name in enumerate(self.columns)}
+        self._rows = rows if rows is not None else []
+
+    def _add_column(self, name):
+        self._index[name] = len(self.columns)
+        self.columns.append(name)
+
+    def append(self, row):
+        # Add a row given as dict (or RowView). Unknown keys become new columns
+        for key in row:
+            if key not in self._index:
+                self._add_column(key)
+        self._rows.append(tuple(row.get(name, MISSING) for name in self.columns))
+
+    def extend(self, rows):
+        # Add the rows of another CompactItems, or an iterable of dicts
+        if isinstance(rows, CompactItems):
+            # Same columns (or ours are the first columns of theirs): copy the tuples as-is
+            if rows.columns[:len(self.columns)] == self.columns:
+                for name in rows.columns[len(self.columns):]:
+                    self._add_column(name)
+                self._rows.extend(rows._rows)
+                return
+
+        for row in rows:
+            self.append(row)
+
+    def column(self, name):
+        # All values of one column, None if a row has no value for it
+        position = self._index[name]
+        values = []
+        for row in self._rows:
+            value = row[position] if position < len(row) else None
+            values.append(None if value is MISSING else value)
+        return values
+
+    def memory_footprint(self):
+        # Approximate memory use in bytes: container, row tuples and the (unique) values
+        size = sys.getsizeof(self._rows) + sys.getsizeof(self.columns) + sys.getsizeof(self._index)
+        seen = set()
+        for row in self._rows:
+            size += sys.getsizeof(row)
+            for value in row:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+        return size
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        index = self._index
+        for row in self._rows:
+            yield RowView(index, row)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [RowView(self._index, row) for row in self._rows[position]]
+        return RowView(self._index, self._rows[position])
+
+    def __repr__(self):
+        return f"CompactItems({len(self._rows)} rows x {len(self.columns)} columns)"
+
+# End of class
+
+
+def memory_footprint(items):
+    # Approximate memory use in bytes of parsed_result['items'] (list of dicts or CompactItems)
+    if isinstance(items, CompactItems):
+        return items.memory_footprint()
+
+    size = sys.getsizeof(items)
+    seen = set()
+    for row in items:
+        size += sys.getsizeof(row)
+        for value in (*row.keys(), *row.values()):
+            if id(value) not in seen:
+                seen.add(id(value))
+                size += sys.getsizeof(value)
+    return size
+
+
+class RowStream:
+    # Rows of TsmRest.stream_command(), used like a generator. 'parsed_result' is the result dict of this stream:
+    # it gets 'hdr' (before the first data row), 'msg', 'cmd' and 'tsm_srv' while the rows are read.
+    # create_report(rows=...) takes the column names from it, not from an unrelated earlier result
+
+    def __init__(self, rows, parsed_result):
+        self.rows = rows
+        self.parsed_result = parsed_result
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.rows)
+
+    def close(self):
+        self.rows.close()
+
+# End of class
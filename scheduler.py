@@ -0,0 +1,407 @@
+import argparse
+import getpass
+import heapq
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Project specific functions
+from export_backends import EXPORT_BACKENDS, export_backend
+from extra_functions import read_csv_view, read_excel_sheet_view
+from metrics import label_value
+from rate_limit import TokenBucket
+from server_health import percentile
+from tsmrest import TsmRest
+
+# Long-running scheduler: runs a table of jobs (command, TSM servers, interval, export target) with one TsmRest
+# (or TsmCluster) instance, instead of one cron job per command that connects again every time.
+#
+# - The keep-alive connections, caches, circuit breakers and metrics of the instance are reused by every job
+# - Jitter: the first run of a job is spread over 'spread' seconds (max one interval), every run gets a random
+#   delay of 0 .. 'jitter' x interval (max 'max_jitter' seconds). Jobs with the same interval do not line up
+#   and the delay does not add up from run to run
+# - Rate limits (token buckets, see rate_limit.py): 'rate' REST calls per second for all OCs and 'oc_rate'
+#   per OC. The REST calls wait for a token, the waiting time is the 'throttle' phase of the metrics. A new
+#   Scheduler on the same instance replaces the buckets of the previous one (other buckets are kept)
+# - At most 'max_jobs' jobs run at the same time. Queue lag: how late a job starts compared to its run time.
+#   A growing lag means the OC (or the rate limits, or max_jobs) cannot keep up with the job table
+# - A job that is still running when it is due again skips that run
+#
+#     api = TsmRest("tsmOC.company.com", "11090")
+#     jobs = load_jobs('jobs.json')
+#     scheduler = Scheduler(api, jobs, "admin", "password", rate=20, oc_rate=10)
+#     scheduler.run()   # Until scheduler.stop() or Ctrl-C
+#
+# Job table: JSON (list of jobs), CSV or Excel (sheet 'Jobs'), one job per row:
+#     name         unique name of the job (default: the command)
+#     command      TSM command
+#     servers      list of TSM servers (CSV/Excel: separated by commas)
+#     interval     seconds between two runs
+#     report_type  optional: XLSX, CSV, HTML, JSON, SQLITE (see create_report())
+#     file_name    report file, time.strftime() codes are replaced by the run time, e.g. 'stgpool_%Y%m%d_%H%M.csv'
+#     sheet_name   optional, XLSX sheet name (default: the job name)
+#     table        optional, SQLITE table (default: the name of the command)
+#     deadline     optional, max duration of one run (seconds)
+
+
+class Job:
+
+    def __init__(self, name, command, servers, interval, report_type=None, file_name=None, sheet_name=None,
+                 table=None, deadline=None):
+        name = name or command
+        if not command or not isinstance(command, str):
+            raise ValueError(f"Job {name}: command is missing")
+        if isinstance(servers, str):
+            servers = [server.strip() for server in servers.split(',') if server.strip()]
+        if not servers:
+            raise ValueError(f"Job {name}: servers is missing")
+        try:
+            interval = float(interval)
+        except (TypeError, ValueError):
+            raise ValueError(f"Job {name}: interval must be a number of seconds, not {interval!r}") from None
+        if interval <= 0:
+            raise ValueError(f"Job {name}: interval must be > 0")
+        if report_type and report_type not in EXPORT_BACKENDS:
+            raise ValueError(f"Job {name}: unknown report type {report_type}. Your options: {set(EXPORT_BACKENDS)}")
+        if report_type and not file_name:
+            raise ValueError(f"Job {name}: file_name is missing")
+
+        self.name = name
+        self.command = command
+        self.servers = list(servers)
+        self.interval = interval
+        self.report_type = report_type or None
+        self.file_name = file_name
+        self.sheet_name = sheet_name or self.name[:31]  # Max length of an Excel sheet name
+        self.table = table or None
+        self.deadline = float(deadline) if deadline not in (None, '') else None
+
+        # State, updated by the Scheduler
+        self.due = None           # Next run time without jitter (time.monotonic())
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0          # Runs skipped because the previous run was not finished
+        self.last_lag = None      # Queue lag of the last run (seconds)
+        self.last_duration = None
+        self.last_error = ''
+
+    def status(self):
+        return {'name': self.name, 'command': self.command, 'servers': len(self.servers), 'interval': self.interval,
+                'running': self.running, 'runs': self.runs, 'failures': self.failures, 'skipped': self.skipped,
+                'last_lag': self.last_lag, 'last_duration': self.last_duration, 'last_error': self.last_error}
+
+# End of class
+
+
+def load_jobs(file_name, sheet='Jobs'):
+    # Job table from a JSON, CSV or Excel file (see above). Raises FileNotFoundError or ValueError
+    if file_name.lower().endswith('.json'):
+        if not os.path.exists(file_name):
+            raise FileNotFoundError(f"load_jobs(): File not found: {file_name}")
+        with open(file_name) as f:
+            rows = json.load(f)
+        if isinstance(rows, dict):
+            rows = rows.get('jobs', [])
+    elif file_name.lower().endswith('.csv'):
+        rows = read_csv_view(file_name)['items']
+    else:
+        rows = read_excel_sheet_view(file_name, sheet)['items']
+
+    fields = ('name', 'command', 'servers', 'interval', 'report_type', 'file_name', 'sheet_name', 'table',
+              'deadline')
+    jobs = [Job(**{field: row.get(field) for field in fields}) for row in rows if row.get('command')]
+
+    names = [job.name for job in jobs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"load_jobs(): duplicate job names: {sorted(duplicates)}")
+    return jobs
+
+# End of function load_jobs()
+
+
+class Scheduler:
+
+    max_jobs = 4          # Jobs running at the same time
+    spread = 60           # First runs are spread over 'spread' seconds (max one interval)
+    jitter = 0.1          # Random delay of every run: 0 .. jitter x interval
+    max_jitter = 300      # Max random delay (seconds)
+    lag_warning = 30      # Queue lag (seconds) that prints a warning
+    lag_window = 200      # Queue lags kept for the statistics
+
+    installed_rate_limits = weakref.WeakKeyDictionary()  # TsmRest instance -> buckets added by a Scheduler
+
+    def __init__(self, api, jobs, tsm_user, tsm_pass, rate=None, oc_rate=None, burst=None):
+        # api: TsmRest or TsmCluster (one TsmRest per OC), used by every job
+        # rate: max REST calls per second to all OCs, oc_rate: per OC (None = no limit). burst: tokens saved up
+        self.api = api
+        self.jobs = list(jobs)
+        self.tsm_user = tsm_user
+        self.tsm_pass = tsm_pass
+
+        # TsmRest instance per OC
+        self.instances = dict(getattr(api, 'instances', None) or {api.oc_key: api})
+
+        # Rate limits: a global bucket shared by the instances, a bucket per OC
+        self.rate_limit = TokenBucket(rate, burst) if rate else None
+        self.oc_rate_limits = {}
+        for oc_key, instance in self.instances.items():
+            buckets = []
+            if oc_rate:
+                self.oc_rate_limits[oc_key] = TokenBucket(oc_rate, burst)
+                buckets.append(self.oc_rate_limits[oc_key])
+            if self.rate_limit is not None:
+                buckets.append(self.rate_limit)
+            self.install_rate_limits(instance, buckets)
+
+        self.queue = []       # Heap of (run time, sequence, job)
+        self.sequence = 0
+        self.lags = deque(maxlen=self.lag_window)
+        self.stats = {'started': 0, 'runs': 0, 'failures': 0, 'skipped': 0, 'max_lag': 0.0}
+        self.waiting = 0      # Jobs handed to the workers that did not start yet
+        self.file_locks = {}  # Report file -> lock (two jobs writing the same file)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def install_rate_limits(self, instance, buckets):
+        # Replace the buckets that a Scheduler added to instance.rate_limits before by 'buckets': two Schedulers
+        # on the same instance do not stack their limits. Buckets added by the user are kept
+        previous = Scheduler.installed_rate_limits.get(instance, [])
+        instance.rate_limits[:] = [bucket for bucket in instance.rate_limits
+                                   if not any(bucket is old for old in previous)] + buckets
+        Scheduler.installed_rate_limits[instance] = buckets
+
+    def schedule(self, job, now=None):
+        # Put the next run of the job in the queue. Returns its run time (time.monotonic())
+        if now is None:
+            now = time.monotonic()
+        if job.due is None:
+            job.due = now + random.uniform(0, min(self.spread, job.interval))
+        else:
+            job.due += job.interval
+            if job.due < now:
+                # The scheduler was behind by more than one interval: the missed runs are not repeated
+                job.due += (now - job.due) // job.interval * job.interval + job.interval
+        run_time = job.due + random.uniform(0, min(self.max_jitter, self.jitter * job.interval))
+
+        with self._lock:
+            self.sequence += 1
+            heapq.heappush(self.queue, (run_time, self.sequence, job))
+        return run_time
+
+    def run(self, duration=None):
+        # Run the jobs until stop(), Ctrl-C or 'duration' seconds
+        end = time.monotonic() + duration if duration is not None else None
+        self._stop.clear()
+        for job in self.jobs:
+            if job.due is None:
+                self.schedule(job)
+
+        print(f"Scheduler: {len(self.jobs)} job(s), {self.max_jobs} at the same time")
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+            try:
+                while not self._stop.is_set() and self.queue:
+                    now = time.monotonic()
+                    if end is not None and now >= end:
+                        break
+                    run_time, sequence, job = self.queue[0]
+                    if run_time > now:
+                        self._stop.wait(run_time - now if end is None else min(run_time - now, end - now))
+                        continue
+
+                    with self._lock:
+                        heapq.heappop(self.queue)
+                    if job.running:
+                        job.skipped += 1
+                        self.stats['skipped'] += 1
+                        print(f"Scheduler: {job.name} did not finish its previous run, run skipped")
+                    else:
+                        job.running = True
+                        with self._lock:
+                            self.waiting += 1
+                        executor.submit(self.run_job, job, run_time)
+                    self.schedule(job, now)
+
+            except KeyboardInterrupt:
+                print("Scheduler: stopping, waiting for the running jobs")
+                self._stop.set()
+
+    # End of function run()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_job(self, job, run_time):
+        # One run of a job: TSM command on the TSM servers of the job, then the export
+        start = time.monotonic()
+        lag = max(0.0, start - run_time)
+        with self._lock:
+            self.waiting -= 1
+            self.lags.append(lag)
+            self.stats['started'] += 1
+            self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+        job.last_lag = lag
+        if lag > self.lag_warning:
+            print(f"Scheduler: {job.name} started {lag:.1f} secs late, the OC or the job workers are saturated")
+
+        try:
+            parsed_result = self.api.query(job.servers, self.tsm_user, self.tsm_pass, job.command,
+                                           deadline=job.deadline)[0]
+            if job.report_type:
+                self.export(job, parsed_result)
+            job.runs += 1
+            job.last_error = ''
+            with self._lock:
+                self.stats['runs'] += 1
+
+        # exit() of a validation must not stop the other jobs
+        except (Exception, SystemExit) as e:
+            job.failures += 1
+            job.last_error = str(e) or type(e).__name__
+            with self._lock:
+                self.stats['failures'] += 1
+            print(f"Scheduler: {job.name} failed: {job.last_error}")
+
+        finally:
+            job.last_duration = time.monotonic() - start
+            job.running = False
+
+    # End of function run_job()
+
+    def export(self, job, parsed_result):
+        # Same as create_report() with the result of one run. Not self.api.parsed_result: jobs run at the same time
+        if 'items' not in parsed_result:
+            raise ValueError("No data to export. Check the 'msg' key")
+        file_name = time.strftime(job.file_name)
+        if not os.path.exists(os.path.abspath(os.path.dirname(file_name))):
+            raise FileNotFoundError(f"Report directory does not exist: {os.path.dirname(file_name)}")
+
+        with self._lock:
+            file_lock = self.file_locks.setdefault(os.path.abspath(file_name), threading.Lock())
+        metrics = next(iter(self.instances.values())).metrics
+        export_start = time.perf_counter()
+        with file_lock:
+            export_backend(job.report_type)(file_name, parsed_result['hdr'], parsed_result['items'],
+                                            sheet_name=job.sheet_name, sheet_tab_color='FFFFFF', streaming=False,
+                                            compress=False, table=job.table, cmd=parsed_result.get('cmd', ''),
+                                            tsm_srv=parsed_result.get('tsm_srv', []))
+        metrics.record_export(job.report_type, file_name, time.perf_counter() - export_start)
+
+    # End of function export()
+
+    def status(self):
+        # Queue lag, job counters and rate limits
+        with self._lock:
+            lags = list(self.lags)
+            status = dict(self.stats)
+            status['waiting'] = self.waiting
+        status['running'] = sum(1 for job in self.jobs if job.running)
+        status['lag'] = lags[-1] if lags else 0.0
+        status['lag_p95'] = percentile(lags, 0.95) if lags else 0.0
+        status['rate_limit'] = self.rate_limit.status() if self.rate_limit is not None else None
+        status['oc_rate_limits'] = {oc_key: bucket.status() for oc_key, bucket in self.oc_rate_limits.items()}
+        status['jobs'] = [job.status() for job in self.jobs]
+        return status
+
+    def prometheus(self):
+        # Scheduler metrics and the metrics of every OC (see CommandMetrics.prometheus()) in the Prometheus format
+        status = self.status()
+        lines = ["# HELP tsmrest_scheduler_queue_lag_seconds Delay between the run time and the start of the jobs",
+                 "# TYPE tsmrest_scheduler_queue_lag_seconds gauge",
+                 f'tsmrest_scheduler_queue_lag_seconds{{stat="last"}} {status["lag"]:.6f}',
+                 f'tsmrest_scheduler_queue_lag_seconds{{stat="p95"}} {status["lag_p95"]:.6f}',
+                 f'tsmrest_scheduler_queue_lag_seconds{{stat="max"}} {status["max_lag"]:.6f}',
+                 "# HELP tsmrest_scheduler_jobs Jobs waiting for a worker and running",
+                 "# TYPE tsmrest_scheduler_jobs gauge",
+                 f'tsmrest_scheduler_jobs{{state="waiting"}} {status["waiting"]}',
+                 f'tsmrest_scheduler_jobs{{state="running"}} {status["running"]}',
+                 "# HELP tsmrest_scheduler_runs_total Runs per job and result",
+                 "# TYPE tsmrest_scheduler_runs_total counter"]
+        for job in self.jobs:
+            for result, count in (('ok', job.runs), ('error', job.failures), ('skipped', job.skipped)):
+                lines.append(f'tsmrest_scheduler_runs_total{{job="{label_value(job.name)}",result="{result}"}} {count}')
+
+        lines.append("# HELP tsmrest_rate_limit_wait_seconds_total Time spent waiting for a token of the rate limits")
+        lines.append("# TYPE tsmrest_rate_limit_wait_seconds_total counter")
+        buckets = [('all', status['rate_limit'])] if status['rate_limit'] else []
+        buckets += list(status['oc_rate_limits'].items())
+        for oc_key, bucket in buckets:
+            lines.append(f'tsmrest_rate_limit_wait_seconds_total{{oc="{label_value(oc_key)}"}} '
+                         f'{bucket["wait_seconds"]:.6f}')
+
+        return '\n'.join(lines) + '\n' + ''.join(instance.metrics.prometheus() for instance in self.instances.values())
+
+    # End of function prometheus()
+
+    def write_prometheus(self, file_name):
+        # Same as CommandMetrics.write_prometheus(): temporary file renamed, never read half written
+        directory = os.path.dirname(os.path.abspath(file_name))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.prometheus())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_name)
+
+# End of class
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a table of TSM commands at regular intervals")
+    parser.add_argument('jobs', help="Job table: JSON, CSV or Excel file (sheet 'Jobs')")
+    parser.add_argument('--oc', default=os.environ.get('TSMREST_OC_ADDRESS', 'localhost'), help="OC address")
+    parser.add_argument('--oc-port', default=os.environ.get('TSMREST_OC_PORT', '11090'))
+    parser.add_argument('--cluster', help="JSON file {'address:port': [TSM servers]} for several OCs")
+    parser.add_argument('--user', default=os.environ.get('TSMREST_USER'), help="TSM administrator")
+    parser.add_argument('--max-jobs', type=int, default=Scheduler.max_jobs)
+    parser.add_argument('--max-workers', type=int, default=4, help="TSM servers queried at the same time per OC")
+    parser.add_argument('--rate', type=float, help="Max REST calls per second, all OCs")
+    parser.add_argument('--oc-rate', type=float, help="Max REST calls per second per OC")
+    parser.add_argument('--burst', type=float, help="REST calls above the rate after an idle period")
+    parser.add_argument('--metrics-file', help="Prometheus text file, written every 'metrics-interval' seconds")
+    parser.add_argument('--metrics-interval', type=float, default=15)
+    args = parser.parse_args()
+
+    if not args.user:
+        print("Scheduler: --user (or TSMREST_USER) is required")
+        exit(1)
+    tsm_pass = os.environ.get('TSMREST_PASSWORD') or getpass.getpass(f"Password of {args.user}: ")
+
+    try:
+        jobs = load_jobs(args.jobs)
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        exit(1)
+
+    if args.cluster:
+        from oc_cluster import TsmCluster
+        with open(args.cluster) as f:
+            api = TsmCluster(json.load(f), max_workers=args.max_workers)
+    else:
+        api = TsmRest(args.oc, args.oc_port)
+        api.max_workers = args.max_workers
+    for instance in getattr(api, 'instances', {api.oc_key: api}).values():
+        instance.keep_raw_result = False
+
+    scheduler = Scheduler(api, jobs, args.user, tsm_pass, rate=args.rate, oc_rate=args.oc_rate, burst=args.burst)
+    scheduler.max_jobs = args.max_jobs
+
+    if args.metrics_file:
+        def write_metrics():
+            while not scheduler._stop.wait(args.metrics_interval):
+                scheduler.write_prometheus(args.metrics_file)
+        threading.Thread(target=write_metrics, daemon=True).start()
+
+    scheduler.run()
+    if args.metrics_file:
+        scheduler.write_prometheus(args.metrics_file)
+
+
+if __name__ == '__main__':
+    main()
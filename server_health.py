@@ -0,0 +1,165 @@
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from result_cache import normalize_command
+
+# Health of the TSM servers behind one OC, kept between calls (see TsmRest.health)
+#
+# Circuit breaker per TSM server: after 'failure_threshold' timeouts / connection errors / HTTP 502-504 in a row
+# the circuit opens and the TSM server is skipped (CircuitOpenError, no REST call) for 'open_seconds'.
+# Then one call is let through as a probe: success closes the circuit, failure opens it again for twice as long.
+# HTTP 500, 401, 403 are answers of the OC: they do not count as failures.
+#
+# Adaptive timeout per TSM server and command: after 'min_samples' calls the timeout is
+# 'timeout_factor' x the 95th percentile of the last 'window' durations, between min_timeout and request_timeout.
+# A command that times out goes back to request_timeout until it has enough new samples.
+# The durations are kept per command shape (the command without its literals, see command_shape()): the pages
+# of a paged SELECT and the polls with a new date_time share their samples. At most max_commands shapes are
+# kept, the least recently used are dropped (long running Scheduler / WebBackend processes).
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def read_only(command):
+    # Commands that can be sent again without side effects: query (q, qu, ...), select, show
+    return re.match(r'\s*(q|qu|que|quer|query|select|show)\s', command + ' ', re.IGNORECASE) is not None
+
+
+def command_shape(command):
+    # normalize_command() with the text between quotes and the numbers replaced by '?'
+    # "select * from actlog where date_time >= '2026-10-17 10:15:00'" -> "... where date_time >= ?"
+    shape = re.sub(r"'[^']*'|\"[^\"]*\"", '?', normalize_command(command))
+    return re.sub(r'\b\d+(?:\.\d+)?\b', '?', shape)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ServerHealth:
+
+    def __init__(self, failure_threshold=3, open_seconds=30, max_open_seconds=600,
+                 window=50, min_samples=5, timeout_factor=4.0, min_timeout=2.0, max_commands=1000):
+        self.failure_threshold = failure_threshold  # Failures in a row that open the circuit
+        self.open_seconds = open_seconds            # First open period, doubled after every failed probe
+        self.max_open_seconds = max_open_seconds
+        self.window = window                        # Durations kept per TSM server and command
+        self.min_samples = min_samples              # Durations needed before the timeout is adapted
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.max_commands = max_commands            # (TSM server, command shape) keys kept in durations
+
+        self.servers = {}    # TSM server -> {'state', 'failures', 'trips', 'open_until', 'probing'}
+        self.durations = OrderedDict()  # (TSM server, command shape) -> deque of call durations (seconds), LRU
+        self.stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0, 'adapted_timeouts': 0}
+        self._lock = threading.Lock()
+
+    def _server(self, tsm_server):
+        key = tsm_server.upper()
+        if key not in self.servers:
+            self.servers[key] = {'state': 'closed', 'failures': 0, 'trips': 0, 'open_until': 0.0, 'probing': False}
+        return self.servers[key]
+
+    def check(self, tsm_server):
+        # Raises CircuitOpenError if the TSM server is skipped. Lets one probe call through after the open period
+        with self._lock:
+            server = self._server(tsm_server)
+            if server['state'] == 'closed':
+                return
+
+            now = time.monotonic()
+            if server['state'] == 'open' and now >= server['open_until']:
+                server['state'] = 'half_open'
+            if server['state'] == 'half_open' and not server['probing']:
+                server['probing'] = True
+                return
+
+            self.stats['rejected'] += 1
+            wait_time = max(0.0, server['open_until'] - now)
+            raise CircuitOpenError(f"Circuit open: {tsm_server} failed {server['failures']} times in a row, "
+                                   f"skipped (next try in {wait_time:.0f} secs)")
+
+    # End of function check()
+
+    def timeout(self, tsm_server, tsm_command, default):
+        # Timeout (seconds) for the next call of this command on this TSM server
+        with self._lock:
+            key = (tsm_server.upper(), command_shape(tsm_command))
+            durations = self.durations.get(key)
+            if durations is None or len(durations) < self.min_samples:
+                return default
+            self.durations.move_to_end(key)
+            adapted = max(self.min_timeout, percentile(durations, 0.95) * self.timeout_factor)
+            if adapted < default:
+                self.stats['adapted_timeouts'] += 1
+                return adapted
+            return default
+
+    def success(self, tsm_server, tsm_command=None, duration=None):
+        # The OC answered (also HTTP 500, 401, ...): close the circuit. duration: seconds of a successful call
+        with self._lock:
+            self.stats['calls'] += 1
+            server = self._server(tsm_server)
+            server.update(state='closed', failures=0, trips=0, probing=False)
+
+            if duration is not None:
+                key = (tsm_server.upper(), command_shape(tsm_command))
+                if key not in self.durations:
+                    self.durations[key] = deque(maxlen=self.window)
+                    while len(self.durations) > self.max_commands:
+                        self.durations.popitem(last=False)  # Least recently used
+                else:
+                    self.durations.move_to_end(key)
+                self.durations[key].append(duration)
+
+    def failure(self, tsm_server, tsm_command=None):
+        # Timeout, connection error, HTTP 502/503/504: count it, open the circuit after failure_threshold in a row
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['failures'] += 1
+            server = self._server(tsm_server)
+            server['failures'] += 1
+
+            # Durations before the failure are too short for this command now
+            if tsm_command is not None:
+                self.durations.pop((tsm_server.upper(), command_shape(tsm_command)), None)
+
+            if server['state'] == 'half_open' or server['failures'] >= self.failure_threshold:
+                if server['state'] != 'open':
+                    self.stats['opened'] += 1
+                open_seconds = min(self.max_open_seconds, self.open_seconds * 2 ** server['trips'])
+                server.update(state='open', open_until=time.monotonic() + open_seconds, probing=False)
+                server['trips'] += 1
+
+    # End of function failure()
+
+    def release(self, tsm_server):
+        # The call ended without a result (cancelled): nothing is counted, the next call can be the probe
+        with self._lock:
+            self._server(tsm_server)['probing'] = False
+
+    def reset(self, tsm_server=None):
+        # Forget the state of one TSM server, or of all servers
+        with self._lock:
+            if tsm_server is None:
+                self.servers.clear()
+                self.durations.clear()
+            else:
+                self.servers.pop(tsm_server.upper(), None)
+                for key in [key for key in self.durations if key[0] == tsm_server.upper()]:
+                    del self.durations[key]
+
+    def status(self):
+        # Per TSM server: state, failures in a row, seconds until the next probe
+        now = time.monotonic()
+        with self._lock:
+            return {name: {'state': server['state'], 'failures': server['failures'],
+                           'retry_in': round(max(0.0, server['open_until'] - now), 1) if server['state'] != 'closed' else 0}
+                    for name, server in self.servers.items()}
+
+# End of class
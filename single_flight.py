@@ -0,0 +1,55 @@
+import threading
+
+
+class _Call:
+    # One call in flight, shared by the callers with the same key
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Request coalescing: concurrent calls with the same key run the function only once.
+    # The first caller executes it, the others wait and get the same result (or exception).
+    # A call that starts after the previous one finished runs the function again (this is not a cache).
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {'calls': 0, 'shared': 0}  # Functions executed / callers that waited for another caller
+
+    def do(self, key, function, *args):
+        # Returns tuple (result, shared). shared is True if the result comes from another caller's call
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['calls'] += 1
+                leader = True
+            else:
+                self.stats['shared'] += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+    # End of function do()
+
+# End of class
@@ -0,0 +1,207 @@
+import datetime
+import json
+import re
+import sqlite3
+from itertools import chain, islice
+
+from result_cache import normalize_command
+
+# Local history of command results in SQLite (see TsmRest.create_report("SQLITE", ...))
+# Every save is a snapshot: the rows get the snapshot id and time, the table 'snapshots' has the command,
+# the TSM servers, the row count and the errors. Trend and invoicing queries then run locally:
+#
+#     SELECT substr(snapshot_time, 1, 7) AS month, "Node Name", sum("Physical Space Occupied (MB)")
+#     FROM query_occupancy GROUP BY month, "Node Name"
+
+SNAPSHOT_COLUMNS = ['snapshot_id', 'snapshot_time']
+
+# Columns indexed by default: snapshot columns, TSM SERVER and the names of nodes, pools, domains, filespaces
+INDEX_COLUMNS = re.compile(r'^(snapshot_id|snapshot_time|TSM SERVER|.*(node|pool|domain|filespace)[ _]name)$',
+                           re.IGNORECASE)
+
+
+def quote(identifier):
+    # SQL identifier between double quotes: column titles have spaces, '?', '(' ...
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def table_name(command):
+    # Table name from a TSM command: "query occupancy" -> query_occupancy
+    name = re.sub(r'[^a-z0-9]+', '_', normalize_command(command)).strip('_')
+    return name[:60] or 'result'
+
+
+def column_type(values):
+    # SQLite type of a column, from sample values. '-' (empty value) does not count
+    types = set()
+    for value in values:
+        if value is None or value == '-':
+            continue
+        if isinstance(value, bool) or isinstance(value, int):
+            types.add('INTEGER')
+        elif isinstance(value, float):
+            types.add('REAL')
+        else:
+            types.add('TEXT')
+
+    if types == {'INTEGER'}:
+        return 'INTEGER'
+    if types and types <= {'INTEGER', 'REAL'}:
+        return 'REAL'
+    return 'TEXT'
+
+
+def sql_value(value):
+    # Python value (fix_value() result) to a value SQLite stores
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(' ')
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+class ResultStore:
+    # SQLite database with one table per command (or per 'table' name)
+    # Rows are inserted with executemany, in one transaction per snapshot
+
+    def __init__(self, db_file, chunk_rows=10000, sample_rows=200):
+        self.db_file = db_file
+        self.chunk_rows = chunk_rows    # Rows per executemany() call
+        self.sample_rows = sample_rows  # Rows used to choose the column types of a new table
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS snapshots (
+                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 table_name TEXT NOT NULL,
+                                 command TEXT,
+                                 tsm_servers TEXT,
+                                 snapshot_time TEXT NOT NULL,
+                                 row_count INTEGER,
+                                 errors TEXT)""")
+        self.conn.commit()
+
+    def columns(self, table):
+        # Column names of a table, [] if the table does not exist
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({quote(table)})")]
+
+    def prepare_table(self, table, col_names, sample, indexes=None):
+        # Create the table (types from the sample rows) or add the columns it does not have yet
+        existing = self.columns(table)
+        col_types = {col: column_type(row.get(col) for row in sample) for col in col_names}
+
+        if not existing:
+            definitions = ["snapshot_id INTEGER NOT NULL", "snapshot_time TEXT NOT NULL"]
+            definitions += [f"{quote(col)} {col_types[col]}" for col in col_names]
+            self.conn.execute(f"CREATE TABLE {quote(table)} ({', '.join(definitions)})")
+            existing = SNAPSHOT_COLUMNS + list(col_names)
+        else:
+            # Another SP version can have more columns
+            for col in col_names:
+                if col not in existing:
+                    self.conn.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(col)} {col_types[col]}")
+                    existing.append(col)
+
+        for col in existing:
+            if INDEX_COLUMNS.match(col) or (indexes and col in indexes):
+                index_name = re.sub(r'\W+', '_', f"idx_{table}_{col}")
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS {quote(index_name)} ON {quote(table)} ({quote(col)})")
+
+    # End of function prepare_table()
+
+    def save(self, parsed_result, table=None, rows=None, snapshot_time=None, indexes=None):
+        # Save a result as a new snapshot, returns the snapshot id
+        # parsed_result: TsmRest.parsed_result ('hdr', 'items', 'cmd', 'tsm_srv')
+        # rows: iterable of row dicts to save instead of parsed_result['items'], e.g. stream_command()
+        # table: default is the name of the command. indexes: extra columns to index
+        command = parsed_result.get('cmd', '')
+        if table is None:
+            table = table_name(command)
+        if snapshot_time is None:
+            snapshot_time = datetime.datetime.now()
+        snapshot_time = sql_value(snapshot_time)
+        if rows is None:
+            rows = parsed_result.get('items', [])
+
+        # Error and 'no match found' records ({'TSM SERVER': 'TSM01 - ERROR: ...'}) go to snapshots.errors
+        errors = []
+
+        def data_rows():
+            for row in rows:
+                if len(row) > 1:
+                    yield row
+                else:
+                    errors.append(row.get('TSM SERVER', ''))
+
+        rows_iter = data_rows()
+        sample = list(islice(rows_iter, self.sample_rows))
+        col_names = [col for col in parsed_result.get('hdr', []) if col not in SNAPSHOT_COLUMNS]
+        if not col_names and sample:
+            col_names = list(sample[0])
+
+        with self.conn:  # One transaction: the snapshot is saved completely or not at all
+            cursor = self.conn.execute(
+                "INSERT INTO snapshots (table_name, command, tsm_servers, snapshot_time) VALUES (?, ?, ?, ?)",
+                (table, command, json.dumps(parsed_result.get('tsm_srv', [])), snapshot_time))
+            snapshot_id = cursor.lastrowid
+            row_count = 0
+
+            if col_names:
+                self.prepare_table(table, col_names, sample, indexes)
+
+                insert = (f"INSERT INTO {quote(table)} ({', '.join(quote(col) for col in SNAPSHOT_COLUMNS + col_names)}) "
+                          f"VALUES ({', '.join('?' * (len(col_names) + 2))})")
+                all_rows = chain(sample, rows_iter)
+                while True:
+                    chunk = [(snapshot_id, snapshot_time) + tuple(sql_value(row.get(col)) for col in col_names)
+                             for row in islice(all_rows, self.chunk_rows)]
+                    if not chunk:
+                        break
+                    self.conn.executemany(insert, chunk)
+                    row_count += len(chunk)
+            else:
+                list(rows_iter)  # Only error records: collect them
+
+            self.conn.execute("UPDATE snapshots SET row_count = ?, errors = ? WHERE id = ?",
+                              (row_count, json.dumps(errors), snapshot_id))
+
+        return snapshot_id
+
+    # End of function save()
+
+    def query(self, sql, params=()):
+        # Run a query on the history, returns a list of dicts
+        cursor = self.conn.execute(sql, params)
+        col_names = [description[0] for description in cursor.description]
+        return [dict(zip(col_names, row)) for row in cursor]
+
+    def snapshots(self, table=None):
+        # Saved snapshots (newest first), of one table or all tables
+        if table is None:
+            return self.query("SELECT * FROM snapshots ORDER BY id DESC")
+        return self.query("SELECT * FROM snapshots WHERE table_name = ? ORDER BY id DESC", (table,))
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# End of class
+
+
+def export_sqlite(file_name, col_names, rows, table=None, cmd='', tsm_srv=(), **options):
+    # SQLITE backend of create_report() (see export_backends.py): a new snapshot in the database file,
+    # the rows are inserted in one transaction
+    snapshot = {'hdr': col_names, 'cmd': cmd, 'tsm_srv': list(tsm_srv)}
+    try:
+        with ResultStore(file_name) as store:
+            store.save(snapshot, table, rows)
+    except sqlite3.Error as e:
+        print(f"ERROR: Could not save to database {file_name}: {e}")
+        exit(1)
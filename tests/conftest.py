@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# The modules are in the root of the repository, the mock OC in benchmarks/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from mock_oc import MockOc  # noqa: E402
+from tsmrest import TsmRest  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clear_parser_caches():
+    # Shapes and row parsers are cached per class: every test starts without them
+    TsmRest.column_shapes.clear()
+    TsmRest.row_parsers.clear()
+    yield
+
+
+@pytest.fixture
+def mock_oc():
+    with MockOc(rows=45) as oc:
+        yield oc
+
+
+@pytest.fixture
+def api(mock_oc):
+    return TsmRest('localhost', str(mock_oc.port))
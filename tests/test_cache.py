@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from result_cache import ResultCache
+
+
+def test_cache_hit_without_rest_call(api, mock_oc):
+    api.cache = ResultCache(default_ttl=60)
+    first, _ = api.query(['A'], 'u', 'p', 'q node')
+    second, _ = api.query(['A'], 'u', 'p', 'Q  NODE')
+
+    assert second['items'] == first['items']
+    assert mock_oc.servers['A'] == 1
+    assert api.cache.stats['hits'] == 1
+
+
+def test_cache_read_only_commands_only(api, mock_oc):
+    api.cache = ResultCache(default_ttl=60, ttls={'cancel': 5})
+    assert api.cache.ttl('select * from nodes') == 60
+    assert api.cache.ttl('cancel process 12') == 5
+    assert api.cache.ttl('update node x') == 0
+
+    api.query(['A'], 'u', 'p', 'update node x')
+    api.query(['A'], 'u', 'p', 'update node x')
+    assert mock_oc.servers['A'] == 2
+
+
+def test_cache_per_user(api, mock_oc):
+    api.cache = ResultCache(default_ttl=60)
+    api.query(['A'], 'u', 'p', 'q node')
+    api.query(['A'], 'other', 'p', 'q node')
+    assert mock_oc.servers['A'] == 2
+
+
+def run_at_once(api, count):
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(lambda i: api.query(['A'], 'u', 'p', 'q node')[0], range(count)))
+
+
+def test_identical_requests_share_one_call(api, mock_oc):
+    mock_oc.latency = 0.3
+    results = run_at_once(api, 5)
+
+    assert mock_oc.servers['A'] == 1
+    assert all(result['items'] == results[0]['items'] for result in results)
+    assert api.single_flight.stats['shared'] == 4
+
+
+def test_coalescing_can_be_switched_off(api, mock_oc):
+    mock_oc.latency = 0.3
+    api.coalesce_requests = False
+    run_at_once(api, 5)
+    assert mock_oc.servers['A'] == 5
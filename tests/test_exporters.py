@@ -0,0 +1,103 @@
+import csv
+import json
+import sqlite3
+
+import pytest
+from openpyxl import load_workbook
+
+from extra_functions import read_csv, read_csv_view
+from oc_cluster import TsmCluster
+
+SERVERS = ['A', 'NOMATCH1', 'B']
+
+
+def read_report(file_name):
+    with open(file_name, newline='') as f:
+        return list(csv.reader(f, delimiter=';'))
+
+
+@pytest.fixture
+def result(api):
+    api.run_command(SERVERS, 'u', 'p', 'q node')
+    return api.parsed_result
+
+
+def test_csv(api, result, tmp_path):
+    file_name = str(tmp_path / 'nodes.csv')
+    api.create_report('CSV', file_name)
+    lines = read_report(file_name)
+
+    assert lines[0] == result['hdr']
+    assert len(lines) == 1 + len(result['items'])
+    assert lines[46] == ['NOMATCH1 - NO MATCH FOUND'] + ['-'] * 10
+
+
+def test_json_and_html(api, result, tmp_path):
+    api.create_report('JSON', str(tmp_path / 'nodes.json'))
+    with open(tmp_path / 'nodes.json') as f:
+        rows = json.load(f)
+    assert len(rows) == len(result['items'])
+    assert list(rows[0]) == result['hdr']
+
+    api.create_report('HTML', str(tmp_path / 'nodes.html'))
+    assert (tmp_path / 'nodes.html').read_text().count('<tr>') == 1 + len(result['items'])
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_xlsx(api, result, tmp_path, streaming):
+    file_name = str(tmp_path / 'nodes.xlsx')
+    api.create_report('XLSX', file_name, 'Nodes', streaming=streaming)
+    sheet = load_workbook(file_name)['Nodes']
+
+    assert [cell.value for cell in sheet[1]] == result['hdr']
+    assert sheet.max_row == 1 + len(result['items'])
+
+
+def test_sqlite(api, result, tmp_path):
+    file_name = str(tmp_path / 'history.db')
+    api.create_report('SQLITE', file_name)
+    api.create_report('SQLITE', file_name)
+
+    with sqlite3.connect(file_name) as conn:
+        assert conn.execute('SELECT count(*) FROM snapshots').fetchone()[0] == 2
+        assert conn.execute('SELECT count(*) FROM q_node').fetchone()[0] == 2 * 90
+
+
+def test_stream_has_its_own_result(api, tmp_path):
+    rows = api.stream_command(SERVERS, 'u', 'p', 'q node')
+    api.run_command(['C'], 'u', 'p', 'q stgpool')  # Another command while the stream is not read yet
+    file_name = str(tmp_path / 'stream.csv')
+    api.create_report('CSV', file_name, rows=rows)
+
+    assert read_report(file_name)[0][:3] == ['TSM SERVER', 'Node Name', 'Platform']
+    assert rows.parsed_result['msg'][0]['srv'] == 'NOMATCH1'
+    assert 'msg' not in api.parsed_result
+
+
+def test_stream_equals_run_command(api, result):
+    items = result['items']
+    assert list(api.stream_command(SERVERS, 'u', 'p', 'q node')) == items
+
+
+def test_cluster_report(mock_oc, tmp_path):
+    cluster = TsmCluster({f'localhost:{mock_oc.port}': ['A', 'B']})
+    instance = cluster.instance('A')
+    instance.parsed_result = {'unchanged': True}
+    cluster.run_command(['B', 'A'], 'u', 'p', 'q node')
+    file_name = str(tmp_path / 'cluster.csv')
+    cluster.create_report('CSV', file_name)
+
+    assert len(read_report(file_name)) == 1 + 90
+    assert instance.parsed_result == {'unchanged': True}
+
+
+def test_read_csv_returns_own_copies(tmp_path):
+    file_name = str(tmp_path / 'servers.csv')
+    (tmp_path / 'servers.csv').write_text('Server;Site\nTSM01;AMS\n'.replace(';', ','))
+    rows = read_csv(file_name)
+    rows['items'][0]['Server'] = 'changed'
+    rows['hdr'].append('extra')
+
+    assert read_csv(file_name) == {'hdr': ['Server', 'Site'], 'items': [{'Server': 'TSM01', 'Site': 'AMS'}]}
+    with pytest.raises(TypeError):
+        read_csv_view(file_name)['items'][0]['Server'] = 'changed'
@@ -0,0 +1,113 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from rate_limit import TokenBucket
+from scheduler import Scheduler
+from server_health import CircuitOpenError, ServerHealth, command_shape
+from tsmrest import TsmRest
+
+
+def test_circuit_opens_after_failures(api, mock_oc):
+    mock_oc.failure_rate = 1.0  # HTTP 503
+    api.command_retries = 0
+    for i in range(3):
+        api.query(['A'], 'u', 'p', 'q node')
+    assert api.health.status()['A']['state'] == 'open'
+
+    parsed_result, _ = api.query(['A'], 'u', 'p', 'q node')
+    assert 'Circuit open' in parsed_result['items'][0]['TSM SERVER']
+    assert mock_oc.servers['A'] == 3
+
+
+def test_http_500_does_not_open_the_circuit(api):
+    for i in range(5):
+        api.query(['FAIL1'], 'u', 'p', 'q node')
+    assert api.health.status()['FAIL1']['state'] == 'closed'
+
+
+def test_probe_closes_the_circuit(api):
+    for i in range(3):
+        api.health.failure('A', 'q node')
+    api.health.servers['A']['open_until'] = time.monotonic() - 1
+
+    parsed_result, _ = api.query(['A'], 'u', 'p', 'q node')
+    assert len(parsed_result['items']) == 45
+    assert api.health.status()['A']['state'] == 'closed'
+
+
+def test_stream_records_health(api):
+    for i in range(3):
+        api.health.failure('A', 'q node')
+    api.health.servers['A']['open_until'] = time.monotonic() - 1
+
+    rows = api.stream_command(['A'], 'u', 'p', 'q node')
+    next(rows)
+    rows.close()  # Consumer stops early: the probe still ends
+    assert api.health.servers['A']['state'] == 'closed'
+    assert not api.health.servers['A']['probing']
+
+
+def test_half_open_rejects_other_calls():
+    health = ServerHealth(failure_threshold=1, open_seconds=0)
+    health.failure('A')
+    health.check('A')  # The probe
+    with pytest.raises(CircuitOpenError):
+        health.check('A')
+    health.release('A')
+    health.check('A')
+
+
+def test_timeouts_are_not_retried():
+    # An OC that accepts connections and never replies
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(10)
+    connections = []
+    threading.Thread(target=lambda: [connections.append(server.accept()) for i in range(10)], daemon=True).start()
+
+    api = TsmRest('127.0.0.1', str(server.getsockname()[1]))
+    api.request_timeout = 0.5
+    start = time.perf_counter()
+    parsed_result, _ = api.query(['A'], 'u', 'p', 'q node')
+    assert time.perf_counter() - start < 0.9
+    assert 'A - ERROR' in parsed_result['items'][0]['TSM SERVER']
+    server.close()
+
+
+def test_durations_per_command_shape():
+    assert command_shape("select * from actlog where date_time >= '2026-10-17 10:15:00'") == \
+        command_shape("SELECT * from actlog where date_time >= '2026-10-18 00:00:00'")
+
+    health = ServerHealth(max_commands=3)
+    for i in range(10):
+        health.success(f'TSM{i}', 'q node', 0.1)
+    assert len(health.durations) == 3
+
+
+def test_queue_time_is_not_server_latency(api, mock_oc):
+    mock_oc.latency = 0.1
+    api.pool._slots = threading.BoundedSemaphore(1)
+    api.query([f'TSM{i}' for i in range(5)], 'u', 'p', 'q node', max_workers=5)
+    assert max(max(durations) for durations in api.health.durations.values()) < 0.3
+
+
+def test_rate_limit(api):
+    api.rate_limits.append(TokenBucket(10, 1))
+    start = time.perf_counter()
+    for i in range(4):
+        api.query([f'TSM{i}'], 'u', 'p', 'q node')
+    assert time.perf_counter() - start >= 0.29
+
+
+def test_schedulers_do_not_stack_rate_limits(api):
+    own_bucket = TokenBucket(100)
+    api.rate_limits.append(own_bucket)
+    Scheduler(api, [], 'u', 'p', rate=20, oc_rate=10)
+    scheduler = Scheduler(api, [], 'u', 'p', rate=20, oc_rate=10)
+
+    assert len(api.rate_limits) == 3
+    assert api.rate_limits[0] is own_bucket
+    assert scheduler.rate_limit in api.rate_limits
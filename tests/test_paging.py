@@ -0,0 +1,56 @@
+import time
+
+from openpyxl import load_workbook
+
+from paged_select import page_command, pageable
+from report_session import ReportSession, sheet_title
+
+SELECT = 'select * from nodes order by node_name'
+
+
+def test_pageable():
+    assert pageable(SELECT)[0]
+    assert not pageable('select * from nodes')[0]
+    assert not pageable('q node')[0]
+    assert page_command(SELECT, 2, 10).endswith('OFFSET 20 ROWS FETCH FIRST 10 ROWS ONLY')
+
+
+def test_paged_result_equals_one_request(api, mock_oc):
+    full, _ = api.query(['A', 'NOMATCH1', 'B'], 'u', 'p', SELECT)
+    paged, _ = api.query_paged(['A', 'NOMATCH1', 'B'], 'u', 'p', SELECT, max_workers=3, page_size=10)
+
+    assert paged['items'] == full['items']
+    assert paged['hdr'] == full['hdr']
+    assert paged['tsm_srv'] == ['A', 'NOMATCH1', 'B']
+    # 45 rows: pages 1-4 full, page 5 not full. Not one page more
+    assert mock_oc.servers['B'] == 1 + 5
+
+
+def test_query_pages_with_page_size(api):
+    api.page_size = 10
+    parsed_result, _ = api.query(['A'], 'u', 'p', SELECT)
+    assert len(parsed_result['items']) == 45
+    assert sum(1 for record in api.metrics.records if 'OFFSET' in record['command']) == 5
+
+
+def test_run_commands_deadline_includes_paged_commands(api, mock_oc):
+    mock_oc.latency = 0.2
+    api.page_size = 10
+    commands = {'nodes': 'q node', 'paged': SELECT, 'paged2': 'select * from occ order by x'}
+
+    start = time.perf_counter()
+    results = api.run_commands(['A', 'B'], 'u', 'p', commands, deadline=0.5)
+    assert time.perf_counter() - start < 0.9
+
+    assert len(results['nodes']['items']) == 90
+    assert 'no time left' in results['paged2']['items'][0]['TSM SERVER']
+
+
+def test_sheet_titles_of_run_commands(api, tmp_path):
+    results = api.run_commands(['A'], 'u', 'p', ['select * from nodes', 'q node', 'q node '])
+    file_name = str(tmp_path / 'report.xlsx')
+    with ReportSession(file_name) as report:
+        report.add_sheets(results)
+
+    assert load_workbook(file_name).sheetnames == ['select from nodes', 'q node', 'q node (2)']
+    assert sheet_title('x' * 40, ['X' * 31]) == 'x' * 27 + ' (2)'
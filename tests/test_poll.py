@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+from incremental import HighWaterMarks, add_lower_bound, advance_mark, mark_value
+
+SELECT = 'select * from nodes'
+HWM_FIELD = 'Last Access Date/Time'
+
+
+def actlog_row(second, message):
+    return {'DATE_TIME': f'2026-10-17 10:00:0{second}', 'MESSAGE': message}
+
+
+def test_second_poll_returns_no_old_rows(api):
+    marks = HighWaterMarks()
+    first = list(api.poll(['A', 'NOMATCH1'], 'u', 'p', SELECT, 'lastacc_time', marks, hwm_field=HWM_FIELD))
+    # The mock OC ignores the WHERE condition: every row comes again, none is new
+    second = list(api.poll(['A', 'NOMATCH1'], 'u', 'p', SELECT, 'lastacc_time', marks, hwm_field=HWM_FIELD))
+
+    assert len(first) == 45
+    assert second == []
+    assert "WHERE lastacc_time >= '2020-09-1" in list(api.metrics.records)[-2]['command']
+
+
+def test_poll_rejects_other_commands(api):
+    with pytest.raises(ValueError):
+        api.poll(['A'], 'u', 'p', 'q actlog begint=-1', 'date_time', HighWaterMarks())
+    with pytest.raises(ValueError):
+        add_lower_bound('q actlog', 'date_time', 1)
+
+
+def test_identical_rows_are_all_new():
+    rows = [actlog_row(1, 'a'), actlog_row(2, 'same'), actlog_row(2, 'same'), actlog_row(2, 'same')]
+    mark, new_rows = advance_mark(None, rows, 'DATE_TIME')
+    assert len(new_rows) == 4
+
+    # Next reply: the rows at the mark again, one more identical row and a later row
+    mark, new_rows = advance_mark(mark, rows[1:] + [actlog_row(2, 'same'), actlog_row(3, 'b')], 'DATE_TIME')
+    assert new_rows == [actlog_row(2, 'same'), actlog_row(3, 'b')]
+
+    mark, new_rows = advance_mark(mark, [actlog_row(3, 'b')], 'DATE_TIME')
+    assert new_rows == []
+
+
+def test_marks_file(tmp_path):
+    file_name = str(tmp_path / 'marks.json')
+    mark, new_rows = advance_mark(None, [actlog_row(1, 'a'), actlog_row(1, 'a')], 'DATE_TIME')
+    marks = HighWaterMarks(file_name)
+    marks.set('key', mark)
+    marks.save()
+    assert HighWaterMarks(file_name).get('key') == mark
+
+
+def test_mark_values():
+    assert mark_value('2026-10-17-10.15.00.000000') == datetime.datetime(2026, 10, 17, 10, 15)
+    assert mark_value('10/17/2026 10:15:00') == datetime.datetime(2026, 10, 17, 10, 15)
+    assert mark_value('42') == 42
+    assert mark_value('-') is None
@@ -0,0 +1,38 @@
+import pytest
+
+import result_query
+from result_query import ResultFrame
+
+ROWS = {'Key': [1, '1', 1.0, None, 'None', 1, '-'],
+        'Size': ['2 GB', '1024 MB', '512', '-', '1 GB', None, '3 GB'],
+        'Pool': ['A', 'A', 1, '1', None, '-', 'B']}
+
+
+def aggregate():
+    frame = ResultFrame(ROWS)
+    grouped = frame.group_by('Key').agg(rows=('Size', 'count'), total=('Size', 'sum'), pools=('Pool', 'distinct'))
+    return list(grouped.rows()), list(frame.group_by().agg(pools=('Pool', 'distinct')).rows())
+
+
+@pytest.fixture
+def without_numpy(monkeypatch):
+    monkeypatch.setattr(result_query, 'numpy', None)
+
+
+def test_groups_by_value():
+    groups, total = aggregate()
+    assert [group.get('Key') for group in groups] == [1, '1', 1.0, None, 'None', '-']
+    assert total == [{'pools': 4}]
+
+
+def test_same_result_without_numpy(monkeypatch):
+    with_numpy = aggregate()
+    monkeypatch.setattr(result_query, 'numpy', None)
+    assert aggregate() == with_numpy
+
+
+def test_sizes_in_the_unit_of_the_column(without_numpy):
+    frame = ResultFrame(ROWS)
+    assert frame.unit('Size') == 'GB'
+    assert frame.values('Size')[:3] == [2.0, 1.0, 512.0]
+    assert frame.values('Size', 'MB')[:2] == [2048.0, 1024.0]
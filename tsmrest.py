@@ -1,24 +1,54 @@
 import json
-import ssl
 import base64
-from urllib.request import urlopen, Request
+import hashlib
 import urllib.error
+import http.client
 import socket
-import csv
 import os.path
 import datetime
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import chain
 from pprint import pprint
 
-# 3rd Party Modules
-from openpyxl import Workbook, load_workbook
-
 # Project specific functions
-from extra_functions import create_xls_styles
+# Report writers (openpyxl, sqlite3) are imported the first time a report type is used (see export_backends.py)
+from export_backends import EXPORT_BACKENDS, export_backend
+from oc_transport import OcConnectionPool
+from json_stream import RestReplyStream
+from column_decoders import infer_shape, compile_row_parser
+from result_set import CompactItems, RowStream
+from result_cache import normalize_command
+from single_flight import SingleFlight
+from metrics import CommandMetrics, new_timing, add_phase
+from paged_select import is_select, pageable, page_command, reply_rows
+from incremental import HighWaterMarks, add_lower_bound, advance_mark, window_start
+from server_health import ServerHealth, CircuitOpenError, read_only
 
 
 class TsmRest:
 
     request_timeout = 10  # HTTP request timeout (seconds)
+    max_workers = 1  # Number of TSM servers queried at the same time by run_command()
+    command_deadline = None  # Max duration of one run_command() call (seconds). None = no limit
+    max_connections = 10  # Max number of open HTTPS connections to the OC. Read when the instance is created
+    keep_raw_result = True  # Keep the REST responses in self.raw_result. Set to False to save memory
+    decoder_sample_rows = 16  # Number of rows used to detect the value shape of a column (see row_parser)
+    column_shapes = {}  # Value shape per column ID, shared by all instances (see row_parser)
+    row_parsers = {}  # Compiled row parser per set of columns, shared by all instances (see row_parser)
+    compact_result = False  # Store parsed_result['items'] as CompactItems (tuples) instead of a list of dicts
+    cache = None  # Optional ResultCache: REST responses are reused until their TTL expires (opt-in)
+    coalesce_requests = True  # Identical commands in flight at the same time share one REST call
+    page_size = None  # SELECT commands with an ORDER BY are fetched in pages of page_size rows (see query_paged)
+    page_retries = 2  # Retries of a failed page (connection refused/reset, HTTP 502/503/504)
+    max_pages = 1000  # Max number of pages per TSM server
+    command_retries = 1  # Retries of a query/select/show command (connection refused/reset, HTTP 502/503/504)
+    retry_timeouts = False  # Retry timeouts too. Off: an unreachable OC fails after one request_timeout
+    retry_backoff = 0.5  # Delay before a retry: random 0 .. retry_backoff * 2^attempt seconds (max retry_max_delay)
+    retry_max_delay = 5.0
+    track_server_health = True  # Circuit breaker and adaptive timeouts per TSM server (see server_health.py)
+    #                             Read when the instance is created, my_api.health = None disables it later
 
     def __init__(self, oc_address, oc_port):
         self.oc_address = oc_address
@@ -28,13 +58,41 @@ class TsmRest:
         self.raw_result = []        # REST response - structured by IBM
         self.parsed_result = {}     # REST response - restructured with parse_raw_data()
 
+        # Keep-alive HTTPS connections to the OC, shared by all commands of this instance
+        self.pool = OcConnectionPool(oc_address, oc_port, self.max_connections)
+
+        # Identical commands in flight at the same time (several threads) share one REST call (coalesce_requests)
+        self.single_flight = SingleFlight()
+
+        # Per TSM server and per phase timings of every REST call, hooks, Prometheus output (see metrics.py)
+        self.metrics = CommandMetrics(self.oc_key)
+
+        # Skips TSM servers that failed several times in a row, adapts the timeouts (see server_health.py)
+        self.health = ServerHealth() if self.track_server_health else None
+
+        # Token buckets (see rate_limit.py): every REST call to the OC waits for a token of each of them
+        self.rate_limits = []
+
     @property
     def base_url(self):
         return str("https://" + self.oc_address + ":" + self.oc_port + "/oc")
 
-    def run_command(self, tsm_servers, tsm_user, tsm_pass, tsm_command):
+    @property
+    def oc_key(self):
+        # Identifies the OC in cache keys
+        return self.oc_address + ":" + str(self.oc_port)
+
+    @property
+    def pool_stats(self):
+        # Connection pool statistics (requests, new_connections, reused_connections, ...)
+        return dict(self.pool.stats)
+
+    def run_command(self, tsm_servers, tsm_user, tsm_pass, tsm_command, max_workers=None, deadline=None):
         # Send TSM command via REST call to TSM OC web server
         # Nothing is returned to main. self.parsed_result and self.raw_result will be set.
+        # max_workers: number of TSM servers queried at the same time (default: class attribute max_workers)
+        # deadline: max duration in seconds of the whole call (default: class attribute command_deadline)
+        # Not thread-safe (the result is saved in the instance): use query() when calling from several threads
         self.parsed_result = {}
         self.raw_result = []
 
@@ -43,87 +101,117 @@ class TsmRest:
             tsm_servers = [tsm_servers]
         self.tsm_servers = tsm_servers
 
-        print(f"\nExecuting your command on {len(tsm_servers)} TSM server(s)...")
-        for tsm_server in tsm_servers:
+        self.parsed_result, self.raw_result = self.query(tsm_servers, tsm_user, tsm_pass, tsm_command,
+                                                         max_workers, deadline)
 
-            # Prepare HTTP request:
+    # End of function run_command()
 
-            # Credential string for HTTP header + Re-encode to ensure all chars are safe for transport
-            cred_str = tsm_user + ":" + tsm_pass
-            cred_encoded = base64.b64encode(cred_str.encode()).decode()
+    def run_commands(self, tsm_servers, tsm_user, tsm_pass, tsm_commands, max_workers=None, deadline=None):
+        # Several commands on several TSM servers in one call (health check: q stg, q db, q proc, ...)
+        # tsm_commands: list of commands, or dict {name: command}, e.g. {'Storage Pools': 'q stgpool', ...}
+        # Returns a dict {name (or command): parsed_result}, in the order of tsm_commands. Feeds ReportSession.add_sheets()
+        # All calls share one pool of max_workers threads (concurrent calls to the OC) and the OC connections
+        # deadline: max duration in seconds of the whole batch, paged commands included: they get the time left.
+        # A paged command that has no time left is not sent, its TSM servers get the 'Deadline exceeded' error
+        # self.parsed_result and self.raw_result are not used
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+        if isinstance(tsm_commands, str):
+            tsm_commands = [tsm_commands]
+        if not isinstance(tsm_commands, dict):
+            tsm_commands = {tsm_command: tsm_command for tsm_command in tsm_commands}
+
+        if max_workers is None:
+            max_workers = self.max_workers
+        if deadline is None:
+            deadline = self.command_deadline
+        start = time.perf_counter()
+
+        # Large SELECT commands are fetched in pages, on their own (see query_paged())
+        paged = {}
+        if self.page_size:
+            paged = {name: tsm_command for name, tsm_command in tsm_commands.items()
+                     if is_select(tsm_command) and pageable(tsm_command)[0]}
+        batch = {name: tsm_command for name, tsm_command in tsm_commands.items() if name not in paged}
+
+        print(f"\nExecuting {len(batch)} command(s) on {len(tsm_servers)} TSM server(s)...")
+
+        timings = [[new_timing() for tsm_server in tsm_servers] for tsm_command in batch.values()]
+        responses = self.fetch_matrix(tsm_servers, tsm_user, tsm_pass, list(batch.values()), max_workers, deadline,
+                                      timings)
 
-            request_header = {
-                "OC-API-Version": "1.0",
-                "Authorization": "Basic " + cred_encoded,
-                "Accept": "application/json",
-                "Content-type": "text/plain"
-            }
-            request_payload = tsm_command
+        results = {}
+        for (name, tsm_command), command_responses, command_timings in zip(batch.items(), responses, timings):
+            print(f"{tsm_command}:")
+            results[name] = self.parse_responses(tsm_servers, tsm_command, command_responses, command_timings)[0]
 
-            # Construct full URL
-            full_url = self.base_url + '/api/cli/issueConfirmedCommand/' + tsm_server
+        for name, tsm_command in paged.items():
+            time_left = None if deadline is None else max(0.0, deadline - (time.perf_counter() - start))
+            results[name] = self.query_paged(tsm_servers, tsm_user, tsm_pass, tsm_command, max_workers, time_left)[0]
 
-            # Create HTTP request object
-            my_http_request = Request(full_url, request_payload.encode(), request_header, method='POST')
+        return {name: results[name] for name in tsm_commands}
+
+    # End of function run_commands()
+
+    def query(self, tsm_servers, tsm_user, tsm_pass, tsm_command, max_workers=None, deadline=None):
+        # Same as run_command(), but the result is returned: tuple (parsed_result, raw_result)
+        # Thread-safe: the instance attributes parsed_result, raw_result and tsm_servers are not used
+
+        # Convert tsm_servers to list if only 1 TSM server is given as a string
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
 
-            # Create empty SSL context to ignore cert warnings (sets option CERT_NONE)
-            ssl_context = ssl.SSLContext()
+        # Opt-in: large SELECT commands in pages (see query_paged())
+        if self.page_size and is_select(tsm_command):
+            is_pageable, reason = pageable(tsm_command)
+            if is_pageable:
+                return self.query_paged(tsm_servers, tsm_user, tsm_pass, tsm_command, max_workers, deadline)
+            print(f"\nNo paging: {reason}. The command is sent in one request")
+
+        if max_workers is None:
+            max_workers = self.max_workers
+        if deadline is None:
+            deadline = self.command_deadline
+
+        print(f"\nExecuting your command on {len(tsm_servers)} TSM server(s)...")
+
+        # Execute the REST calls (concurrently if max_workers > 1)
+        timings = [new_timing() for tsm_server in tsm_servers]
+        responses = self.fetch_all(tsm_servers, tsm_user, tsm_pass, tsm_command, max_workers, deadline, timings)
+
+        return self.parse_responses(tsm_servers, tsm_command, responses, timings)
+
+    # End of function query()
+
+    def parse_responses(self, tsm_servers, tsm_command, responses, timings, parsed_result=None, raw_result=None):
+        # parsed_result and raw_result of one command from the responses of fetch_all(): tuple (parsed_result, raw_result)
+        # TSM servers without a response get an error record, every TSM server gets a metrics record
+        # parsed_result, raw_result: add the rows to an existing result (see TsmCluster). The caller completes it
+        new_result = parsed_result is None
+        if new_result:
+            parsed_result = {}
+        if raw_result is None:
+            raw_result = []
+
+        # Parse the responses in the order of tsm_servers, not in the order the TSM servers replied
+        for tsm_server, (raw_rest_reply, exception_msg), timing in zip(tsm_servers, responses, timings):
 
             # Flag. To execute code in 'finally' block
             correct_execution = False
-            exception_msg = ''
+            row_count = len(parsed_result.get('items', ()))
 
-            # Execute REST call and parse data
             try:
-                with urlopen(my_http_request, timeout=self.request_timeout, context=ssl_context) as u:
-                    http_response = u.read()
-                    # debug: print(f"REQUEST STATUS: {u.status} - REASON: {u.reason} ")
-
+                if raw_rest_reply is not None:
                     # Save REST response (with original IBM logic/format/syntax)
-                    raw_rest_reply = json.loads(http_response)
-                    self.raw_result.append(raw_rest_reply)
-
-                    # Parse raw data (sets self.parsed_result)
-                    self.parse_raw_data(raw_rest_reply, tsm_server, tsm_command)
-
-                correct_execution = True
+                    if self.keep_raw_result:
+                        raw_result.append(raw_rest_reply)
 
-            # HTTP exceptions
-            except urllib.error.HTTPError as e:
-                if e.code == 404:
-                    exception_msg = (
-                        f"ERROR: Page not found! HTML RC {e.code}\n"
-                        f"       Validate that the REST API is enabled and accessible\n"
-                        f"       Check the settings menu in the OC at {self.base_url} with user '{tsm_user}\n"
-                    )
-                elif e.code == 403:
-                    exception_msg = f"ERROR: Access denied! HTML RC {e.code}"
-                elif e.code == 401:
-                    exception_msg = (
-                        f"ERROR: API Access refused! : {e.reason} HTML RC {e.code}\n"
-                        f"       Try to access the operations center at {self.base_url} with user '{tsm_user}'\n"
-                        f"       Validate that the REST API is enabled in the operations center settings menu\n"
-                    )
-                elif e.code == 500:
-                    # Catches incorrect syntax AND permissions. Cannot differentiate
-                    # It also catches a TSM server name that is not managed/configured on TSM OC
-                    # Hopefully IBM fixes this in future, or maybe I'm blind.
-                    exception_msg = "ERROR: Problem with syntax of TSM command or TSM account privileges"
-                else:
-                    exception_msg = f"ERROR: Incorrect request. Response: {e.code} : {e.reason}"
-
-            # Connectivity exceptions (URLError is superclass of HTTPError that why it comes after HTTPError)
-            except urllib.error.URLError as e:
-                if isinstance(e.reason, socket.timeout):
-                    exception_msg = f"ERROR: Timeout. Is {self.oc_address} reachable?"
-                elif isinstance(e.reason, ConnectionRefusedError):
-                    exception_msg = f"ERROR: Connection refused. Is {self.oc_address} port {self.oc_port} reachable?"
-                else:
-                    exception_msg = f"ERROR: Request error: {e.reason}"
-                    # debug: print(repr(e.args[0]))
+                    # Parse raw data (adds the rows to parsed_result)
+                    start = time.perf_counter()
+                    self.parse_raw_data(raw_rest_reply, tsm_server, tsm_command, parsed_result)
+                    add_phase(timing, 'parse', time.perf_counter() - start)
 
-            except socket.timeout:
-                exception_msg = f"ERROR: Timeout exceeded: {self.request_timeout} secs. Is {self.oc_address} reachable?"
+                    correct_execution = True
 
             # If data structure is not as expected we raise ValueError in parse_raw_data()
             except ValueError as e:
@@ -140,16 +228,20 @@ class TsmRest:
                 else:
                     # Exception was raised, add informational record to data set
                     empty_record = {'TSM SERVER': tsm_server + ' - ' + exception_msg}
-                    if 'items' in self.parsed_result:
-                        self.parsed_result['items'].append(empty_record)  # Pycharm TypeChecker (ok in VSC, ignore)
-                    else:
-                        self.parsed_result['items'] = [empty_record]
+                    self.result_items(parsed_result).append(empty_record)
 
                     print(f" -> {tsm_server} : {exception_msg}")
 
                 # Save command and TSM server
-                self.parsed_result['cmd'] = tsm_command
-                self.parsed_result['tsm_srv'] = tsm_servers
+                parsed_result['cmd'] = tsm_command
+                parsed_result['tsm_srv'] = tsm_servers
+
+                # Timings and byte counts of this TSM server (see self.metrics)
+                if correct_execution:
+                    self.metrics.record(tsm_server, tsm_command, timing, 'ok', '',
+                                        len(parsed_result['items']) - row_count)
+                else:
+                    self.metrics.record(tsm_server, tsm_command, timing, 'error', exception_msg)
 
             # End of Try/Catch
 
@@ -157,10 +249,442 @@ class TsmRest:
 
         # If there are 'items' and no 'hdr' (columns) it means we had 'No Match Found' across all TSM servers
         # So we add 'hdr' to the result, with just 1 'hdr': TSM SERVER
-        if 'items' in self.parsed_result and 'hdr' not in self.parsed_result:
-            self.parsed_result['hdr'] = ['TSM SERVER']
+        if new_result and 'items' in parsed_result and 'hdr' not in parsed_result:
+            parsed_result['hdr'] = ['TSM SERVER']
 
-    # End of function run_command()
+        return parsed_result, raw_result
+
+    # End of function parse_responses()
+
+    def query_paged(self, tsm_servers, tsm_user, tsm_pass, tsm_command, max_workers=None, deadline=None,
+                    page_size=None):
+        # query() for large SELECT commands: the result is fetched in pages of 'page_size' rows
+        # ("... OFFSET n ROWS FETCH FIRST page_size ROWS ONLY"), up to max_workers pages at the same time.
+        # Every page is a short REST call: request_timeout applies per page, a failed page is retried
+        # (page_retries). The rows are merged in order (TSM server, page), same parsed_result as query()
+        # The SELECT needs an ORDER BY on a unique key, otherwise pages can overlap or miss rows
+        parsed_result = {}
+        raw_result = []
+
+        # Convert tsm_servers to list if only 1 TSM server is given as a string
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+
+        if max_workers is None:
+            max_workers = self.max_workers
+        if deadline is None:
+            deadline = self.command_deadline
+        if page_size is None:
+            page_size = self.page_size
+
+        print(f"\nExecuting your command on {len(tsm_servers)} TSM server(s) in pages of {page_size} rows...")
+
+        pages = self.fetch_pages(tsm_servers, tsm_user, tsm_pass, tsm_command, page_size, max_workers, deadline)
+        self.parse_pages(tsm_servers, tsm_command, pages, page_size, parsed_result, raw_result)
+
+        # Save command and TSM server
+        parsed_result['cmd'] = tsm_command
+        parsed_result['tsm_srv'] = tsm_servers
+
+        # 'No Match Found' across all TSM servers
+        if 'items' in parsed_result and 'hdr' not in parsed_result:
+            parsed_result['hdr'] = ['TSM SERVER']
+
+        return parsed_result, raw_result
+
+    # End of function query_paged()
+
+    def parse_pages(self, tsm_servers, tsm_command, pages, page_size, parsed_result=None, raw_result=None):
+        # Rows of the pages of fetch_pages(), in the order of tsm_servers and pages: tuple (parsed_result, raw_result)
+        # parsed_result, raw_result: add the rows to an existing result (see TsmCluster). The caller completes it
+        if parsed_result is None:
+            parsed_result = {}
+        if raw_result is None:
+            raw_result = []
+
+        for tsm_server, server_pages in zip(tsm_servers, pages):
+            exception_msg = ''
+
+            for page, (raw_rest_reply, page_msg, timing) in enumerate(server_pages):
+                page_cmd = page_command(tsm_command, page, page_size)
+                row_count = len(parsed_result.get('items', ()))
+
+                # The page after the last full page is empty ('no match found'): end of the result
+                if raw_rest_reply is not None and page > 0 and reply_rows(raw_rest_reply) == 0:
+                    self.metrics.record(tsm_server, page_cmd, timing, 'ok')
+                    break
+
+                try:
+                    if raw_rest_reply is None:
+                        exception_msg = page_msg
+                    else:
+                        if self.keep_raw_result:
+                            raw_result.append(raw_rest_reply)
+
+                        start = time.perf_counter()
+                        self.parse_raw_data(raw_rest_reply, tsm_server, tsm_command, parsed_result)
+                        add_phase(timing, 'parse', time.perf_counter() - start)
+
+                # If data structure is not as expected we raise ValueError in parse_raw_data()
+                except ValueError as e:
+                    exception_msg = f"ERROR: {e.args[0]}"
+
+                # All other exceptions
+                except Exception as e:
+                    exception_msg = f"ERROR: Unhandled exception - Contact the developer. Text: {e} Error Type: {type(e)}"
+
+                if exception_msg:
+                    self.metrics.record(tsm_server, page_cmd, timing, 'error', exception_msg)
+
+                    # The rows of the pages before are kept, the error record shows where the result stops
+                    exception_msg = f"{exception_msg} (page {page + 1}, rows from {page * page_size + 1})"
+                    break
+
+                self.metrics.record(tsm_server, page_cmd, timing, 'ok', '', len(parsed_result['items']) - row_count)
+
+            else:
+                # Every page was full: max_pages reached, the result is not complete
+                if server_pages and reply_rows(server_pages[-1][0]) == page_size:
+                    exception_msg = f"WARNING: Result truncated after {len(server_pages)} pages (max_pages)"
+
+            if exception_msg:
+                self.result_items(parsed_result).append({'TSM SERVER': tsm_server + ' - ' + exception_msg})
+                print(f" -> {tsm_server} : {exception_msg}")
+            else:
+                print(f" -> {tsm_server} : OK ({len(server_pages)} page(s))")
+
+        # End of loop 'for every tsm server in list'
+
+        return parsed_result, raw_result
+
+    # End of function parse_pages()
+
+    def fetch_pages(self, tsm_servers, tsm_user, tsm_pass, tsm_command, page_size, max_workers=1, deadline=None):
+        # Fetch the pages of a SELECT on every TSM server, up to 'max_workers' REST calls at the same time
+        # Returns one list per TSM server with a tuple (raw_rest_reply, exception_msg, timing) per page.
+        # The number of pages is not known in advance: pages are requested in rounds, the TSM servers whose
+        # last page was full get the next pages in the next round. A list stops at the first page that is
+        # not full (the end of the result), at a failed page, or at max_pages pages
+        deadline_msg = f"ERROR: Deadline exceeded: no reply within {deadline} secs"
+        if deadline is not None and deadline <= 0:
+            deadline_msg = "ERROR: Deadline exceeded: no time left for this command"
+        end_time = None if deadline is None else time.perf_counter() + deadline
+        pages = [[] for tsm_server in tsm_servers]
+        active = list(range(len(tsm_servers)))  # Index of the TSM servers that need more pages
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            while active:
+                if end_time is not None and time.perf_counter() >= end_time:
+                    # No time left for the next round: no REST call is sent
+                    for index in active:
+                        pages[index].append((None, deadline_msg, new_timing()))
+                    break
+
+                # Share the workers between the TSM servers that need more pages
+                pages_per_server = max(1, max_workers // len(active))
+                futures = {}
+                for index in active:
+                    first_page = len(pages[index])
+                    for page in range(first_page, min(first_page + pages_per_server, self.max_pages)):
+                        timing = new_timing()
+                        future = executor.submit(self.fetch, tsm_servers[index], tsm_user, tsm_pass,
+                                                 page_command(tsm_command, page, page_size), timing,
+                                                 self.page_retries)
+                        futures[future] = (index, timing)
+
+                timeout = None if end_time is None else max(0.0, end_time - time.perf_counter())
+                done, not_done = wait(futures, timeout=timeout)
+
+                # Futures are in page order per TSM server (dicts keep the insertion order)
+                finished = set()
+                for future, (index, timing) in futures.items():
+                    if index in finished:
+                        continue  # Page after the end of the result or after a failed page
+                    if future in done:
+                        raw_rest_reply, exception_msg = future.result()
+                    else:
+                        raw_rest_reply, exception_msg = None, deadline_msg
+                    pages[index].append((raw_rest_reply, exception_msg, timing))
+
+                    if raw_rest_reply is None or reply_rows(raw_rest_reply) < page_size:
+                        finished.add(index)
+
+                active = [index for index in active if index not in finished and len(pages[index]) < self.max_pages]
+                if not_done:
+                    break  # Deadline exceeded
+
+        finally:
+            # Do not wait for late pages: requests still queued are cancelled, running ones are abandoned
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return pages
+
+    # End of function fetch_pages()
+
+    def fetch_all(self, tsm_servers, tsm_user, tsm_pass, tsm_command, max_workers=1, deadline=None, timings=None):
+        # Execute the REST call on every TSM server, up to 'max_workers' servers at the same time
+        # Returns a list of tuples (raw_rest_reply, exception_msg), in the same order as tsm_servers
+        # A TSM server that did not reply before 'deadline' (seconds) gets an error message
+        # timings: optional list of timing dicts (metrics.new_timing()), one per TSM server, filled by fetch()
+        return self.fetch_matrix(tsm_servers, tsm_user, tsm_pass, [tsm_command], max_workers, deadline,
+                                 None if timings is None else [timings])[0]
+
+    # End of function fetch_all()
+
+    def fetch_matrix(self, tsm_servers, tsm_user, tsm_pass, tsm_commands, max_workers=1, deadline=None, timings=None):
+        # fetch_all() for several commands: every command on every TSM server, in one pool of 'max_workers' threads
+        # on the shared OC connections. Returns a list per command of tuples (raw_rest_reply, exception_msg),
+        # in the same order as tsm_commands and tsm_servers. timings: optional list per command of timing lists
+        # Calls are sent command by command, so the load is spread over the TSM servers
+        deadline_msg = f"ERROR: Deadline exceeded: no reply within {deadline} secs"
+        responses = [[(None, deadline_msg)] * len(tsm_servers) for tsm_command in tsm_commands]
+        call_count = len(tsm_servers) * len(tsm_commands)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, call_count)))
+        futures = {}
+        for command_index, tsm_command in enumerate(tsm_commands):
+            # Only commands without side effects are sent again after a temporary error
+            retries = self.command_retries if read_only(tsm_command) else 0
+
+            for server_index, tsm_server in enumerate(tsm_servers):
+                timing = timings[command_index][server_index] if timings is not None else None
+                future = executor.submit(self.fetch, tsm_server, tsm_user, tsm_pass, tsm_command, timing, retries)
+                futures[future] = (command_index, server_index)
+
+        done, not_done = wait(futures, timeout=deadline)
+
+        # Do not wait for late TSM servers: requests still queued are cancelled, running ones are abandoned
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        for future in done:
+            command_index, server_index = futures[future]
+            responses[command_index][server_index] = future.result()
+
+        return responses
+
+    # End of function fetch_matrix()
+
+    @staticmethod
+    def prepare_request(tsm_server, tsm_user, tsm_pass):
+        # Prepare HTTP request: returns tuple (url_path, request_header)
+
+        # Credential string for HTTP header + Re-encode to ensure all chars are safe for transport
+        cred_str = tsm_user + ":" + tsm_pass
+        cred_encoded = base64.b64encode(cred_str.encode()).decode()
+
+        request_header = {
+            "OC-API-Version": "1.0",
+            "Authorization": "Basic " + cred_encoded,
+            "Accept": "application/json",
+            "Content-type": "text/plain"
+        }
+
+        # URL path on the OC web server
+        url_path = '/oc/api/cli/issueConfirmedCommand/' + tsm_server
+
+        return url_path, request_header
+
+    def fetch(self, tsm_server, tsm_user, tsm_pass, tsm_command, timing=None, retries=0):
+        # Execute the REST call on one TSM server and decode the JSON reply
+        # Returns a tuple (raw_rest_reply, exception_msg). raw_rest_reply is None if the call failed
+        # Runs in a worker thread: do not touch self.parsed_result or self.raw_result here
+        # timing: optional dict (metrics.new_timing()) that gets the phases of the call
+        # retries: number of retries for errors that can be temporary (see retryable_error())
+        if timing is not None:
+            timing['start'] = time.perf_counter()  # Not queued time in fetch_all()
+
+        for attempt in range(retries + 1):
+            try:
+                http_response, source = self.fetch_response(tsm_server, tsm_user, tsm_pass, tsm_command, timing)
+                start = time.perf_counter()
+                raw_rest_reply = json.loads(http_response)
+                add_phase(timing, 'decode', time.perf_counter() - start)
+                if timing is not None:
+                    timing['end'] = time.perf_counter()
+
+                # Save valid responses in the cache (see self.cache)
+                if self.cache is not None and source == 'rest':
+                    self.cache.put(self.oc_key, tsm_server, self.user_key(tsm_user, tsm_pass), tsm_command,
+                                   http_response)
+
+                return raw_rest_reply, ''
+
+            except Exception as e:
+                if attempt < retries and self.retryable_error(e):
+                    if timing is not None:
+                        timing['retries'] += 1
+                    # Jittered exponential backoff: retries of several threads do not hit the OC at the same time
+                    time.sleep(random.uniform(0, min(self.retry_max_delay, self.retry_backoff * 2 ** attempt)))
+                    continue
+
+                if timing is not None:
+                    timing['end'] = time.perf_counter()
+                return None, self.exception_message(e, tsm_user)
+
+    # End of function fetch()
+
+    def retryable_error(self, e):
+        # Errors that a retry can fix: connection refused/reset (e.g. OC restarting), HTTP 502/503/504
+        # HTTP 500 is a syntax or privilege error (see exception_message()), a retry gives the same error
+        # A timeout is retried only with retry_timeouts: the retry would wait request_timeout again
+        if isinstance(e, urllib.error.HTTPError):
+            return e.code in (502, 503, 504)
+        if isinstance(e, urllib.error.URLError) and isinstance(e.reason, BaseException):
+            e = e.reason
+        if isinstance(e, socket.timeout):
+            return self.retry_timeouts
+        return isinstance(e, (ConnectionError, http.client.HTTPException))
+
+    @staticmethod
+    def server_failure(e):
+        # Errors that count for the circuit breaker (see self.health): timeout, connection error, HTTP 502/503/504
+        if isinstance(e, urllib.error.HTTPError):
+            return e.code in (502, 503, 504)
+        return isinstance(e, (urllib.error.URLError, OSError, http.client.HTTPException))
+
+    def fetch_response(self, tsm_server, tsm_user, tsm_pass, tsm_command, timing=None):
+        # REST response (bytes) of one command on one TSM server. Returns tuple (http_response, source)
+        # source 'cache': from self.cache
+        # source 'shared': the same command was already in flight (other thread), we got its response
+        # source 'rest': new REST call
+        user_key = self.user_key(tsm_user, tsm_pass)
+        source = 'rest'
+
+        if self.cache is not None:
+            http_response = self.cache.get(self.oc_key, tsm_server, user_key, tsm_command)
+            if http_response is not None:
+                source = 'cache'
+
+        if source == 'cache':
+            pass
+
+        elif not self.coalesce_requests:
+            http_response = self.post_command(tsm_server, tsm_user, tsm_pass, tsm_command, timing)
+
+        else:
+            # Identical requests in flight share one REST call. Every caller decodes its own copy of the response
+            key = (tsm_server.upper(), user_key, normalize_command(tsm_command))
+            start = time.perf_counter()
+            http_response, shared = self.single_flight.do(key, self.post_command,
+                                                          tsm_server, tsm_user, tsm_pass, tsm_command, timing)
+            if shared:
+                source = 'shared'
+                add_phase(timing, 'wait', time.perf_counter() - start)  # Waited for the other caller's call
+
+        if timing is not None:
+            timing['source'] = source
+        return http_response, source
+
+    # End of function fetch_response()
+
+    def post_command(self, tsm_server, tsm_user, tsm_pass, tsm_command, timing=None):
+        # Send the REST call on a pooled keep-alive connection (no new TLS handshake if a connection is idle)
+        url_path, request_header = self.prepare_request(tsm_server, tsm_user, tsm_pass)
+        if self.health is None:
+            self.throttle(timing)
+            return self.pool.post(url_path, tsm_command.encode(), request_header, self.request_timeout, timing)
+
+        # Fast fail for a TSM server with an open circuit, timeout from the durations of earlier calls
+        self.health.check(tsm_server)
+        self.throttle(timing)
+        timeout = self.health.timeout(tsm_server, tsm_command, self.request_timeout)
+        if timing is None:
+            timing = new_timing()  # For the 'queue' phase
+        queued = timing['phases'].get('queue', 0.0)
+        start = time.perf_counter()
+        try:
+            http_response = self.pool.post(url_path, tsm_command.encode(), request_header, timeout, timing)
+        except Exception as e:
+            raise self.record_failure(tsm_server, tsm_command, e, timeout)
+
+        # Duration of the call without the wait for a free connection (max_connections): not server latency
+        duration = time.perf_counter() - start - (timing['phases'].get('queue', 0.0) - queued)
+        self.health.success(tsm_server, tsm_command, duration)
+        return http_response
+
+    # End of function post_command()
+
+    def record_failure(self, tsm_server, tsm_command, e, timeout):
+        # Health of a failed REST call (see self.health). Returns the exception to raise
+        if self.server_failure(e):
+            self.health.failure(tsm_server, tsm_command)
+        else:
+            self.health.success(tsm_server)  # HTTP 500, 401, ...: the OC and the TSM server answered
+        if isinstance(e, socket.timeout) and timeout < self.request_timeout:
+            adaptive_timeout = socket.timeout(f"adaptive timeout {timeout:.1f} secs")
+            adaptive_timeout.__cause__ = e
+            return adaptive_timeout
+        return e
+
+    def throttle(self, timing=None):
+        # Wait for a token of every rate limit (self.rate_limits), the waiting time is the 'throttle' phase
+        if self.rate_limits:
+            add_phase(timing, 'throttle', sum(bucket.acquire() for bucket in self.rate_limits))
+
+    @staticmethod
+    def user_key(tsm_user, tsm_pass):
+        # Identifies the credentials in cache and request keys, without keeping the password
+        # Results are never shared between different users, or the same user with another password
+        cred_hash = hashlib.sha256((tsm_user + ":" + tsm_pass).encode()).hexdigest()[:16]
+        return tsm_user.upper() + ":" + cred_hash
+
+    def exception_message(self, e, tsm_user):
+        # Translate an exception raised by a REST call into an error message for the report
+
+        # HTTP exceptions
+        if isinstance(e, urllib.error.HTTPError):
+            if e.code == 404:
+                exception_msg = (
+                    f"ERROR: Page not found! HTML RC {e.code}\n"
+                    f"       Validate that the REST API is enabled and accessible\n"
+                    f"       Check the settings menu in the OC at {self.base_url} with user '{tsm_user}\n"
+                )
+            elif e.code == 403:
+                exception_msg = f"ERROR: Access denied! HTML RC {e.code}"
+            elif e.code == 401:
+                exception_msg = (
+                    f"ERROR: API Access refused! : {e.reason} HTML RC {e.code}\n"
+                    f"       Try to access the operations center at {self.base_url} with user '{tsm_user}'\n"
+                    f"       Validate that the REST API is enabled in the operations center settings menu\n"
+                )
+            elif e.code == 500:
+                # Catches incorrect syntax AND permissions. Cannot differentiate
+                # It also catches a TSM server name that is not managed/configured on TSM OC
+                # Hopefully IBM fixes this in future, or maybe I'm blind.
+                exception_msg = "ERROR: Problem with syntax of TSM command or TSM account privileges"
+            else:
+                exception_msg = f"ERROR: Incorrect request. Response: {e.code} : {e.reason}"
+
+        # Connectivity exceptions (URLError is superclass of HTTPError that why it comes after HTTPError)
+        elif isinstance(e, urllib.error.URLError):
+            if isinstance(e.reason, socket.timeout):
+                exception_msg = f"ERROR: Timeout. Is {self.oc_address} reachable?"
+            elif isinstance(e.reason, ConnectionRefusedError):
+                exception_msg = f"ERROR: Connection refused. Is {self.oc_address} port {self.oc_port} reachable?"
+            else:
+                exception_msg = f"ERROR: Request error: {e.reason}"
+                # debug: print(repr(e.args[0]))
+
+        elif isinstance(e, socket.timeout):
+            limit = e.args[0] if e.args and str(e.args[0]).startswith('adaptive') else f"{self.request_timeout} secs"
+            exception_msg = f"ERROR: Timeout exceeded: {limit}. Is {self.oc_address} reachable?"
+
+        # TSM server skipped by the circuit breaker (see server_health.py)
+        elif isinstance(e, CircuitOpenError):
+            exception_msg = f"ERROR: {e}"
+
+        # REST response is not valid JSON
+        elif isinstance(e, ValueError):
+            exception_msg = f"ERROR: {e.args[0]}"
+
+        # All other exceptions
+        else:
+            exception_msg = f"ERROR: Unhandled exception - Contact the developer. Text: {e} Error Type: {type(e)}"
+
+        return exception_msg
+
+    # End of function exception_message()
 
     @staticmethod
     def fix_value(dict_value):
@@ -230,8 +754,11 @@ class TsmRest:
 
     # End of function fix_value
 
-    def parse_raw_data(self, raw_data, tsm_server, tsm_command):
+    def parse_raw_data(self, raw_data, tsm_server, tsm_command, parsed_result=None):
         # Interpret and parse the raw REST response, save result to self.parsed_data
+        # or to parsed_result if given (see query())
+        if parsed_result is None:
+            parsed_result = self.parsed_result
 
         data_structure_valid = False
 
@@ -268,32 +795,19 @@ class TsmRest:
         # If key 'items' is in REST response, then we have real data (rows/columns) in the result
         # Meaning you probably executed a TSM 'query' or 'select' command
         if 'items' in raw_data[0][0]:
-            # If 'hdr'[0] is a dict then it contains colID and colName, and actual data contains colID, not colName
-            if not isinstance(raw_data[0][0]['hdr'][0], (dict, list)):
-                for item in raw_data[0][0]['items']:
-                    for header in raw_data[0][0]['hdr']:
-                        item[header] = self.fix_value(item[header])
-
-                clean_data = {'hdr': raw_data[0][0]['hdr'], 'items': raw_data[0][0]['items']}
-
-            # 'hdr'[0] is not a dict then 'hdr' is just an ordered list with the colNames (select query)
+            hdr = raw_data[0][0]['hdr']
+            items = raw_data[0][0]['items']
+            clean_hdr = self.parse_hdr(hdr)
+
+            # Compact result: rows are tuples in the order of clean_hdr
+            if self.compact_result:
+                parse_row = self.row_parser(hdr, items[:self.decoder_sample_rows], as_tuple=True)
+                clean_data = {'hdr': clean_hdr,
+                              'items': CompactItems(clean_hdr, [parse_row(item, tsm_server) for item in items])}
             else:
-                for item in raw_data[0][0]['items']:
-                    for header in raw_data[0][0]['hdr']:
-                        item[header['id']] = self.fix_value(item[header['id']])
-
-                        # Change column ID to column title
-                        item[header['def']] = item.pop(header['id'], "Not Valid")
-
-                clean_data = {'hdr': list(item['def'] for item in raw_data[0][0]['hdr']),
-                              'items': raw_data[0][0]['items']}
-
-            # Add "TSM server" col name to header list (useful for multi-TSM server reports)
-            clean_data['hdr'].insert(0, "TSM SERVER")
-
-            # Add "TSM server":"value" to each dictionary in 'items' list (useful for multi-TSM server reports)
-            for item in clean_data['items']:
-                item.update({"TSM SERVER": tsm_server})
+                parse_row = self.row_parser(hdr, items[:self.decoder_sample_rows])
+                clean_data = {'hdr': clean_hdr,
+                              'items': [parse_row(item, tsm_server) for item in items]}
 
         # If there is a TSM info/warning/error message in the REST response, then we save it
         if 'msg' in raw_data[0][0]:
@@ -314,51 +828,383 @@ class TsmRest:
 
         # Data (clean_data) is now ready, got its final structure
 
-        # Move 'items' from clean_data into instance variable parsed_result
+        # Move 'items' from clean_data into parsed_result
         # This is to support command execution on multiple TSM servers
         if 'items' in clean_data:
-            for data_dict in clean_data['items']:
-                if 'items' in self.parsed_result:
-                    self.parsed_result['items'].append(data_dict)
-                else:
-                    self.parsed_result['items'] = [data_dict]
-            if 'hdr' not in self.parsed_result:
-                self.parsed_result['hdr'] = clean_data['hdr']
+            self.result_items(parsed_result).extend(clean_data['items'])
+            if 'hdr' not in parsed_result:
+                parsed_result['hdr'] = clean_data['hdr']
 
-        # Move 'msg' from clean_Data into instance variable parsed_result
+        # Move 'msg' from clean_Data into parsed_result
         if 'msg' in clean_data:
-            if 'msg' not in self.parsed_result:
-                self.parsed_result['msg'] = []
+            if 'msg' not in parsed_result:
+                parsed_result['msg'] = []
 
             for m in clean_data['msg']:
-                self.parsed_result['msg'].append(m)
+                parsed_result['msg'].append(m)
 
             # If the result of the command is 'no match found' then we create an empty key/value in 'items'
             # To leave a trace behind that we did query the TSM server.
             if 'items' not in clean_data:
-                for msg in clean_data['msg']:
-                    if msg['n'] == '2034':  # 'No Match Found'
-                        empty_record = {'TSM SERVER': tsm_server + ' - NO MATCH FOUND'}
-                        if 'items' in self.parsed_result:
-                            self.parsed_result['items'].append(empty_record)
-                        else:
-                            self.parsed_result['items'] = [empty_record]
-                    else:
-                        error_record = {'TSM SERVER': tsm_server + ' - ' + msg['def']}
-                        if 'items' in self.parsed_result:
-                            self.parsed_result['items'].append(error_record)
-                        else:
-                            self.parsed_result['items'] = [error_record]
+                for record in self.msg_records(clean_data['msg'], tsm_server):
+                    self.result_items(parsed_result).append(record)
 
     # End of function
 
-    # Export self.parsed_result to xlsx, csv, html
-    def create_report(self, report_type, file_name=None, sheet_name='Report', sheet_tab_color='FFFFFF'):
+    def result_items(self, parsed_result=None):
+        # Returns parsed_result['items'] (default self.parsed_result), created empty if needed:
+        # a list of dicts, or CompactItems
+        if parsed_result is None:
+            parsed_result = self.parsed_result
+        if 'items' not in parsed_result:
+            parsed_result['items'] = CompactItems() if self.compact_result else []
+        return parsed_result['items']
+
+    @staticmethod
+    def parse_hdr(hdr):
+        # Column titles of a REST response, with "TSM SERVER" as first column (useful for multi-TSM server reports)
+
+        # If 'hdr'[0] is a dict then it contains colID and colName, and actual data contains colID, not colName
+        if isinstance(hdr[0], (dict, list)):
+            col_names = list(header['def'] for header in hdr)
+
+        # 'hdr'[0] is not a dict then 'hdr' is just an ordered list with the colNames (select query)
+        else:
+            col_names = list(hdr)
+
+        return ["TSM SERVER"] + col_names
+
+    def row_parser(self, hdr, sample_items, as_tuple=False):
+        # Returns a function parse_row(item, tsm_server) that converts one dict of 'items' into a clean dict:
+        # clean values, column titles as keys and "TSM SERVER":"value" (useful for multi-TSM server reports)
+        # as_tuple=True: the row is a tuple (tsm_server, value, ...) in the order of parse_hdr()
+        # The value shape of a column is detected in sample_items (first rows) and cached per column ID
+        # (or column name for select queries). The row parser is compiled once per set of columns.
+
+        # If 'hdr'[0] is a dict then it contains colID and colName, and actual data contains colID, not colName
+        plain_hdr = not isinstance(hdr[0], (dict, list))
+
+        columns = []
+        for header in hdr:
+            if plain_hdr:
+                key = col_name = header
+            else:
+                key, col_name = header['id'], header['def']
+
+            shape = self.column_shapes.get(key)
+            if shape is None:
+                shape = infer_shape(item[key] for item in sample_items if key in item)
+                if shape is None:
+                    shape = 'scalar'  # No sample value: this parser only, the next reply detects the shape
+                else:
+                    self.column_shapes[key] = shape
+
+            columns.append((key, col_name, shape))
+
+        columns = tuple(columns)
+        parse_row = self.row_parsers.get((columns, as_tuple))
+        if parse_row is None:
+            parse_row = compile_row_parser(columns, self.fix_value, as_tuple)
+            self.row_parsers[(columns, as_tuple)] = parse_row
+
+        return parse_row
+
+    # End of function row_parser()
+
+    @staticmethod
+    def msg_records(msgs, tsm_server):
+        # If the result of the command is 'no match found' (or an error) then we create a record for 'items'
+        # To leave a trace behind that we did query the TSM server.
+        records = []
+        for msg in msgs:
+            if msg['n'] == '2034':  # 'No Match Found'
+                records.append({'TSM SERVER': tsm_server + ' - NO MATCH FOUND'})
+            else:
+                records.append({'TSM SERVER': tsm_server + ' - ' + msg['def']})
+        return records
+
+    def stream_command(self, tsm_servers, tsm_user, tsm_pass, tsm_command):
+        # Generator version of run_command() for large results (select * from contents, actlog, ...)
+        # The rows are parsed and yielded one by one while the REST response is being received.
+        # Error/'no match found' records are yielded as rows too, like in run_command().
+        # Nothing is kept in self.raw_result. The RowStream (see result_set.py) returned is an iterator of the rows
+        # with its own parsed_result: 'hdr', 'msg', 'cmd', 'tsm_srv' but no 'items'. self.parsed_result is the same
+        # dict until the next command replaces it, the stream keeps writing to its own dict
+        self.parsed_result = {}
+        self.raw_result = []
+
+        # Convert tsm_servers to list if only 1 TSM server is given as a string
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+        self.tsm_servers = tsm_servers
+
+        parsed_result = self.parsed_result
+        parsed_result['cmd'] = tsm_command
+        parsed_result['tsm_srv'] = tsm_servers
+
+        return RowStream(self.stream_rows(tsm_servers, tsm_user, tsm_pass, tsm_command, parsed_result),
+                         parsed_result)
+
+    # End of function stream_command()
+
+    def stream_rows(self, tsm_servers, tsm_user, tsm_pass, tsm_command, parsed_result):
+        # Rows of stream_command(), TSM server after TSM server
+        print(f"\nStreaming your command on {len(tsm_servers)} TSM server(s)...")
+        for tsm_server in tsm_servers:
+            correct_execution = False
+            exception_msg = ''
+            timing = new_timing()
+            timing['source'] = 'stream'
+            row_count = 0
 
-        # Validate report type parameter
-        valid_report_type = {'XLSX', 'HTML', 'CSV'}
-        if report_type not in valid_report_type or not isinstance(report_type, str):
-            print(f"create_report(): Unknown Report type. Your options: {valid_report_type}")
+            try:
+                for row in self.stream_server(tsm_server, tsm_user, tsm_pass, tsm_command, timing, parsed_result):
+                    row_count += 1
+                    yield row
+                correct_execution = True
+
+            except Exception as e:
+                exception_msg = self.exception_message(e, tsm_user)
+
+            # Timings of this TSM server. 'total' includes the time the caller spent on the rows
+            if correct_execution:
+                self.metrics.record(tsm_server, tsm_command, timing, 'ok', '', row_count)
+                print(f" -> {tsm_server} : OK")
+            else:
+                self.metrics.record(tsm_server, tsm_command, timing, 'error', exception_msg, row_count)
+                print(f" -> {tsm_server} : {exception_msg}")
+                yield {'TSM SERVER': tsm_server + ' - ' + exception_msg}
+
+        # 'No Match Found' across all TSM servers
+        if 'hdr' not in parsed_result:
+            parsed_result['hdr'] = ['TSM SERVER']
+
+    # End of function stream_rows()
+
+    def stream_server(self, tsm_server, tsm_user, tsm_pass, tsm_command, timing=None, parsed_result=None):
+        # Execute the REST call on one TSM server and yield the parsed rows while the response is received
+        # Same validation and parsing as parse_raw_data(), one row at a time
+        # timing: optional dict (metrics.new_timing()), gets the connect, tls, wait and read phases
+        # parsed_result: dict of the stream (RowStream.parsed_result) that gets 'hdr' and 'msg'. Never
+        # self.parsed_result: another command can run while the rows are being read
+        if parsed_result is None:
+            parsed_result = {}
+        url_path, request_header = self.prepare_request(tsm_server, tsm_user, tsm_pass)
+        timeout = self.request_timeout
+        if self.health is not None:
+            self.health.check(tsm_server)  # Fast fail, raises CircuitOpenError
+            timeout = self.health.timeout(tsm_server, tsm_command, self.request_timeout)
+        self.throttle(timing)
+
+        def read(size):
+            # response.read() with timing and byte count
+            start = time.perf_counter()
+            chunk = response.read(size)
+            add_phase(timing, 'read', time.perf_counter() - start)
+            timing['bytes_received'] += len(chunk)
+            return chunk
+
+        # The health of the TSM server is recorded also when the consumer stops early: a probe call (half-open
+        # circuit) must always end with success() or failure()
+        health_recorded = self.health is None
+        try:
+            with self.pool.open(url_path, tsm_command.encode(), request_header, timeout, timing) as response:
+                hdr = None
+                parse_row = None
+                object_index = None
+                first_object_keys = set()
+                msgs = []
+                # First rows, kept until the value shapes are detected on decoder_sample_rows rows (as in
+                # parse_raw_data()). Also rows received before 'hdr': not expected, IBM sends 'hdr' first
+                early_items = []
+
+                for event in RestReplyStream(read if timing is not None else response.read).events():
+                    if event[0] == 'item':
+                        if object_index != 0:
+                            continue  # parse_raw_data() only reads 'items' from the first dict
+                        if parse_row is not None:
+                            yield parse_row(event[1], tsm_server)
+                            continue
+                        early_items.append(event[1])
+                        if hdr is not None and len(early_items) >= self.decoder_sample_rows:
+                            parse_row = self.row_parser(hdr, early_items[:self.decoder_sample_rows])
+                            for item in early_items:
+                                yield parse_row(item, tsm_server)
+                            early_items = []
+
+                    elif event[0] == 'object':
+                        object_index = event[1]
+
+                    else:  # 'items' or 'field'
+                        if object_index == 0:
+                            first_object_keys.add(event[1])
+
+                        if event[0] == 'field' and event[1] == 'hdr' and object_index == 0:
+                            hdr = event[2]
+                            if 'hdr' not in parsed_result:
+                                parsed_result['hdr'] = self.parse_hdr(hdr)
+
+                        elif event[0] == 'field' and event[1] == 'msg' and object_index <= 1:
+                            msg = event[2]
+                            msg.update({"srv": tsm_server})
+                            msg.update({"cmd": tsm_command})
+                            msgs.append(msg)
+
+                # Fewer rows than decoder_sample_rows
+                if early_items and hdr is not None:
+                    parse_row = self.row_parser(hdr, early_items[:self.decoder_sample_rows])
+                    for item in early_items:
+                        yield parse_row(item, tsm_server)
+
+        except Exception as e:
+            if health_recorded:
+                raise
+            health_recorded = True
+            raise self.record_failure(tsm_server, tsm_command, e, timeout)
+
+        finally:
+            if not health_recorded:
+                self.health.success(tsm_server)
+
+        # Same validation as parse_raw_data(): the first dict has 'msg' only, or 'hdr' and 'items'
+        has_items = 'items' in first_object_keys
+        if object_index is not None:
+            if first_object_keys != {'msg'} and not (has_items and 'hdr' in first_object_keys):
+                raise ValueError("Unsupported Data structure: Not able to validate structure")
+
+        # If you perform a SQL select query that returns 0 rows on SP 8.1.8 and older, the REST API
+        # sends an 'empty list inside a list [[]]'. Same behavior as the 'fix' in parse_raw_data()
+        else:
+            msgs.append({'n': '2034', 'srv': tsm_server, 'cmd': tsm_command})
+
+        if msgs:
+            if 'msg' not in parsed_result:
+                parsed_result['msg'] = []
+            parsed_result['msg'].extend(msgs)
+
+            if not has_items:
+                yield from self.msg_records(msgs, tsm_server)
+
+    # End of function stream_server()
+
+    def poll(self, tsm_servers, tsm_user, tsm_pass, tsm_command, hwm_column, marks, name=None, lookback=0,
+             hwm_field=None):
+        # Incremental query for monitoring (actlog, summary, ...): yields only the rows that are new since the
+        # previous poll, the cost of a poll depends on the number of new rows, not on the history.
+        # Per TSM server the highest value of hwm_column (e.g. date_time) is the high-water mark, saved in 'marks'
+        # (HighWaterMarks, or the name of its JSON file). The SELECT is rewritten to "... WHERE hwm_column >= mark".
+        # Rows at the mark were yielded already, they are skipped (fingerprint of the values, see incremental.py)
+        # lookback: seconds (or units of a numeric column) before the mark that are queried again, for rows that
+        #           are written late. Also covers a clock/timezone difference between this host and the TSM server
+        # hwm_field: title of the column in the rows (default: hwm_column in capitals, like in a SELECT result)
+        # name: identifies the poll in 'marks' (default: the command)
+        # The marks of a TSM server are saved after its rows were consumed: an interrupted poll is repeated
+        # Returns a generator of the new rows. A command that is not a SELECT raises ValueError (at the call)
+        if not is_select(tsm_command):
+            raise ValueError(f"poll(): only SELECT commands can be polled (a WHERE condition is added), "
+                             f"not: {tsm_command}")
+        if isinstance(marks, str):
+            marks = HighWaterMarks(marks)
+        if hwm_field is None:
+            hwm_field = hwm_column.upper()
+        if name is None:
+            name = normalize_command(tsm_command)
+
+        return self.poll_rows(tsm_servers, tsm_user, tsm_pass, tsm_command, hwm_column, marks, name, lookback,
+                              hwm_field)
+
+    # End of function poll()
+
+    def poll_rows(self, tsm_servers, tsm_user, tsm_pass, tsm_command, hwm_column, marks, name, lookback, hwm_field):
+        # Rows of poll(), TSM server after TSM server
+        self.parsed_result = {}
+        self.raw_result = []
+
+        # Convert tsm_servers to list if only 1 TSM server is given as a string
+        if isinstance(tsm_servers, str):
+            tsm_servers = [tsm_servers]
+        self.tsm_servers = tsm_servers
+
+        self.parsed_result['cmd'] = tsm_command
+        self.parsed_result['tsm_srv'] = tsm_servers
+
+        # SELECT per TSM server, from its mark on
+        keys = [self.oc_key + '|' + tsm_server.upper() + '|' + name for tsm_server in tsm_servers]
+        commands = []
+        for key in keys:
+            mark = marks.get(key)
+            if mark is None:
+                commands.append(tsm_command)
+            else:
+                commands.append(add_lower_bound(tsm_command, hwm_column, window_start(mark['hwm'], lookback)))
+
+        print(f"\nPolling {len(tsm_servers)} TSM server(s)...")
+        timings = [new_timing() for tsm_server in tsm_servers]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(tsm_servers)))) as executor:
+            responses = list(executor.map(lambda args: self.fetch(*args),
+                                          [(tsm_server, tsm_user, tsm_pass, command, timing)
+                                           for tsm_server, command, timing in zip(tsm_servers, commands, timings)]))
+
+        for tsm_server, key, command, (raw_rest_reply, exception_msg), timing in zip(tsm_servers, keys, commands,
+                                                                                      responses, timings):
+            server_result = {}
+            try:
+                if raw_rest_reply is not None:
+                    start = time.perf_counter()
+                    self.parse_raw_data(raw_rest_reply, tsm_server, command, server_result)
+                    add_phase(timing, 'parse', time.perf_counter() - start)
+
+            # If data structure is not as expected we raise ValueError in parse_raw_data()
+            except ValueError as e:
+                raw_rest_reply, exception_msg = None, f"ERROR: {e.args[0]}"
+
+            if raw_rest_reply is None:
+                # The mark is not moved: the next poll asks the same rows again
+                self.metrics.record(tsm_server, command, timing, 'error', exception_msg)
+                print(f" -> {tsm_server} : {exception_msg}")
+                yield {'TSM SERVER': tsm_server + ' - ' + exception_msg}
+                continue
+
+            if len(server_result.get('hdr', ())) > 1 and 'hdr' not in self.parsed_result:
+                self.parsed_result['hdr'] = server_result['hdr']
+            if 'msg' in server_result:
+                self.parsed_result.setdefault('msg', []).extend(server_result['msg'])
+
+            # Data rows only: 'no match found' records ({'TSM SERVER': ..}) are not new rows
+            rows = [row for row in server_result.get('items', ()) if len(row) > 1]
+            mark, new_rows = advance_mark(marks.get(key), rows, hwm_field, lookback)
+
+            self.metrics.record(tsm_server, command, timing, 'ok', '', len(new_rows))
+            print(f" -> {tsm_server} : {len(new_rows)} new row(s)")
+            yield from new_rows
+
+            if mark is not None:
+                marks.set(key, mark)
+                marks.save()
+            elif rows:
+                # hwm_field missing (typo) or without a timestamp/number: every poll would return every row again
+                print(f"poll(): WARNING: {tsm_server}: no high-water mark in column '{hwm_field}' "
+                      f"(columns: {', '.join(rows[0])}). The next poll returns all rows again")
+
+        # No data rows on any TSM server
+        if 'hdr' not in self.parsed_result:
+            self.parsed_result['hdr'] = ['TSM SERVER']
+
+    # End of function poll_rows()
+
+    # Export self.parsed_result to xlsx, csv, html, or a SQLite database
+    def create_report(self, report_type, file_name=None, sheet_name='Report', sheet_tab_color='FFFFFF',
+                      streaming=False, compress=False, rows=None, table=None, col_names=None):
+        # streaming=True (XLSX only): write-only workbook, rows are written to disk one by one
+        # compress=True (CSV, HTML, JSON): gzip compressed file
+        # rows: iterable of row dicts to export instead of self.parsed_result['items'], e.g. stream_command()
+        # col_names: column names of 'rows' (default: hdr of stream_command(), else the keys of the first data row)
+        # SQLITE: file_name is the database, the rows are added as a new snapshot to 'table'
+        #         (default: the name of the command, e.g. query_occupancy). See sqlite_store.py
+
+        # Validate report type parameter (XLSX, CSV, HTML, JSON, SQLITE and registered backends)
+        if not isinstance(report_type, str) or report_type not in EXPORT_BACKENDS:
+            print(f"create_report(): Unknown Report type. Your options: {set(EXPORT_BACKENDS)}")
             exit(1)
 
         # Validate target directory to store report exists
@@ -372,128 +1218,49 @@ class TsmRest:
             exit(1)
 
         # Validate we have data to print
-        if 'items' not in self.parsed_result:
+        if rows is None and 'items' not in self.parsed_result:
             print("No data to print, this is not normal. All exceptions should be handled. Check the 'msg' key")
             # debug: pprint(self.parsed_result)
             exit(1)
 
         # Function call is ok: Arguments validated
+        export_start = time.perf_counter()
 
-        col_names = self.parsed_result['hdr']
-        clean_data = self.parsed_result['items']
-
-        if report_type == "XLSX":
+        if rows is None:
+            result = self.parsed_result
+            col_names = result['hdr']
+            clean_data = result['items']
 
-            # Initialize wb as empty workbook
-            wb = Workbook()
-
-            # If the Excel file already exists then load it. We'll place our data in a new sheet
-            if os.path.exists(file_name):
-                try:
-                    wb = load_workbook(file_name)
-                except Exception:  # At this point we already checked if path exists
-                    print(f"ERROR: Could not access the target file {file_name}")
-                    exit(1)
-            else:
-                # Excel file does not exist yet (wb already created in first step)
-
-                # Since this is a new file we can remove the 'default' sheet
-                remove_these_sheets = ['Sheet', 'Sheet1', 'Sheet 1']
-                for sheet in remove_these_sheets:
-                    if sheet in wb.sheetnames:
-                        del wb[sheet]
-
-            # Define styles
-            create_xls_styles(wb)
-
-            # Create a new Excel sheet, set name and tab color
-            ws = wb.create_sheet(title=sheet_name)
-            ws.sheet_properties.tabColor = sheet_tab_color
-
-            # Write headers to the first row of the sheet
-            ws.append(col_names)
-
-            # Style column titles
-            ws.row_dimensions[1].height = 20
-
-            for i in range(1, len(col_names)+1):
-                current_cell = str(chr(ord('A') + (i - 1)) + '1')
-                ws[current_cell].style = 'title_style'
-
-            # Write values to cells
-            row_index = 2
-            for item in clean_data:
-                col_index = 1
-                for col in col_names:
-                    if col in item:
-                        if item[col] is not None:
-                            ws.cell(row=row_index, column=col_index).value = item[col]
-                        else:
-                            # If the Value is None then we set a dash in the cell '-'
-                            ws.cell(row=row_index, column=col_index).value = '-'
-                            # debug: print(ws.cell(row=row_index, column=col_index).coordinate)
-                    else:
-                        # The column name is not present as a key in the current item from 'items'
-                        ws.cell(row=row_index, column=col_index).value = '-'
-                    col_index += 1
-                row_index += 1
-
-            # Enable Excel Column Filtering
-            ws.auto_filter.ref = ws.dimensions
-
-            # Auto Size columns (stackoverflow flunky hack) (not happy with it)
-            dims = {}
-            for row in ws.rows:
-                for cell in row:
-                    if cell.value:
-                        dims[cell.column_letter] = max((dims.get(cell.column_letter, 0), len(str(cell.value))))
-            for col, value in dims.items():
-                ws.column_dimensions[col].width = value + 6
-
-            # Save Excel file
-            try:
-                wb.save(file_name)
-            except Exception:
-                print(f"ERROR: Could not save report file {file_name}")
-                exit(1)
-
-        elif report_type == 'CSV':
-            # If target CSV report file exists then it gets overwritten
-            try:
-                with open(file_name, 'w') as output_file:
-                    dict_writer = csv.DictWriter(output_file, restval="-", fieldnames=col_names, delimiter=';')
-                    dict_writer.writeheader()
-                    dict_writer.writerows(clean_data)
-            except Exception:
-                print(f"ERROR: Could not create csv file {file_name}")
-                exit(1)
-
-        elif report_type == 'HTML':
-            # If target HTML report file exists then it gets overwritten
-            html = "<html>\n<head>\n\t<title>Test Report</title>\n</head>\n\n<body>\n<table>\n\n\t<tr>\n"
-            for col in col_names:
-                html += "\t\t<th>" + col + "</th>\n"
-            html += "\t</tr>\n"
-            for item in clean_data:
-                html += "\t<tr>\n"
-                for col in col_names:
-                    if col in item:
-                        html += "\t\t<td>" + str(item[col]) + "</td>\n"
-                    else:
-                        html += "\t\t<td>-</td>\n"
-                html += "\t</tr>\n"
-            html += "</table>\n</body>\n</html>"
+        else:
+            # Rows from an iterator. self.parsed_result is not used: it can be the result of an earlier command
+            # stream_command(): its RowStream.parsed_result gets 'hdr' before the first data row
+            # Other iterators: the keys of the first data row are the column names
+            # Error records ({'TSM SERVER': ..}) before the first data row are kept until then
+            result = getattr(rows, 'parsed_result', {})
+            rows = iter(rows)
+            first_rows = []
+            if col_names is None:
+                for row in rows:
+                    first_rows.append(row)
+                    if 'hdr' in result or len(row) > 1:
+                        break
+
+                if 'hdr' in result:
+                    col_names = result['hdr']
+                elif first_rows:
+                    col_names = list(first_rows[-1])
+                else:
+                    col_names = ['TSM SERVER']
+            clean_data = chain(first_rows, rows)
 
-            # Save the report
-            try:
-                f = open(file_name, 'w')
-                f.write(html)
-                f.close()
-            except Exception:
-                print(f"ERROR: Could not create html file {file_name}")
+        # Write the report with the backend of the report type
+        export = export_backend(report_type)
+        export(file_name, col_names, clean_data, sheet_name=sheet_name, sheet_tab_color=sheet_tab_color,
+               streaming=streaming, compress=compress, table=table, cmd=result.get('cmd', ''),
+               tsm_srv=result.get('tsm_srv', []))
 
-        else:
-            pass  # Unknown report type (exception already caught in beginning of function)
+        # Duration and file size of the export (see self.metrics). With 'rows', includes the REST calls
+        self.metrics.record_export(report_type, file_name, time.perf_counter() - export_start)
 
     # End of function create_report()
 
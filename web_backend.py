@@ -0,0 +1,401 @@
+import argparse
+import asyncio
+import base64
+import binascii
+import csv
+import datetime
+import io
+import json
+import os
+import urllib.parse
+from collections.abc import Mapping
+from http import HTTPStatus
+
+from async_client import AsyncTsmRest
+
+# Async HTTP backend for the web app: JSON API on top of AsyncTsmRest, one process for many dashboard users
+#
+# ASGI application: run it with an ASGI server (uvicorn --factory web_backend:create_app, the OC is read from the
+# environment variables TSMREST_OC_ADDRESS and TSMREST_OC_PORT), or without extra packages:
+#     python web_backend.py --oc tsmOC.company.com --oc-port 11090 --port 8080
+#
+# Every request has the TSM administrator and password as HTTP Basic authentication, they are passed to the OC
+#   POST /api/command    {"servers": ["TSM01", "TSM02"], "command": "q stgpool", "format": "json" | "csv",
+#                         "deadline": seconds (default default_deadline, max max_deadline)}
+#                        -> parsed_result, rows streamed in chunks (JSON, or CSV like create_report)
+#   POST /api/commands   {"servers": [...], "commands": {"Storage Pools": "q stgpool", ...}}  -> {name: parsed_result}
+#   GET  /api/health     requests in progress, connection pool, circuit breaker state per TSM server
+#   GET  /metrics        Prometheus text format (see metrics.py)
+#
+# Backpressure: max_inflight requests at the same time (more: HTTP 503 + Retry-After), max_per_user per TSM user
+# (more: HTTP 429). A response is sent in chunks of chunk_rows rows, the next chunk waits until the client has
+# read the previous one (slow clients do not fill the memory).
+
+
+def json_value(value):
+    # json.dumps() default: values of fix_value() and CompactItems rows
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, Mapping):
+        return dict(value)
+    if hasattr(value, '__iter__') and not isinstance(value, (str, bytes)):
+        return list(value)
+    return str(value)
+
+
+def basic_auth(scope):
+    # Tuple (user, password) of the Authorization header, None if missing or invalid
+    for name, value in scope['headers']:
+        if name == b'authorization' and value[:6].lower() == b'basic ':
+            try:
+                user, separator, password = base64.b64decode(value[6:].strip()).decode().partition(':')
+            except (binascii.Error, UnicodeDecodeError):
+                return None
+            return (user, password) if separator and user else None
+    return None
+
+
+class WebBackend:
+    # ASGI application (scope, receive, send)
+
+    max_inflight = 200        # Requests handled at the same time. More: HTTP 503
+    max_per_user = 4          # Requests of one TSM user at the same time. More: HTTP 429
+    chunk_rows = 500          # Rows per chunk of a streamed response
+    max_request_bytes = 65536
+    default_deadline = 60     # Max duration (seconds) of the REST calls of one request, if the request has none
+    max_deadline = 300        # Max 'deadline' a request can ask: longer values are cut to max_deadline
+
+    def __init__(self, client):
+        self.client = client
+        self.inflight = 0
+        self.per_user = {}  # TSM user -> requests in progress
+        self.stats = {'requests': 0, 'rejected_busy': 0, 'rejected_user': 0, 'bad_requests': 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        self.stats['requests'] += 1
+        method, path = scope['method'], scope['path']
+
+        if method == 'GET' and path == '/api/health':
+            return await self.send_json(send, 200, self.health())
+        if method == 'GET' and path == '/metrics':
+            return await self.send_body(send, 200, self.client.metrics.prometheus().encode(),
+                                        'text/plain; version=0.0.4')
+        if method != 'POST' or path not in ('/api/command', '/api/commands'):
+            return await self.send_json(send, 404, {'error': f"Not found: {method} {path}"})
+
+        credentials = basic_auth(scope)
+        if credentials is None:
+            return await self.send_json(send, 401, {'error': "TSM user and password needed (HTTP Basic)"},
+                                        [(b'www-authenticate', b'Basic realm="TSM"')])
+        user_key = credentials[0].upper()
+
+        # Backpressure: reject at once instead of queueing without limit
+        if self.inflight >= self.max_inflight:
+            self.stats['rejected_busy'] += 1
+            return await self.send_json(send, 503, {'error': "Server busy, try again"}, [(b'retry-after', b'1')])
+        if self.per_user.get(user_key, 0) >= self.max_per_user:
+            self.stats['rejected_user'] += 1
+            return await self.send_json(send, 429, {'error': f"Max {self.max_per_user} requests at the same time "
+                                                             f"per user"}, [(b'retry-after', b'1')])
+
+        self.inflight += 1
+        self.per_user[user_key] = self.per_user.get(user_key, 0) + 1
+        try:
+            await self.handle_command(scope, receive, send, path, credentials)
+        finally:
+            self.inflight -= 1
+            self.per_user[user_key] -= 1
+            if not self.per_user[user_key]:
+                del self.per_user[user_key]
+
+    # End of function __call__()
+
+    async def handle_command(self, scope, receive, send, path, credentials):
+        tsm_user, tsm_pass = credentials
+        body = await self.read_body(receive)
+        if body is None:
+            return await self.send_json(send, 413, {'error': f"Request larger than {self.max_request_bytes} bytes"})
+
+        # Validate the request
+        try:
+            request = json.loads(body)
+            tsm_servers = request['servers']
+            if isinstance(tsm_servers, str):
+                tsm_servers = [tsm_servers]
+            if not tsm_servers or not all(isinstance(tsm_server, str) for tsm_server in tsm_servers):
+                raise ValueError("'servers' must be a list of TSM server names")
+            deadline = float(request.get('deadline', self.default_deadline))
+            if not deadline > 0:
+                raise ValueError("'deadline' must be a number of seconds > 0")
+            deadline = min(deadline, self.max_deadline)
+            report_format = request.get('format', 'json')
+            if report_format not in ('json', 'csv'):
+                raise ValueError("'format' must be json or csv")
+
+            if path == '/api/command':
+                tsm_command = request['command']
+                if not isinstance(tsm_command, str) or not tsm_command.strip():
+                    raise ValueError("'command' must be a TSM command")
+            else:
+                tsm_commands = request['commands']
+                if not isinstance(tsm_commands, (list, dict)) or not tsm_commands:
+                    raise ValueError("'commands' must be a list of commands or a dict {name: command}")
+
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.stats['bad_requests'] += 1
+            return await self.send_json(send, 400, {'error': f"Invalid request: {e}"})
+
+        if path == '/api/command':
+            parsed_result, raw_result = await self.client.query(tsm_servers, tsm_user, tsm_pass, tsm_command, deadline)
+            if report_format == 'csv':
+                return await self.stream_csv(send, parsed_result)
+            return await self.stream_json(send, parsed_result)
+
+        results = await self.client.run_commands(tsm_servers, tsm_user, tsm_pass, tsm_commands, deadline)
+        return await self.send_json(send, 200, results)
+
+    # End of function handle_command()
+
+    async def read_body(self, receive):
+        # Request body (bytes), None if it is larger than max_request_bytes
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            size += len(chunks[-1])
+            if size > self.max_request_bytes:
+                return None
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    async def stream_json(self, send, parsed_result):
+        # {"cmd": .., "tsm_srv": .., "hdr": .., "msg": [..], "items": [..]}, the items in chunks
+        # msg: messages of the OC (no match found, errors), same as parsed_result['msg']
+        head = {key: parsed_result.get(key) for key in ('cmd', 'tsm_srv', 'hdr')}
+        head['msg'] = parsed_result.get('msg', [])
+        await self.start_response(send, 200, 'application/json')
+        await send({'type': 'http.response.body',
+                    'body': (json.dumps(head, default=json_value)[:-1] + ', "items": [').encode(),
+                    'more_body': True})
+
+        items = parsed_result.get('items', [])
+        for start in range(0, len(items), self.chunk_rows):
+            chunk = ',\n'.join(json.dumps(dict(row), default=json_value)
+                               for row in items[start:start + self.chunk_rows])
+            await send({'type': 'http.response.body', 'body': ((',\n' if start else '\n') + chunk).encode(),
+                        'more_body': True})
+            await asyncio.sleep(0)  # Let the other requests run between the chunks
+
+        await send({'type': 'http.response.body', 'body': b'\n]}\n', 'more_body': False})
+
+    async def stream_csv(self, send, parsed_result):
+        # CSV like create_report("CSV"): ';' as delimiter, missing values '-'. Columns that are not in 'hdr' are
+        # left out: the rows of several TSM servers can have different keys, an error after the response headers
+        # were sent would cut the response
+        col_names = parsed_result.get('hdr', ['TSM SERVER'])
+        await self.start_response(send, 200, 'text/csv; charset=utf-8')
+
+        buffer = io.StringIO()
+        dict_writer = csv.DictWriter(buffer, restval="-", extrasaction="ignore", fieldnames=col_names, delimiter=';')
+        dict_writer.writeheader()
+        items = parsed_result.get('items', [])
+        for start in range(0, len(items), self.chunk_rows):
+            dict_writer.writerows(items[start:start + self.chunk_rows])
+            await send({'type': 'http.response.body', 'body': buffer.getvalue().encode(), 'more_body': True})
+            buffer.seek(0)
+            buffer.truncate()
+            await asyncio.sleep(0)
+
+        await send({'type': 'http.response.body', 'body': buffer.getvalue().encode(), 'more_body': False})
+
+    def health(self):
+        health = self.client.health
+        return {'inflight': self.inflight, 'users': len(self.per_user), 'requests': self.stats,
+                'pool': self.client.pool_stats, 'coalesced': self.client.coalesce_stats,
+                'tsm_servers': health.status() if health is not None else {}}
+
+    @staticmethod
+    async def start_response(send, status, content_type, headers=()):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', content_type.encode())] + list(headers)})
+
+    async def send_body(self, send, status, body, content_type, headers=()):
+        headers = [(b'content-length', str(len(body)).encode())] + list(headers)
+        await self.start_response(send, status, content_type, headers)
+        await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+    async def send_json(self, send, status, data, headers=()):
+        await self.send_body(send, status, json.dumps(data, default=json_value).encode(), 'application/json', headers)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.client.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+# End of class
+
+
+def create_app(oc_address=None, oc_port=None):
+    # WebBackend for an ASGI server. Default OC: environment variables TSMREST_OC_ADDRESS, TSMREST_OC_PORT
+    oc_address = oc_address or os.environ.get('TSMREST_OC_ADDRESS', 'localhost')
+    oc_port = oc_port or os.environ.get('TSMREST_OC_PORT', '11090')
+    return WebBackend(AsyncTsmRest(oc_address, str(oc_port)))
+
+
+class ResponseWriter:
+    # ASGI 'send' of serve(): HTTP/1.1 response, chunked if the application sets no content-length
+
+    def __init__(self, writer, keep_alive):
+        self.writer = writer
+        self.keep_alive = keep_alive
+        self.started = False
+        self.finished = False
+        self.chunked = False
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            headers = list(message.get('headers', []))
+            self.chunked = not any(name.lower() == b'content-length' for name, value in headers)
+            if self.chunked:
+                headers.append((b'transfer-encoding', b'chunked'))
+            headers.append((b'connection', b'keep-alive' if self.keep_alive else b'close'))
+
+            lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}".encode()]
+            lines += [name + b': ' + value for name, value in headers]
+            self.writer.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+            self.started = True
+
+        elif message['type'] == 'http.response.body':
+            body = message.get('body', b'')
+            if self.chunked:
+                if body:
+                    self.writer.write(f"{len(body):x}\r\n".encode() + body + b'\r\n')
+                if not message.get('more_body', False):
+                    self.writer.write(b'0\r\n\r\n')
+            else:
+                self.writer.write(body)
+            if not message.get('more_body', False):
+                self.finished = True
+
+        # Backpressure: wait until the client has read enough of the response
+        await self.writer.drain()
+
+# End of class
+
+
+async def handle_connection(app, reader, writer, idle_timeout=60, max_request_bytes=65536):
+    # HTTP/1.1 connection of serve(): keep-alive, one request after the other
+    try:
+        while True:
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), idle_timeout)
+            except asyncio.TimeoutError:
+                break
+            if not request_line:
+                break
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) != 3:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            method, target, version = parts
+
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            header_map = dict(headers)
+
+            content_length = int(header_map.get(b'content-length', b'0') or 0)
+            if content_length > max_request_bytes:
+                writer.write(b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            body = await reader.readexactly(content_length) if content_length else b''
+
+            path, _, query_string = target.partition('?')
+            scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': version.split('/')[-1],
+                     'method': method.upper(), 'scheme': 'http', 'path': urllib.parse.unquote(path),
+                     'raw_path': path.encode('latin-1'), 'query_string': query_string.encode('latin-1'),
+                     'headers': headers, 'client': writer.get_extra_info('peername'),
+                     'server': writer.get_extra_info('sockname')}
+            keep_alive = version == 'HTTP/1.1' and header_map.get(b'connection', b'').lower() != b'close'
+
+            body_sent = False
+
+            async def receive():
+                nonlocal body_sent
+                if body_sent:
+                    return {'type': 'http.disconnect'}
+                body_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            response = ResponseWriter(writer, keep_alive)
+            try:
+                await app(scope, receive, response.send)
+            except Exception as e:
+                print(f"web_backend: {method} {path}: unhandled exception {type(e).__name__}: {e}")
+                if not response.started:
+                    await response.send({'type': 'http.response.start', 'status': 500,
+                                         'headers': [(b'content-length', b'0')]})
+                    await response.send({'type': 'http.response.body', 'body': b''})
+                break
+
+            if not response.finished or not keep_alive:
+                break
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass  # Client gone
+    finally:
+        writer.close()
+
+# End of function handle_connection()
+
+
+async def serve(app, host='127.0.0.1', port=8080, backlog=1024):
+    # Minimal HTTP/1.1 server for an ASGI application, in the running event loop (no extra packages)
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(app, reader, writer),
+                                        host, port, backlog=backlog)
+    async with server:
+        print(f"TsmRest web backend on http://{host}:{port}/api/command  (Ctrl-C to stop)")
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async HTTP backend for TsmRest")
+    parser.add_argument('--oc', default=os.environ.get('TSMREST_OC_ADDRESS', 'localhost'), help="OC address")
+    parser.add_argument('--oc-port', default=os.environ.get('TSMREST_OC_PORT', '11090'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-inflight', type=int, default=WebBackend.max_inflight)
+    parser.add_argument('--max-per-user', type=int, default=WebBackend.max_per_user)
+    args = parser.parse_args()
+
+    app = create_app(args.oc, args.oc_port)
+    app.max_inflight = args.max_inflight
+    app.max_per_user = args.max_per_user
+    try:
+        asyncio.run(serve(app, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()